@@ -2,25 +2,27 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 import arrow
 import click
 from rich.console import Console
-from rich.live import Live
 from rich.prompt import Confirm
 from rich.spinner import Spinner
 from rich.table import Table
 from rich.text import Text
 
+from ..utils import gh, gh_api, merge_check, ui
 from ..utils import pending_merge as pm_utils
-from ..utils import ui
 from ..utils.click import (
     DEFAULT_MAX_WORKERS,
     deprecated_option,
     global_command_decorators,
     jobs_option,
+    refresh_option,
 )
+from ..utils.progress import ProgressGrid
 
 console = Console()
 
@@ -56,6 +58,69 @@ def _resolve_repos(repo_paths):
     return list(repos.values())
 
 
+def _aggregate_repos(
+    repos,
+    push=True,
+    target_branch=None,
+    jobs=DEFAULT_MAX_WORKERS,
+    reuse=True,
+    locked=False,
+):
+    """Aggregate (and push) ``repos``, ``jobs`` at a time, following them on a
+    live grid. Exit with an error once they are all done if any of them failed.
+
+    With ``reuse``, the repos whose aggregation inputs did not change are not
+    aggregated again (see `pm_utils.Repo.rebuild_consolidation_branch`).
+    """
+    grid = ProgressGrid(
+        [
+            {"no_wrap": True},  # state dot / spinner
+            {},  # repo + outcome
+        ],
+        console=console,
+    )
+    # Shared by every row: a new one per row would not animate in sync
+    spinner = Spinner("dots")
+    for repo in repos:
+        outcome = Text(repo.path.as_posix(), no_wrap=True, overflow="ellipsis")
+        grid.set_row(repo, [spinner, outcome], status="pending")
+    failed = []
+    outputs = {}  # repo -> its captured output
+    with grid:
+        for repo, rebuilt, error, output in pm_utils.aggregate_repos(
+            repos,
+            push=push,
+            target_branch=target_branch,
+            max_workers=jobs,
+            reuse=reuse,
+            locked=locked,
+        ):
+            outputs[repo] = output
+            outcome = Text(repo.path.as_posix(), no_wrap=True, overflow="ellipsis")
+            if error is not None:
+                failed.append(repo)
+                # The last line of git's own output tells more than the command
+                stderr = getattr(error, "stderr", None) or b""
+                lines = stderr.decode(errors="replace").strip().splitlines()
+                outcome.append(f" {lines[-1] if lines else error}", style="red")
+                grid.set_row(repo, ["[red]?[/]", outcome], status="failed")
+            elif not rebuilt:
+                outcome.append(" unchanged", style="dim")
+                grid.set_row(repo, ["[green]●[/]", outcome], status="unchanged")
+            else:
+                outcome.append(" pushed" if push else " aggregated", style="green")
+                grid.set_row(repo, ["[green]●[/]", outcome], status="done")
+    # Grouped by repo, in the order of the grid
+    for repo in repos:
+        if outputs.get(repo):
+            console.line()
+            console.print(f"[bold]{repo.path.as_posix()}[/]")
+            ui.replay(outputs[repo])
+    if failed:
+        names = ", ".join(repo.name for repo in failed)
+        ui.exit_msg(f"Aggregation failed for {names}")
+
+
 @cli.command(name="show")
 @click.argument(
     "repo_paths",
@@ -77,81 +142,84 @@ def _resolve_repos(repo_paths):
     help="Output as JSON",
 )
 @jobs_option
+@refresh_option
 @deprecated_option(
     "--purge",
     message="`--purge` has been removed from `otools-pending show`. "
     "Use `otools-pending clean` instead.",
 )
-def show_pending(repo_paths=(), check=True, as_json=False, jobs=DEFAULT_MAX_WORKERS):
+def show_pending(
+    repo_paths=(),
+    check=True,
+    as_json=False,
+    jobs=DEFAULT_MAX_WORKERS,
+    refresh=False,
+):
     """List pull requests on <repo_path>."""
     repos = _resolve_repos(repo_paths)
     all_prs = [pr for repo in repos for pr in repo._iter_pending_pull_requests()]
     if check:
         ui.warn_missing_github_token()
-    # ids of PRs whose enrichment failed -> error message
-    errors: dict[int, str] = {}
-    # Shared by every row: a new one per rebuild would restart the animation
-    spinner = Spinner("dots")
+        gh_api.configure(pool_size=jobs)
     # In case of --json, output directly
     if as_json:
         if check:
-            with ThreadPoolExecutor(max_workers=jobs) as pool:
-                futures = {pool.submit(pr.enrich_with_github): pr for pr in all_prs}
-                for future in as_completed(futures):
-                    try:
-                        future.result()
-                    except Exception:
-                        # leave state as None in the JSON output
-                        pass
+            # A PR that failed is left with a None state in the JSON output
+            for __ in pm_utils.enrich_pull_requests(
+                all_prs, max_workers=jobs, refresh=refresh
+            ):
+                pass
         click.echo(json.dumps([pr.to_dict() for pr in all_prs], indent=2, default=str))
         return
 
-    def build_grid():
-        grid = Table.grid(padding=(0, 1))
-        grid.add_column(no_wrap=True)  # state dot / spinner
-        grid.add_column(no_wrap=True)  # shortcut (linked)
-        grid.add_column(no_wrap=True, style="dim")  # patch marker
-        grid.add_column()  # title
-        grid.add_column(no_wrap=True, justify="right", style="dim")  # last updated
-        for pr in all_prs:
-            if not check:
-                state_cell, updated, title = "-", "", ""
-            elif id(pr) in errors:
-                state_cell, updated = "[red]?[/]", ""
-                title = Text(
-                    errors[id(pr)], style="red", no_wrap=True, overflow="ellipsis"
-                )
-            elif not pr.is_enriched:
-                state_cell, updated, title = spinner, "", ""
-            else:
-                state = "merged" if pr.merged else pr.state
-                state_cell = f"[{PR_STATE_STYLES.get(state, 'white')}]●[/]"
-                updated = arrow.get(pr.updated_at).humanize() if pr.updated_at else ""
-                title = Text(pr.title or "", no_wrap=True, overflow="ellipsis")
-            grid.add_row(
+    grid = ProgressGrid(
+        [
+            {"no_wrap": True},  # state dot / spinner
+            {"no_wrap": True},  # shortcut (linked)
+            {"no_wrap": True, "style": "dim"},  # patch marker
+            {},  # title
+            {"no_wrap": True, "justify": "right", "style": "dim"},  # last updated
+        ],
+        console=console,
+    )
+    # Shared by every row: a new one per row would not animate in sync
+    spinner = Spinner("dots")
+
+    def show_row(pr, error=None):
+        if not check:
+            status, state_cell, updated, title = "", "-", "", ""
+        elif error is not None:
+            status, state_cell, updated = "failed", "[red]?[/]", ""
+            title = Text(str(error), style="red", no_wrap=True, overflow="ellipsis")
+        elif not pr.is_enriched:
+            status, state_cell, updated, title = "pending", spinner, "", ""
+        else:
+            status = "merged" if pr.merged else pr.state
+            state_cell = f"[{PR_STATE_STYLES.get(status, 'white')}]●[/]"
+            updated = arrow.get(pr.updated_at).humanize() if pr.updated_at else ""
+            title = Text(pr.title or "", no_wrap=True, overflow="ellipsis")
+        grid.set_row(
+            id(pr),
+            [
                 state_cell,
                 f"[link={pr.url}]{pr.shortcut}[/link]",
                 "(patch)" if pr.is_patch else "",
                 title,
                 updated,
-            )
-        return grid
+            ],
+            status=status,
+        )
 
+    for pr in all_prs:
+        show_row(pr)
     if check and all_prs:
-        with (
-            Live(build_grid(), console=console, refresh_per_second=10) as live,
-            ThreadPoolExecutor(max_workers=jobs) as pool,
-        ):
-            futures = {pool.submit(pr.enrich_with_github): pr for pr in all_prs}
-            for future in as_completed(futures):
-                pr = futures[future]
-                try:
-                    future.result()
-                except Exception as exc:
-                    errors[id(pr)] = str(exc)
-                live.update(build_grid())
+        with grid:
+            for pr, error in pm_utils.enrich_pull_requests(
+                all_prs, max_workers=jobs, refresh=refresh
+            ):
+                show_row(pr, error)
     else:
-        console.print(build_grid())
+        grid.print()
 
 
 @cli.command(name="clean")
@@ -169,70 +237,71 @@ def show_pending(repo_paths=(), check=True, as_json=False, jobs=DEFAULT_MAX_WORK
     "If not set, you will be prompted once.",
 )
 @jobs_option
-def clean_pending(repo_paths=(), aggregate=None, jobs=DEFAULT_MAX_WORKERS):
+@refresh_option
+def clean_pending(
+    repo_paths=(), aggregate=None, jobs=DEFAULT_MAX_WORKERS, refresh=False
+):
     """Remove merged pull requests from pending-merge files."""
     repos = _resolve_repos(repo_paths)
     all_prs = [pr for repo in repos for pr in repo._iter_pending_pull_requests()]
     if not all_prs:
         return
     ui.warn_missing_github_token()
+    gh_api.configure(pool_size=jobs)
     touched_repos: set[pm_utils.Repo] = set()
-    removed: set[int] = set()  # ids of PRs removed from their merges file
-    # ids of PRs whose enrichment failed -> error message
-    errors: dict[int, str] = {}
-    # Shared by every row: a new one per rebuild would restart the animation
+    grid = ProgressGrid(
+        [
+            {"no_wrap": True},  # state dot / spinner
+            {"no_wrap": True},  # shortcut (linked)
+            {"no_wrap": True, "style": "dim"},  # patch marker
+            {},  # outcome
+        ],
+        console=console,
+    )
+    # Shared by every row: a new one per row would not animate in sync
     spinner = Spinner("dots")
 
-    def build_grid():
-        grid = Table.grid(padding=(0, 1))
-        grid.add_column(no_wrap=True)  # state dot / spinner
-        grid.add_column(no_wrap=True)  # shortcut (linked)
-        grid.add_column(no_wrap=True, style="dim")  # patch marker
-        grid.add_column()  # outcome
-        for pr in all_prs:
-            if id(pr) in errors:
-                state_cell = "[red]?[/]"
-                outcome = Text(
-                    errors[id(pr)], style="red", no_wrap=True, overflow="ellipsis"
-                )
-            elif not pr.is_enriched:
-                state_cell, outcome = spinner, ""
-            elif id(pr) in removed:
-                state = "merged" if pr.merged else pr.state
-                state_cell = f"[{PR_STATE_STYLES.get(state, 'white')}]●[/]"
-                outcome = Text("removed", style="green")
-            else:
-                continue  # enriched but not removed — nothing to do here
-            grid.add_row(
+    def show_row(pr, status, state_cell, outcome):
+        grid.set_row(
+            id(pr),
+            [
                 state_cell,
                 f"[link={pr.url}]{pr.shortcut}[/link]",
                 "(patch)" if pr.is_patch else "",
                 outcome,
-            )
-        return grid
-
-    # Enrich every PR via the GitHub API in parallel; remove the merged ones
-    # from the merges file as soon as we know the verdict, on the main thread
-    # (so concurrent yaml edits stay race-free).
-    with (
-        Live(build_grid(), console=console, refresh_per_second=10) as live,
-        ThreadPoolExecutor(max_workers=jobs) as pool,
-    ):
-        futures = {pool.submit(pr.enrich_with_github): pr for pr in all_prs}
-        for future in as_completed(futures):
-            pr = futures[future]
-            try:
-                future.result()
-            except Exception as exc:
+            ],
+            status=status,
+        )
+
+    for pr in all_prs:
+        show_row(pr, "pending", spinner, "")
+    # Enrich every PR via the GitHub API, in batches, unless its repo's history
+    # shows it merged; remove the merged ones from the merges file as soon as
+    # we know the verdict, on the main thread (so concurrent yaml edits stay
+    # race-free). Each file is written once, with all its removals.
+    with ExitStack() as transactions, grid:
+        for repo in repos:
+            transactions.enter_context(repo.transaction())
+        for pr, error in pm_utils.enrich_pull_requests(
+            all_prs, max_workers=jobs, refresh=refresh, from_history=True
+        ):
+            if error is not None:
                 # Leave the PR in place; we can't tell if it was merged.
-                errors[id(pr)] = str(exc)
-                live.update(build_grid())
+                outcome = Text(
+                    str(error), style="red", no_wrap=True, overflow="ellipsis"
+                )
+                show_row(pr, "failed", "[red]?[/]", outcome)
                 continue
             if pr.merged:
                 pr.remove_from_merges_file()
                 touched_repos.add(pr._repo)
-                removed.add(id(pr))
-            live.update(build_grid())
+                style = PR_STATE_STYLES["merged"]
+                show_row(
+                    pr, "removed", f"[{style}]●[/]", Text("removed", style="green")
+                )
+            else:
+                # Nothing to do about it
+                grid.remove_row(id(pr))
     # Dispose of the merges files left without any pending merge, and keep the
     # rest for re-aggregation.
     to_aggregate = []
@@ -255,9 +324,7 @@ def clean_pending(repo_paths=(), aggregate=None, jobs=DEFAULT_MAX_WORKERS):
         )
     if not aggregate:
         return
-    for repo in to_aggregate:
-        repo.run_aggregate()
-        repo.push_to_remote()
+    _aggregate_repos(to_aggregate, jobs=jobs)
 
 
 @cli.command(name="aggregate")
@@ -275,12 +342,154 @@ def clean_pending(repo_paths=(), aggregate=None, jobs=DEFAULT_MAX_WORKERS):
     default=True,
     help="push the result of the aggregation to a remote branch",
 )
-def aggregate(repo_paths, target_branch=None, push=None):
+@click.option(
+    "--locked",
+    "locked",
+    is_flag=True,
+    default=False,
+    help="aggregate the commits recorded in the lock file of each repo",
+)
+@jobs_option
+def aggregate(
+    repo_paths, target_branch=None, push=None, locked=False, jobs=DEFAULT_MAX_WORKERS
+):
     """Perform a git aggregation on each <repo_path>."""
-    for repo in _resolve_repos(repo_paths):
-        repo.run_aggregate()
-        if push:
-            repo.push_to_remote(target_branch=target_branch)
+    repos = _resolve_repos(repo_paths)
+    if repos:
+        # Asked for explicitly: rebuilt whatever the last aggregation was
+        _aggregate_repos(
+            repos,
+            push=push,
+            target_branch=target_branch,
+            jobs=jobs,
+            reuse=False,
+            locked=locked,
+        )
+
+
+def _lock_changes(repo):
+    """Return the changes to the lock file of ``repo`` (see
+    `Repo.lock_changes`), and the error that prevented resolving them."""
+    try:
+        return repo.lock_changes(), None
+    except click.ClickException as exc:
+        return None, exc.format_message()
+
+
+@cli.command(name="outdated")
+@click.argument(
+    "repo_paths",
+    required=False,
+    nargs=-1,
+)
+@jobs_option
+def outdated(repo_paths=(), jobs=DEFAULT_MAX_WORKERS):
+    """List the commits of the lock files that moved since they were written.
+
+    The remotes are asked with one `git ls-remote` each: nothing is fetched.
+    """
+    repos = [repo for repo in _resolve_repos(repo_paths) if repo.abs_lock_path.exists()]
+    if not repos:
+        ui.echo("No lock file")
+        return
+    table = Table.grid(padding=(0, 1))
+    table.add_column(no_wrap=True)  # repo
+    table.add_column(no_wrap=True)  # ref
+    table.add_column(no_wrap=True, style="dim")  # remote
+    table.add_column(no_wrap=True)  # locked -> current
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for repo, (changes, error) in zip(
+            repos, pool.map(_lock_changes, repos), strict=True
+        ):
+            if error:
+                table.add_row(repo.name, "[red]unresolved[/]", "", error)
+            for url, ref, locked_sha, current_sha in changes or []:
+                table.add_row(
+                    repo.name,
+                    ref,
+                    url,
+                    f"{(locked_sha or 'new')[:8]} → "
+                    f"[yellow]{(current_sha or 'gone')[:8]}[/]",
+                )
+    if table.row_count:
+        console.print(table)
+    else:
+        ui.echo("All lock files are up to date")
+
+
+def _print_merge_check(check):
+    console.print(f"[bold]{check.repo.name}[/]")
+    for label in check.missing:
+        console.print(f"  [red]missing[/] {label}")
+    if check.first_conflict:
+        label, paths = check.first_conflict
+        console.print(f"  [red]aggregation stops at[/] {label}: {', '.join(paths)}")
+    for label, paths in check.base_conflicts:
+        console.print(
+            f"  [yellow]conflicts with the base[/] {label}: {', '.join(paths)}"
+        )
+    for first, second, paths in check.pair_conflicts:
+        console.print(
+            f"  [yellow]conflict[/] {first} [yellow]with[/] {second}: "
+            f"{', '.join(paths)}"
+        )
+
+
+@cli.command(name="check")
+@click.argument(
+    "repo_paths",
+    required=False,
+    nargs=-1,
+)
+@jobs_option
+def check(repo_paths=(), jobs=DEFAULT_MAX_WORKERS):
+    """Tell which pending merges conflict, without aggregating.
+
+    The merges of each repo are fetched, then merged in the object database
+    with `git merge-tree`: in order, as the aggregation would, then each one
+    onto the base and each pair of them, to find the culprits.
+    """
+    repos = _resolve_repos(repo_paths)
+    if not repos:
+        ui.echo("No pending merges")
+        return
+    grid = ProgressGrid([{"no_wrap": True}, {}], console=console)
+    spinner = Spinner("dots")
+    for repo in repos:
+        outcome = Text(repo.path.as_posix(), no_wrap=True, overflow="ellipsis")
+        grid.set_row(repo, [spinner, outcome], status="pending")
+    checks = {}
+    failed = []
+    with grid:
+        for repo, repo_check, error in merge_check.check_repos(repos, jobs):
+            outcome = Text(repo.path.as_posix(), no_wrap=True, overflow="ellipsis")
+            if error is not None:
+                failed.append(repo)
+                outcome.append(f" {error}", style="red")
+                grid.set_row(repo, ["[red]?[/]", outcome], status="failed")
+                continue
+            assert repo_check is not None
+            checks[repo] = repo_check
+            if not repo_check.ok:
+                failed.append(repo)
+                outcome.append(" conflicts", style="red")
+                grid.set_row(repo, ["[red]●[/]", outcome], status="conflicts")
+            elif repo_check.base_conflicts or repo_check.pair_conflicts:
+                outcome.append(" merges in order only", style="yellow")
+                grid.set_row(repo, ["[yellow]●[/]", outcome], status="ordered")
+            else:
+                outcome.append(" ok", style="green")
+                grid.set_row(repo, ["[green]●[/]", outcome], status="ok")
+    # In the order of the grid
+    for repo in repos:
+        repo_check = checks.get(repo)
+        if repo_check and (
+            not repo_check.ok or repo_check.base_conflicts or repo_check.pair_conflicts
+        ):
+            _print_merge_check(repo_check)
+    if failed:
+        names = ", ".join(repo.name for repo in failed)
+        ui.exit_msg(f"Pending merges don't aggregate for {names}")
 
 
 @cli.command(name="add")
@@ -307,7 +516,10 @@ def aggregate(repo_paths, target_branch=None, push=None):
     default=True,
     help="push the result of the aggregation to a remote branch",
 )
-def add_pending(entity_urls, aggregate=True, patch=False, push=True):
+@jobs_option
+def add_pending(
+    entity_urls, aggregate=True, patch=False, push=True, jobs=DEFAULT_MAX_WORKERS
+):
     """Add one or more pending merges using the given entity link(s)"""
     # pattern, given an https://github.com/<user>/<repo>/pull/<pr-index>
     # # PR headline
@@ -315,17 +527,21 @@ def add_pending(entity_urls, aggregate=True, patch=False, push=True):
     # - refs/pull/<pr-index>/head
     # Add every pending merge to its file first, without aggregating, and
     # collect the affected repos deduplicated by their merges file so that a
-    # submodule referenced by several URLs is aggregated only once.
+    # submodule referenced by several URLs is aggregated only once. Each file
+    # is written once, with all its additions.
     repos = {}
-    for entity_url in entity_urls:
-        repo = pm_utils.add_pending(entity_url, aggregate=False, patch=patch)
-        repos[repo.abs_merges_path] = repo
+    with ExitStack() as transactions:
+        for entity_url in entity_urls:
+            repo = pm_utils.Repo(
+                gh.parse_github_url(entity_url)["repo_name"], path_check=False
+            )
+            if repo.abs_merges_path not in repos:
+                transactions.enter_context(repo.transaction())
+            pm_utils.add_pending(entity_url, aggregate=False, patch=patch)
+            repos[repo.abs_merges_path] = repo
     # Then aggregate each affected submodule once.
     if aggregate:
-        for repo in repos.values():
-            repo.run_aggregate()
-            if push:
-                repo.push_to_remote()
+        _aggregate_repos(list(repos.values()), push=push, jobs=jobs)
 
 
 @cli.command(name="remove")
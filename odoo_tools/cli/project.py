@@ -4,13 +4,15 @@
 import os
 import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import click
 import jinja2
 from git import Repo as GitRepo
 
-from ..utils import git, ui
-from ..utils.click import global_command_decorators
+from ..utils import git, odoo_store, os_exec, ui
+from ..utils.click import DEFAULT_MAX_WORKERS, global_command_decorators, jobs_option
 from ..utils.config import PROJ_CFG_FILE, config
 from ..utils.misc import (
     SmartDict,
@@ -220,6 +222,55 @@ def init(**kw):
     bootstrap_files(SmartDict(kw))
 
 
+def _apply_patch(patch, target):
+    """Apply ``patch`` on the repository in ``target``, relative to the project."""
+    ui.echo(f"Applying patch {patch.name} to {target}")
+    target_repo = GitRepo(build_path(target))
+    target_repo.git.am("--3way", patch)
+
+
+def _run_concurrently(pipelines, max_workers=DEFAULT_MAX_WORKERS):
+    """Run ``pipelines``, a list of steps (callables) by label, concurrently.
+
+    The steps of a pipeline run one after the other, and what they print,
+    the output of their git commands included, is prefixed with the label of
+    the pipeline. Once a step fails, or on interruption, the other pipelines
+    stop: their running git command is terminated (see `os_exec.CancelScope`)
+    and their next steps are skipped, then the first error is raised.
+    """
+    scope = os_exec.CancelScope()
+
+    def run_pipeline(label, steps):
+        with ui.label_output(label), scope.enter():
+            for step in steps:
+                if scope.is_cancelled():
+                    ui.echo("Cancelled", fg="yellow")
+                    return
+                try:
+                    step()
+                except BaseException:
+                    if scope.is_cancelled():
+                        # Stopped because of the failure of another pipeline
+                        ui.echo("Cancelled", fg="yellow")
+                        return
+                    scope.cancel()
+                    raise
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pipelines))) as pool:
+        futures = [
+            pool.submit(run_pipeline, label, steps)
+            for label, steps in pipelines.items()
+        ]
+        try:
+            errors = [future.exception() for future in futures]
+        except BaseException:
+            scope.cancel()
+            raise
+    for error in errors:
+        if error is not None:
+            raise error
+
+
 @cli.command()
 @click.option(
     "--odoo-hash",
@@ -243,8 +294,32 @@ def init(**kw):
     default=".venv",
     help="Directory to use for the virtualenv",
 )
+@click.option(
+    "--clone-mode",
+    type=click.Choice(git.CLONE_MODES),
+    default="full",
+    show_default=True,
+    help="How to clone odoo and enterprise when they are not checked out yet:"
+    " 'blobless' fetches the history without the file contents, 'shallow' only"
+    " the commit to check out (see `deepen-local-odoo` to get more history)."
+    " Ignored when git-autoshare is set up.",
+)
+@click.option(
+    "--store/--no-store",
+    default=False,
+    help="Link src/odoo and src/enterprise to checkouts of a store shared by"
+    " all the projects, in the otools cache, instead of checking them out in the"
+    " project. Switching back to commits already checked out is then instant.",
+)
+@jobs_option
 def checkout_local_odoo(
-    odoo_hash=None, enterprise_hash=None, venv=False, venv_path=".venv"
+    odoo_hash=None,
+    enterprise_hash=None,
+    venv=False,
+    venv_path=".venv",
+    clone_mode="full",
+    store=False,
+    jobs=DEFAULT_MAX_WORKERS,
 ):
     """checkout odoo core and odoo enterprise in the working directory
 
@@ -258,6 +333,14 @@ def checkout_local_odoo(
     This will setup or update a virtual environment in the directory with the required tools installed to run Odoo
     locally (you will still need docker to get the correct versions of the source code, unless you pass the hashes
     on the command line).
+
+    Odoo core and enterprise are checked out concurrently (unless `--jobs 1`),
+    each one getting its patches as soon as it is ready. The result of the
+    patches is kept in each repository: a series applied before is only
+    checked out again.
+
+    With `--store`, the checkouts are shared with the other projects: see the
+    `OTOOLS_ODOO_STORE_BUDGET` environment variable to bound their disk usage.
     """
     # TODO: proj_tmpl_ver=2 is deprecated (this command is v2-only)
     if config.template_version == 1:
@@ -268,28 +351,56 @@ def checkout_local_odoo(
         image_odoo_hash, image_enterprise_hash = get_docker_image_commit_hashes()
         odoo_hash = odoo_hash or image_odoo_hash
         enterprise_hash = enterprise_hash or image_enterprise_hash
-    if odoo_hash:
-        git.get_odoo_core(odoo_hash, dest=odoo_src_dest)
-    else:
+    if not odoo_hash:
         ui.exit_msg("Unable to find the commit hash of odoo core")
-
-    if enterprise_hash:
-        git.get_odoo_enterprise(enterprise_hash, dest=enterprise_src_dest)
-    else:
+    if not enterprise_hash:
         ui.exit_msg("Unable to find the commit hash of odoo enterprise")
 
     # Apply odoo/enterprise patches
     # This matches the behavior of the `001_apply_patches` script in the odoo-template
     # https://github.com/camptocamp/odoo-template/blob/99931bbc/%7B%7Bcookiecutter.repo_name%7D%7D/build.d/001_apply_patches
     patches_dir = build_path("./patches")
+    patches = []
     if patches_dir.is_dir():
-        for patch in patches_dir.glob("**/*.patch"):
-            patch_target = (
-                config.odoo_src_rel_path / patch.relative_to(patches_dir).parent
-            )
-            ui.echo(f"Applying patch {patch.name} to {patch_target}")
-            target_repo = GitRepo(build_path(patch_target))
-            target_repo.git.am("--3way", patch)
+        patches = sorted(patches_dir.glob("**/*.patch"))
+
+    def checkout_steps(repo, ref, dest):
+        """The steps checking ``ref`` of odoo/``repo`` out in ``dest``, and
+        applying its patches."""
+        repo_patches = [
+            patch for patch in patches if patch.parent == patches_dir / dest.name
+        ]
+        if store:
+            # Patches are applied once, when the store checks the commit out
+            def checkout():
+                worktree = odoo_store.checkout("odoo", repo, ref, patches=repo_patches)
+                odoo_store.link(build_path(dest), worktree)
+
+            return [checkout]
+        get_repo = git.get_odoo_core if repo == "odoo" else git.get_odoo_enterprise
+        return [
+            partial(get_repo, ref, dest=dest, mode=clone_mode),
+            partial(git.apply_patches, build_path(dest), ref, repo_patches),
+        ]
+
+    _run_concurrently(
+        {
+            "odoo": checkout_steps("odoo", odoo_hash, odoo_src_dest),
+            "enterprise": checkout_steps(
+                "enterprise", enterprise_hash, enterprise_src_dest
+            ),
+        },
+        max_workers=jobs,
+    )
+    # Patches of any other directory, nested ones included (`patches/odoo/x/`)
+    repos_patches_dirs = (
+        patches_dir / odoo_src_dest.name,
+        patches_dir / enterprise_src_dest.name,
+    )
+    for patch in patches:
+        if patch.parent not in repos_patches_dirs:
+            target = patch.relative_to(patches_dir).parent
+            _apply_patch(patch, config.odoo_src_rel_path / target)
 
     if venv:
         setup_venv(venv_path)
@@ -311,5 +422,24 @@ docker compose run --rm odoo pip install --user -e /odoo/src/odoo
 """)
 
 
+@cli.command()
+@click.option(
+    "--depth",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of commits of history to add. The whole history is fetched"
+    " when omitted.",
+)
+def deepen_local_odoo(depth=None):
+    """Fetch more history in shallow checkouts of odoo core and enterprise
+
+    Meant for checkouts made by `checkout-local-odoo --clone-mode shallow`.
+    """
+    for name in ("odoo", "enterprise"):
+        dest = build_path(config.odoo_src_rel_path / name)
+        if dest.is_dir():
+            git.deepen_repo(dest, depth=depth)
+
+
 if __name__ == "__main__":
     cli()
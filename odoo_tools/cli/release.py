@@ -6,10 +6,8 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import click
 from git import Repo as GitRepo
 from rich.console import Console
-from rich.live import Live
 from rich.prompt import Confirm
 from rich.spinner import Spinner
-from rich.table import Table
 from rich.text import Text
 
 from ..exceptions import ProjectConfigException
@@ -21,6 +19,7 @@ from ..utils.marabunta import MarabuntaFileHandler
 from ..utils.os_exec import run
 from ..utils.path import build_path
 from ..utils.pending_merge import Repo, make_merge_branch_name
+from ..utils.progress import ProgressGrid
 from ..utils.proj import get_current_version, get_project_bundle_addon_name
 
 console = Console()
@@ -187,44 +186,35 @@ def _push_aggregated_branches(
     if not repos:
         ui.echo("No repo to push")
         return
-    states = {}  # repo -> "done" | error message
-    # Shared by every row: a new one per rebuild would restart the animation
+    grid = ProgressGrid(
+        [
+            {"no_wrap": True},  # state dot / spinner
+            {},  # repo + outcome
+        ],
+        console=console,
+    )
+    # Shared by every row: a new one per row would not animate in sync
     spinner = Spinner("dots")
+    for repo in repos:
+        outcome = Text(repo.path.as_posix(), no_wrap=True, overflow="ellipsis")
+        grid.set_row(repo, [spinner, outcome], status="pending")
 
-    def build_grid():
-        grid = Table.grid(padding=(0, 1))
-        grid.add_column(no_wrap=True)  # state dot / spinner
-        grid.add_column()  # repo + outcome
-        for repo in repos:
-            state = states.get(repo)
-            outcome = Text(repo.path.as_posix(), no_wrap=True, overflow="ellipsis")
-            if state is None:
-                state_cell = spinner
-            elif state == "done":
-                state_cell = "[green]●[/]"
-                outcome.append(f" pushed {branch_name}", style="green")
-            else:
-                state_cell = "[red]?[/]"
-                outcome.append(f" {state}", style="red")
-            grid.add_row(state_cell, outcome)
-        return grid
-
-    with (
-        Live(build_grid(), console=console, refresh_per_second=10) as live,
-        ThreadPoolExecutor(max_workers=max_workers) as pool,
-    ):
+    with grid, ThreadPoolExecutor(max_workers=max_workers) as pool:
         futures = {
             pool.submit(_push_repo_branch, repo, branch_name, company_git_remote): repo
             for repo in repos
         }
         for future in as_completed(futures):
             repo = futures[future]
+            outcome = Text(repo.path.as_posix(), no_wrap=True, overflow="ellipsis")
             try:
                 future.result()
-                states[repo] = "done"
             except Exception as exc:
-                states[repo] = str(exc)
-            live.update(build_grid())
+                outcome.append(f" {exc}", style="red")
+                grid.set_row(repo, ["[red]?[/]", outcome], status="failed")
+            else:
+                outcome.append(f" pushed {branch_name}", style="green")
+                grid.set_row(repo, ["[green]●[/]", outcome], status="pushed")
 
 
 @click.group()
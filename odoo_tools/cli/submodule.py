@@ -1,10 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from itertools import chain
 
 import click
+from rich.console import Console
+from rich.spinner import Spinner
+from rich.text import Text
 
-from ..utils import git, path, proj, ui
+from ..utils import gh, git, path, proj, ui
 from ..utils import pending_merge as pm_utils
-from ..utils.click import global_command_decorators
+from ..utils.click import (
+    DEFAULT_MAX_WORKERS,
+    global_command_decorators,
+    jobs_option,
+    refresh_option,
+)
+from ..utils.gitmodules import load_gitmodules
+from ..utils.progress import ProgressGrid
+
+console = Console()
 
 
 @click.group()
@@ -13,9 +26,104 @@ def cli():
     pass
 
 
+def remote_probe_options(func):
+    """Options driving the probes of the OCA and company repositories, see
+    `git.remote_repo_exists`."""
+    func = click.option(
+        "--refresh-remotes",
+        is_flag=True,
+        default=False,
+        help="Forget which OCA and company repositories are known to exist or to"
+        " be missing, and probe them again.",
+    )(func)
+    func = click.option(
+        "--github-api/--no-github-api",
+        default=False,
+        help="Look up which OCA and company repositories exist with batched"
+        " GitHub API queries rather than one `git ls-remote` each. Requires a"
+        " GITHUB_TOKEN. The repositories it does not find, e.g. private ones"
+        " the token cannot read, are still probed with `git ls-remote`.",
+    )(func)
+    return func
+
+
+def _update_submodules(
+    submodules, max_workers=DEFAULT_MAX_WORKERS, refresh_remotes=False, github_api=False
+):
+    """Update ``submodules``, ``max_workers`` at a time.
+
+    Each submodule goes through its whole `git.submodule_update` pipeline on a
+    worker thread. The messages of each pipeline are collected and printed
+    once they are all done, grouped by submodule, while a live grid shows the
+    progress. A failing submodule does not stop the other ones.
+
+    The submodules are registered beforehand, in one go, so that the
+    pipelines never have to write the superproject's configuration. Their
+    recorded commits are looked up in one go as well, and the repositories
+    they may add as remotes are all probed beforehand.
+    """
+    if not submodules:
+        return
+    paths = [submodule.path for submodule in submodules]
+    git.submodule_sync(*paths)
+    git.submodule_register(*paths)
+    pinned_shas = git.get_pinned_shas(*paths)
+    if refresh_remotes:
+        git.remote_repo_cache.invalidate()
+    git.prefetch_submodule_remotes(
+        submodules,
+        max_workers=max_workers,
+        batch_lookup=gh.remote_repos_exist if github_api else None,
+    )
+    failed = []
+    outputs = {}  # submodule path -> messages collected by ui.capture_output
+    grid = ProgressGrid(
+        [
+            {"no_wrap": True},  # state dot / spinner
+            {},  # submodule path + outcome
+        ],
+        console=console,
+    )
+    # Shared by every row: a new one per row would not animate in sync
+    spinner = Spinner("dots")
+    for submodule_path in paths:
+        outcome = Text(submodule_path, no_wrap=True, overflow="ellipsis")
+        grid.set_row(submodule_path, [spinner, outcome], status="pending")
+
+    def update(submodule):
+        with ui.capture_output() as output:
+            outputs[submodule.path] = output
+            git.submodule_update(submodule.path, pinned_shas=pinned_shas)
+
+    with grid, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(update, submodule): submodule for submodule in submodules
+        }
+        for future in as_completed(futures):
+            submodule = futures[future]
+            outcome = Text(submodule.path, no_wrap=True, overflow="ellipsis")
+            try:
+                future.result()
+            except Exception as exc:
+                failed.append(submodule.path)
+                outcome.append(f" {exc}", style="red")
+                grid.set_row(submodule.path, ["[red]?[/]", outcome], status="failed")
+            else:
+                outcome.append(" updated", style="green")
+                grid.set_row(submodule.path, ["[green]●[/]", outcome], status="updated")
+    if any(outputs.values()):
+        console.line()
+    for submodule_path in paths:
+        ui.replay(outputs.get(submodule_path, []))
+    if failed:
+        ui.exit_msg(f"Failed to update {', '.join(failed)}")
+
+
 @cli.command()
+@jobs_option
+@remote_probe_options
 @click.pass_context
-def init(ctx):
+def init(ctx, jobs=DEFAULT_MAX_WORKERS, refresh_remotes=False, github_api=False):
     """Add git submodules read in the .gitmodules files.
 
     Allows to edit the .gitmodules file, add all the repositories and
@@ -23,10 +131,22 @@ def init(ctx):
 
     It means less 'git submodule add -b ... {url} {path}' commands to run
 
+    The submodules already present are updated in parallel, while the new
+    ones are added one at a time: adding a submodule edits the index and the
+    .gitmodules file, which can't be done concurrently.
     """
-    with path.cd(path.root_path()):
-        for submodule in git.iter_gitmodules():
-            git.submodule_init(submodule)
+    to_update = []
+    for submodule in git.iter_gitmodules():
+        if submodule.exists:
+            to_update.append(submodule)
+        else:
+            git.submodule_add(submodule)
+    _update_submodules(
+        to_update,
+        max_workers=jobs,
+        refresh_remotes=refresh_remotes,
+        github_api=github_api,
+    )
 
     ui.echo("Submodules initialized.")
     ui.echo("")
@@ -47,7 +167,7 @@ def ls(dockerfile=False):
     It can be used to directly copy-paste the addons paths in the Dockerfile.
     The order depends of the order in the .gitmodules file.
     """
-    submodules = (submodule.path for submodule in git.iter_gitmodules())
+    submodules = (submodule.path for submodule in load_gitmodules())
     if dockerfile:
         blacklist = {"odoo/src"}
         lines = (f"odoo/{line}" for line in submodules if line not in blacklist)
@@ -71,22 +191,35 @@ def ls(dockerfile=False):
 
 @cli.command()
 @click.argument("submodule_path", default="")
-def update(submodule_path=None):
+@jobs_option
+@remote_probe_options
+def update(
+    submodule_path=None,
+    jobs=DEFAULT_MAX_WORKERS,
+    refresh_remotes=False,
+    github_api=False,
+):
     """Initialize or update submodules
 
     Synchronize submodules and then launch `git submodule update --init`
-    for each submodule.
+    for each submodule. The submodules are updated in parallel, see `--jobs`.
 
     If `git-autoshare` is configured locally, it will add `--reference` to
     fetch data from local cache.
 
+    Whether the OCA and company forks of each submodule exist is remembered
+    for a few days, see `--refresh-remotes`.
+
     :param submodule_path: submodule path for a precise sync & update
 
     """
-    with path.cd(path.root_path()):
-        for submodule in git.iter_gitmodules(filter_path=submodule_path):
-            git.submodule_sync(submodule.path)
-            git.submodule_update(submodule.path)
+    submodules = list(git.iter_gitmodules(filter_path=submodule_path))
+    _update_submodules(
+        submodules,
+        max_workers=jobs,
+        refresh_remotes=refresh_remotes,
+        github_api=github_api,
+    )
 
 
 @cli.command()
@@ -169,7 +302,8 @@ def push(submodule_path, target_branch=None):
     " pending merges. This is the default behavior. With --no-aggregate, those"
     " submodules are skipped.",
 )
-def upgrade(submodule_path, force_branch, clean_pending, aggregate):
+@refresh_option
+def upgrade(submodule_path, force_branch, clean_pending, aggregate, refresh=False):
     """Upgrade submodules to their latest remote commit.
 
     For submodules with pending merges, purge merged PRs first and
@@ -184,21 +318,32 @@ def upgrade(submodule_path, force_branch, clean_pending, aggregate):
     # Resolved lazily on the first push, then reused for the other submodules.
     target_branch = None
     with path.cd(path.root_path()):
-        for submodule in git.iter_gitmodules(filter_path=submodule_path):
-            repo = pm_utils.Repo(submodule.path, path_check=False)
-            if repo.has_pending_merges() and clean_pending:
-                ui.echo(f"Purging merged PRs for {submodule.path}")
-                for pr in repo.purge_merged_prs():
-                    ui.echo(f"  removed {pr.shortcut}")
+        # All looked up at once, for the submodules upgraded below
+        pinned_shas = git.get_pinned_shas()
+        submodules = list(git.iter_gitmodules(filter_path=submodule_path))
+        repos = {
+            submodule.path: pm_utils.Repo(submodule.path, path_check=False)
+            for submodule in submodules
+        }
+        to_purge = [repo for repo in repos.values() if repo.has_pending_merges()]
+        if clean_pending and to_purge:
+            # The merged PRs of every submodule, looked up concurrently
+            names = ", ".join(str(repo.path) for repo in to_purge)
+            ui.echo(f"Purging merged PRs for {names}")
+            for pr in pm_utils.purge_merged_prs_of(to_purge, refresh=refresh):
+                ui.echo(f"  removed {pr.shortcut}")
+        for submodule in submodules:
+            repo = repos[submodule.path]
             if repo.has_pending_merges():
                 if not aggregate:
                     ui.echo(f"Skipping {submodule.path}: it has pending merges")
                     continue
                 ui.echo(f"Rebuilding consolidation branch for {submodule.path}")
                 target_branch = target_branch or pm_utils.gh.get_target_branch()
-                repo.rebuild_consolidation_branch(
+                if not repo.rebuild_consolidation_branch(
                     push=True, target_branch=target_branch
-                )
+                ):
+                    ui.echo("  unchanged since the last aggregation, not pushed")
                 continue
             # No pending merges: upgrade to latest remote
             branch = force_branch
@@ -210,12 +355,18 @@ def upgrade(submodule_path, force_branch, clean_pending, aggregate):
                 if not ui.ask_confirmation(f"Upgrade {submodule.path} anyway?"):
                     continue
             try:
-                git.submodule_update(submodule.path)
-                git.submodule_upgrade(submodule.path, submodule.url, branch=branch)
+                git.submodule_update(submodule.path, pinned_shas=pinned_shas)
+                # Checked out at its recorded commit by the update
+                git.submodule_upgrade(
+                    submodule.path,
+                    submodule.url,
+                    branch=branch,
+                    commit_before=pinned_shas.get(str(submodule.path)),
+                )
             except Exception as e:
                 ui.echo(f"ERROR upgrading {submodule.path}: {e}", fg="red")
                 ui.echo(f"Rolling back {submodule.path}")
-                git.submodule_update(submodule.path)
+                git.submodule_update(submodule.path, pinned_shas=pinned_shas)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""Run git-aggregator in process, on a merges config already loaded.
+
+Each ``gitaggregate`` command pays for a Python interpreter, its imports, and
+parsing again the YAML file otools already has: it adds up when many repos are
+aggregated. `aggregate` drives git-aggregator's library API instead, and tells
+how long each phase took.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+from git_aggregator.config import get_repos
+from git_aggregator.repo import Repo as AggregatorRepo
+
+from . import ssh, ui
+from .os_exec import get_venv
+
+logger = logging.getLogger(__name__)
+
+#: Set to ``0`` to aggregate with the ``gitaggregate`` command instead
+IN_PROCESS_ENV_VAR = "OTOOLS_AGGREGATE_IN_PROCESS"
+#: The phases of an aggregation timed by `aggregate`
+PHASES = ("fetch", "merge", "shell_command_after")
+
+
+def is_enabled() -> bool:
+    return os.getenv(IN_PROCESS_ENV_VAR, "1") != "0"
+
+
+class _EchoFilter(logging.Filter):
+    """Print the records of git-aggregator with `ui.echo`, as the
+    ``gitaggregate`` command would: when several repos are aggregated at the
+    same time, each one's are then captured with its output (see
+    `ui.capture_output`), instead of interleaving on the terminal."""
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            ui.echo(record.getMessage(), fg="yellow")
+        else:
+            ui.echo(record.getMessage(), fg="bright_black")
+        return False
+
+
+_ECHO_LOGGERS = ("git_aggregator.repo", "git_aggregator.utils", "git_aggregator.config")
+_echo_filter = _EchoFilter()
+_echo_lock = threading.Lock()
+# How many aggregations are running, and the level to restore after the last
+_echo_users = 0
+_echo_saved_level = logging.NOTSET
+
+
+@contextmanager
+def _echo_logs():
+    """Echo the records of git-aggregator (see `_EchoFilter`) within the block.
+
+    The logging of the process is only changed while aggregations run, and
+    restored after the last one of those running at the same time.
+    """
+    global _echo_users, _echo_saved_level
+    with _echo_lock:
+        if not _echo_users:
+            root = logging.getLogger("git_aggregator")
+            _echo_saved_level = root.level
+            # What git-aggregator does is logged at the INFO level
+            root.setLevel(logging.INFO)
+            for name in _ECHO_LOGGERS:
+                logging.getLogger(name).addFilter(_echo_filter)
+        _echo_users += 1
+    try:
+        yield
+    finally:
+        with _echo_lock:
+            _echo_users -= 1
+            if not _echo_users:
+                for name in _ECHO_LOGGERS:
+                    logging.getLogger(name).removeFilter(_echo_filter)
+                logging.getLogger("git_aggregator").setLevel(_echo_saved_level)
+
+
+class TimedRepo(AggregatorRepo):
+    """A git-aggregator repo, timing the phases of its aggregation.
+
+    The git commands are run with the environment of `os_exec.run`, and their
+    output is captured, as for the ``gitaggregate`` command: several repos may
+    be aggregated at the same time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # phase -> seconds, see PHASES
+        self.timings = dict.fromkeys(PHASES, 0.0)
+
+    @contextmanager
+    def _timed(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[phase] += time.perf_counter() - start
+
+    def log_call(
+        self, cmd, callwith=subprocess.check_call, log_level=logging.DEBUG, **kw
+    ):
+        if callwith is subprocess.check_call:
+            callwith = partial(subprocess.run, check=True, capture_output=True)
+        kw.setdefault("env", get_venv(network=ssh.track(cmd)))
+        return super().log_call(cmd, callwith=callwith, log_level=log_level, **kw)
+
+    def init_repository(self, target_dir):
+        with self._timed("fetch"):
+            return super().init_repository(target_dir)
+
+    def fetch(self):
+        with self._timed("fetch"):
+            super().fetch()
+
+    def _reset_to(self, remote, ref):
+        with self._timed("merge"):
+            super()._reset_to(remote, ref)
+
+    def _merge(self, merge):
+        with self._timed("merge"):
+            super()._merge(merge)
+
+    def _execute_shell_command_after(self):
+        with self._timed("shell_command_after"):
+            super()._execute_shell_command_after()
+
+
+def aggregate(path: str | Path, config: Mapping) -> dict[str, float]:
+    """Aggregate the repo at ``path`` as ``config``, its section of a merges
+    file, and return how long each of `PHASES` took, in seconds.
+
+    Raises `subprocess.CalledProcessError` when a git command fails, or a
+    `git_aggregator.exception.GitAggregatorException`.
+    """
+    with _echo_logs():
+        (repo_dict,) = get_repos({str(Path(path).resolve()): config})
+        repo = TimedRepo(**repo_dict)
+        start = time.perf_counter()
+        repo.aggregate()
+    logger.debug(
+        "Aggregated %s in %.2fs (%s)",
+        path,
+        time.perf_counter() - start,
+        ", ".join(f"{phase} {repo.timings[phase]:.2f}s" for phase in PHASES),
+    )
+    return repo.timings
@@ -0,0 +1,124 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""Small persistent caches, kept as JSON files under ``get_cache_path()``.
+
+A cache is only ever a shortcut: failing to read or write it is logged (see
+``--debug``) and otherwise ignored, the caller then simply does the work again.
+"""
+
+import json
+import logging
+import tempfile
+import threading
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from .misc import get_cache_path
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    stored_at: datetime
+
+    @property
+    def age(self) -> timedelta:
+        return datetime.now() - self.stored_at
+
+
+class JsonCache:
+    """A key-value store persisted in the JSON file ``file_name`` of the cache
+    directory.
+
+    Every entry remembers when it was stored, so that each reader applies its
+    own expiry rules (see :meth:`lookup`). The file is read once, on first use,
+    and rewritten atomically on every change: a concurrent ``otools`` process
+    never sees it half written. It is safe to use from several threads.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._lock = threading.RLock()
+        self._path: Path | None = None
+        self._entries: dict[str, dict] = {}
+
+    @property
+    def path(self) -> Path:
+        return get_cache_path() / self.file_name
+
+    def _load(self) -> dict[str, dict]:
+        # Reloaded when the cache directory changes, which only happens in tests
+        path = self.path
+        if path != self._path:
+            self._path = path
+            try:
+                self._entries = json.loads(path.read_text())
+            except FileNotFoundError:
+                self._entries = {}
+            except (OSError, ValueError) as exc:
+                logger.debug("Cannot read cache %s: %s", path, exc)
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        path = self.path
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+            ) as fobj:
+                json.dump(self._entries, fobj)
+            Path(fobj.name).replace(path)
+        except OSError as exc:
+            logger.debug("Cannot write cache %s: %s", path, exc)
+
+    def lookup(self, key: str) -> CacheEntry | None:
+        """Return the entry stored under ``key``, or None."""
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        try:
+            return CacheEntry(entry["value"], datetime.fromisoformat(entry["at"]))
+        except (TypeError, KeyError, ValueError):
+            return None
+
+    def keys(self) -> list[str]:
+        with self._lock:
+            return list(self._load())
+
+    def get(self, key: str, max_age: timedelta, default=None):
+        """Return the value stored under ``key`` if it is younger than ``max_age``."""
+        entry = self.lookup(key)
+        if entry is None or entry.age >= max_age:
+            return default
+        return entry.value
+
+    def set(self, key: str, value):
+        self.update({key: value})
+
+    def update(self, values: Mapping[str, Any]):
+        """Store all of ``values`` at once, for a single write of the file."""
+        if not values:
+            return
+        stored_at = datetime.now().isoformat()
+        with self._lock:
+            entries = self._load()
+            for key, value in values.items():
+                entries[key] = {"value": value, "at": stored_at}
+            self._save()
+
+    def invalidate(self, *keys: str):
+        """Drop the entries of ``keys``, or every entry when none is given."""
+        with self._lock:
+            entries = self._load()
+            if keys:
+                for key in keys:
+                    entries.pop(key, None)
+            else:
+                entries.clear()
+            self._save()
@@ -6,6 +6,7 @@ import click
 
 from .. import __version__
 from .minimum_version import with_minimum_version_check
+from .ssh import with_ssh_multiplexing
 from .update_check import with_update_check
 
 __all__ = [
@@ -16,8 +17,10 @@ __all__ = [
     "global_command_decorators",
     "is_debug",
     "jobs_option",
+    "refresh_option",
     "version_option",
     "with_minimum_version_check",
+    "with_ssh_multiplexing",
     "with_update_check",
 ]
 
@@ -101,6 +104,17 @@ jobs_option = click.option(
     help="Number of operations to run in parallel.",
 )
 
+#: Shared ``--refresh`` option for the commands asking GitHub about the state
+#: of pending pull requests, see `pending_merge.enrich_pull_requests`.
+refresh_option = click.option(
+    "--refresh",
+    "refresh",
+    is_flag=True,
+    default=False,
+    help="Ask GitHub for the state of every pull request, even the ones known"
+    " from an earlier run to be merged.",
+)
+
 
 def _enable_debug(ctx, param, value):
     """Turn debug mode on as soon as the flag is parsed.
@@ -134,13 +148,15 @@ def global_command_decorators(func):
     """Apply the standard ``otools-*`` pre-invoke hooks.
 
     Bundles (in order): update-available check, project ``otools_min_version``
-    enforcement, the ``-V`` / ``--version`` flag and the ``--debug`` flag.
+    enforcement, SSH connection sharing, the ``-V`` / ``--version`` flag and
+    the ``--debug`` flag.
     Place it right above ``def cli(...):`` so it wraps the callback;
     ``@click.group()`` / ``@click.command()`` and any CLI-specific options stay
     where they are.
     """
     func = with_update_check(func)
     func = with_minimum_version_check(func)
+    func = with_ssh_multiplexing(func)
     func = version_option(func)
     func = debug_option(func)
     return func
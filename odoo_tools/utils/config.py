@@ -104,6 +104,14 @@ class ProjectConfig(BaseModel):
     pending_merge_rel_path: Path
     """The path to the pending merges files."""
 
+    pending_merge_lock: bool = False
+    """Record the commits of each aggregation in a lock file.
+
+    The lock file sits next to the pending merges file of the repo, with a
+    ``.lock`` suffix. See ``otools-pending outdated`` and
+    ``otools-pending aggregate --locked``.
+    """
+
     version_file_rel_path: OptionalPath = None
     """The path to the version file."""
 
@@ -1,14 +1,27 @@
 # Copyright 2023 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import logging
+import os
 import re
 import subprocess
 from pathlib import Path
 
-from . import git, ui
+import requests
+
+from . import gh_api, git, ui
 from .os_exec import run
 from .proj import get_project_id
 
+logger = logging.getLogger(__name__)
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+#: Repositories looked up per GraphQL query, see `remote_repos_exist`
+GRAPHQL_BATCH_SIZE = 100
+#: Pull requests looked up per GraphQL query, see `pull_requests_info`: with
+#: up to 100 labels each, a batch stays far below the node limit of a query
+GRAPHQL_PR_BATCH_SIZE = 50
+
 RE_GH_REMOTE_URL = re.compile(
     r"^(?:https?://github\.com/|git@github\.com:)"
     r"(?P<owner>[^/]+)/(?P<repo>[^/]+?)(?:\.git)?$"
@@ -33,6 +46,141 @@ def parse_remote_url(url: str) -> tuple[str, str]:
     return match.group("owner"), match.group("repo")
 
 
+def _graphql_batches(items, batch_size, build_field):
+    """Yield ``(batch, query, variables)`` for aliased GraphQL queries over
+    ``items``, ``batch_size`` at a time; ``build_field(i, item)`` returns the
+    parameters, aliased field and variables of the i-th item of a batch."""
+    for start in range(0, len(items), batch_size):
+        batch = items[start : start + batch_size]
+        params, fields, variables = [], [], {}
+        for i, item in enumerate(batch):
+            item_params, field, item_variables = build_field(i, item)
+            params.append(item_params)
+            fields.append(field)
+            variables.update(item_variables)
+        query = f"query({', '.join(params)}) {{ {' '.join(fields)} }}"
+        yield batch, query, variables
+
+
+def _graphql_query(token: str, query: str, variables: dict) -> dict:
+    response = gh_api.get_client().post(
+        GRAPHQL_URL,
+        json={"query": query, "variables": variables},
+        headers={"Authorization": f"bearer {token}"},
+    )
+    return response.json()
+
+
+def remote_repos_exist(urls: list[str]) -> dict[str, bool]:
+    """Tell which of the github repositories at ``urls`` exist, using batched
+    GraphQL queries rather than one ``git ls-remote`` per repository.
+
+    Meant as the ``batch_lookup`` of `git.prefetch_remote_repos`. The GitHub API
+    needs a ``GITHUB_TOKEN``: without one, or when a query fails, nothing is
+    answered and the caller falls back on probing each URL.
+
+    Only the repositories found are answered for: a private repository the
+    token cannot read looks just like a missing one, and would be taken as
+    missing for a whole day. The others are left out of the result, to be
+    probed with ``git ls-remote`` like the URLs that are not github
+    repositories.
+    """
+    token = os.environ.get("GITHUB_TOKEN")
+    if not token:
+        return {}
+    repos = {}
+    for url in urls:
+        try:
+            repos[url] = parse_remote_url(url)
+        except ValueError:
+            continue
+    items = list(repos.items())
+    answers = {}
+
+    def build_field(i, item):
+        __, (owner, repo) = item
+        return (
+            f"$o{i}: String!, $n{i}: String!",
+            f"r{i}: repository(owner: $o{i}, name: $n{i}) {{ id }}",
+            {f"o{i}": owner, f"n{i}": repo},
+        )
+
+    for batch, query, variables in _graphql_batches(
+        items, GRAPHQL_BATCH_SIZE, build_field
+    ):
+        try:
+            result = _graphql_query(token, query, variables)
+        except (requests.RequestException, ValueError) as exc:
+            logger.debug("Cannot look up repositories on GitHub: %s", exc)
+            return answers
+        data = result.get("data") or {}
+        for i, (url, __) in enumerate(batch):
+            if data.get(f"r{i}"):
+                answers[url] = True
+    return answers
+
+
+PULL_REQUEST_FIELDS = (
+    "state merged number title updatedAt labels(first: 100) { nodes { name } }"
+)
+
+
+def pull_requests_info(
+    pull_requests: list[tuple[str, str, int]],
+) -> dict[tuple[str, str, int], dict]:
+    """Fetch the state of ``pull_requests``, given as ``(owner, repo, number)``,
+    with batched GraphQL queries rather than one REST call each.
+
+    Returns the information of the pull requests found, by ``(owner, repo,
+    number)``, with the keys of the REST API (``state``, ``merged``,
+    ``labels``, ``number``, ``title`` and ``updated_at``). They are queried
+    `GRAPHQL_PR_BATCH_SIZE` at a time.
+
+    The GitHub API needs a ``GITHUB_TOKEN``: without one, nothing is answered.
+    A batch whose query fails, like the pull requests that can't be found,
+    is left out: the caller falls back on the REST API for them.
+    """
+    token = os.environ.get("GITHUB_TOKEN")
+    if not token:
+        return {}
+    answers = {}
+
+    def build_field(i, item):
+        owner, repo, number = item
+        return (
+            f"$o{i}: String!, $n{i}: String!, $p{i}: Int!",
+            f"p{i}: repository(owner: $o{i}, name: $n{i}) "
+            f"{{ pullRequest(number: $p{i}) {{ {PULL_REQUEST_FIELDS} }} }}",
+            {f"o{i}": owner, f"n{i}": repo, f"p{i}": int(number)},
+        )
+
+    for batch, query, variables in _graphql_batches(
+        list(dict.fromkeys(pull_requests)), GRAPHQL_PR_BATCH_SIZE, build_field
+    ):
+        try:
+            result = _graphql_query(token, query, variables)
+        except (requests.RequestException, ValueError) as exc:
+            logger.debug("Cannot look up pull requests on GitHub: %s", exc)
+            continue
+        data = result.get("data") or {}
+        for i, key in enumerate(batch):
+            pull = (data.get(f"p{i}") or {}).get("pullRequest")
+            if not pull:
+                continue
+            answers[key] = {
+                # Like the REST API, which has no "merged" state
+                "state": "closed"
+                if pull.get("state") == "MERGED"
+                else (pull.get("state") or "").lower(),
+                "merged": bool(pull.get("merged")),
+                "labels": (pull.get("labels") or {}).get("nodes") or [],
+                "number": pull.get("number"),
+                "title": pull.get("title"),
+                "updated_at": pull.get("updatedAt"),
+            }
+    return answers
+
+
 def parse_github_url(entity_spec):
     # "entity" is either a PR, commit or a branch
     # TODO: input validation
@@ -0,0 +1,317 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""HTTP client for the GitHub API, shared by all the calls of a command.
+
+A single `requests.Session` keeps the connections to api.github.com alive, so
+that the many concurrent calls of e.g. ``otools-pending show`` don't each pay
+for a TCP and TLS handshake. Its pool is sized to the number of threads the
+command runs (see `configure`), up to `MAX_POOL_SIZE`: the calls beyond wait
+for a connection of the pool to be free.
+
+Rate-limited and failing calls are retried, after the delay GitHub asks for
+(``Retry-After`` or ``X-RateLimit-Reset``) or with an exponential backoff.
+
+The responses fetched with `GitHubClient.get_json` are kept on disk with their
+``ETag`` (see `ResponseCache`): the next calls only ask GitHub whether they
+changed, and an unchanged response does not count against the rate limit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import click
+import requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+
+from .misc import get_cache_path
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.github.com"
+TIMEOUT = 30
+#: How many times a call is retried
+MAX_RETRIES = 3
+#: Delay before the first retry, in seconds, doubled on each retry
+BACKOFF_FACTOR = 1.0
+#: The longest GitHub can make us wait before a retry, in seconds: a call
+#: rate-limited for longer fails right away
+MAX_RETRY_WAIT = 60
+RETRY_STATUSES = (403, 429, 500, 502, 503, 504)
+#: The most connections a command keeps open to the GitHub API. GitHub asks
+#: for few concurrent calls (see its secondary rate limits): more of them only
+#: get answered slower, or rate-limited.
+MAX_POOL_SIZE = 16
+#: The hosts the client talks to, each with its own pool: the API, github.com
+#: (e.g. the ``.patch`` of a PR) and the hosts it redirects to
+#: (``patch-diff.githubusercontent.com``, ``codeload.github.com``)
+POOL_HOSTS = 4
+#: The disk space of the cached responses, in bytes: the least recently used
+#: ones are dropped beyond it
+RESPONSE_CACHE_MAX_SIZE = 50 * 1024**2
+
+_CLOSE_META_KEY = "odoo_tools.gh_api.close"
+
+
+def _is_rate_limited(response: requests.Response) -> bool:
+    # A 403 is also what a missing permission gets: only retry it when GitHub
+    # tells it is about the rate limit.
+    return (
+        "Retry-After" in response.headers
+        or response.headers.get("X-RateLimit-Remaining") == "0"
+    )
+
+
+class ResponseCache:
+    """The bodies of GitHub API responses, with their ``ETag``, one file per
+    URL in the ``dir_name`` directory of the cache.
+
+    Like the other caches (see `cache.JsonCache`), failing to read or write
+    it is only logged. It counts its hits (responses GitHub told us were
+    unchanged) and misses, logged with ``--debug``.
+    """
+
+    def __init__(self, dir_name="github-api", max_size=RESPONSE_CACHE_MAX_SIZE):
+        self.dir_name = dir_name
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        return get_cache_path() / self.dir_name
+
+    def _file(self, url: str, auth: str = "") -> Path:
+        # What a token can see depends on the token
+        key = hashlib.sha256(f"{url}\0{auth}".encode()).hexdigest()
+        return self.path / f"{key}.json"
+
+    def lookup(self, url: str, auth: str = "") -> dict | None:
+        """Return the ``etag`` and ``body`` stored for ``url``, or None."""
+        try:
+            entry = json.loads(self._file(url, auth).read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.debug("Cannot read cached response of %s: %s", url, exc)
+            return None
+        if not isinstance(entry, dict) or "etag" not in entry or "body" not in entry:
+            return None
+        return entry
+
+    def store(self, url: str, etag: str, body, auth: str = ""):
+        path = self._file(url, auth)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+            ) as fobj:
+                json.dump({"url": url, "etag": etag, "body": body}, fobj)
+            Path(fobj.name).replace(path)
+        except OSError as exc:
+            logger.debug("Cannot cache response of %s: %s", url, exc)
+
+    def touch(self, url: str, auth: str = ""):
+        """Mark the response of ``url`` as used, see `evict`."""
+        try:
+            self._file(url, auth).touch()
+        except OSError:
+            pass
+
+    def count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def evict(self):
+        """Drop the least recently used responses beyond `max_size`."""
+        try:
+            files = [(path.stat(), path) for path in self.path.glob("*.json")]
+        except OSError as exc:
+            logger.debug("Cannot list cached responses: %s", exc)
+            return
+        total = sum(stat.st_size for stat, __ in files)
+        for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+            if total <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+
+    def close(self):
+        """Log the hits and misses of the command, then `evict`."""
+        with self._lock:
+            hits, misses, self.hits, self.misses = self.hits, self.misses, 0, 0
+        if hits or misses:
+            logger.debug(
+                "GitHub API response cache: %d hit(s), %d miss(es)", hits, misses
+            )
+            self.evict()
+
+
+response_cache = ResponseCache()
+
+
+class GitHubClient:
+    """Pooled, retrying HTTP client for the GitHub API.
+
+    :param pool_size: the number of connections kept alive, i.e. the number
+        of calls in flight at the same time, up to `MAX_POOL_SIZE`
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOLSIZE, max_retries=MAX_RETRIES):
+        self.pool_size = min(pool_size, MAX_POOL_SIZE)
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        # Blocking: a call waits for a connection of the pool rather than
+        # opening one more, dropped as soon as it is answered
+        adapter = HTTPAdapter(
+            pool_connections=POOL_HOSTS, pool_maxsize=self.pool_size, pool_block=True
+        )
+        self.session.mount("https://", adapter)
+
+    @staticmethod
+    def auth_headers(scheme="token") -> dict[str, str]:
+        """Return the authorization header of the ``GITHUB_TOKEN``, if any."""
+        if token := os.environ.get("GITHUB_TOKEN"):
+            return {"Authorization": f"{scheme} {token}"}
+        return {}
+
+    def _backoff(self, attempt: int) -> float:
+        return BACKOFF_FACTOR * 2**attempt
+
+    def _retry_delay(self, response: requests.Response, attempt: int) -> float | None:
+        """Return how long to wait before retrying the call that got
+        ``response``, or None if it must not be retried."""
+        if response.status_code not in RETRY_STATUSES:
+            return None
+        if response.status_code == 403 and not _is_rate_limited(response):
+            return None
+        if retry_after := response.headers.get("Retry-After"):
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = self._backoff(attempt)
+        elif response.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                reset = float(response.headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                delay = self._backoff(attempt)
+            else:
+                delay = max(reset - time.time(), 0) + 1
+        else:
+            delay = self._backoff(attempt)
+        if delay > MAX_RETRY_WAIT:
+            logger.debug("GitHub asks to wait %.0fs, not retrying", delay)
+            return None
+        return delay
+
+    def _wait(self, delay: float):
+        time.sleep(delay)
+
+    def request(
+        self, method: str, url: str, retries: int | None = None, **kwargs
+    ) -> requests.Response:
+        """Send a request to ``url``, relative to `API_URL` or absolute.
+
+        :param retries: how many times to retry the call, instead of the
+            client's ``max_retries``
+
+        Raises ``requests.RequestException`` (eg. ``HTTPError`` on a missing
+        resource or once the retries are exhausted) on failure.
+        """
+        if url.startswith("/"):
+            url = API_URL + url
+        max_retries = self.max_retries if retries is None else retries
+        kwargs.setdefault("timeout", TIMEOUT)
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt >= max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                reason = str(exc)
+            else:
+                delay = None
+                if attempt < max_retries:
+                    delay = self._retry_delay(response, attempt)
+                if delay is None:
+                    response.raise_for_status()
+                    return response
+                reason = f"HTTP {response.status_code}"
+            logger.debug(
+                "%s %s failed (%s), retrying in %.1fs", method, url, reason, delay
+            )
+            self._wait(delay)
+            attempt += 1
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def get_json(self, url: str, headers=None, **kwargs):
+        """Get ``url`` and return the decoded JSON, revalidating the response
+        cached on an earlier call, if any, with its ``ETag``."""
+        headers = dict(headers or {})
+        auth = headers.get("Authorization", "")
+        cached = response_cache.lookup(url, auth)
+        if cached:
+            headers["If-None-Match"] = cached["etag"]
+        response = self.get(url, headers=headers, **kwargs)
+        if cached and response.status_code == 304:
+            response_cache.count(hit=True)
+            response_cache.touch(url, auth)
+            return cached["body"]
+        response_cache.count(hit=False)
+        body = response.json()
+        if etag := response.headers.get("ETag"):
+            response_cache.store(url, etag, body, auth)
+        return body
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+_lock = threading.Lock()
+_client: GitHubClient | None = None
+
+
+def _close_with_command():
+    """Have `response_cache` closed at the end of the current command."""
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None:
+        root = ctx.find_root()
+        if not root.meta.get(_CLOSE_META_KEY):
+            root.meta[_CLOSE_META_KEY] = True
+            root.call_on_close(response_cache.close)
+
+
+def get_client() -> GitHubClient:
+    """Return the client shared by the whole command."""
+    global _client
+    _close_with_command()
+    with _lock:
+        if _client is None:
+            _client = GitHubClient()
+        return _client
+
+
+def configure(pool_size: int = DEFAULT_POOLSIZE):
+    """Size the pool of the shared client for ``pool_size`` concurrent calls,
+    e.g. the ``--jobs`` of the command."""
+    global _client
+    _close_with_command()
+    with _lock:
+        if _client is None or _client.pool_size != min(pool_size, MAX_POOL_SIZE):
+            if _client is not None:
+                _client.session.close()
+            _client = GitHubClient(pool_size=pool_size)
@@ -1,26 +1,31 @@
 # Copyright 2023 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import hashlib
+import logging
 import subprocess
-from collections.abc import Iterator
-from functools import cache
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from os import PathLike
 from pathlib import Path
 from typing import NamedTuple
 
-from git.config import GitConfigParser
 from git_autoshare.core import find_autoshare_repository
 
-from . import ui
+from . import ssh, ui
+from .cache import JsonCache
+from .click import DEFAULT_MAX_WORKERS
 from .config import config as proj_config
-from .os_exec import run
+from .gitmodules import Submodule, load_gitmodules
+from .gitmodules import repo_name_from_url as _repo_name_from_url
+from .os_exec import get_venv, run, run_streamed
 from .path import build_path, root_path
 from .proj import get_odoo_version, get_project_id
 
-
-def _repo_name_from_url(url: str) -> str:
-    """Extract repository name from a GitHub SSH or HTTPS URL."""
-    return url.rstrip("/").split("/")[-1].removesuffix(".git")
+logger = logging.getLogger(__name__)
 
 
 def remote_exists(git_dir: str | Path, remote_name: str) -> bool:
@@ -32,7 +37,42 @@ def remote_exists(git_dir: str | Path, remote_name: str) -> bool:
     return result.returncode == 0
 
 
-@cache
+#: Answers of `remote_repo_exists`, by URL, kept across runs
+remote_repo_cache = JsonCache("remote-repos.json")
+#: How long a repository is known to exist. Repositories are seldom deleted.
+REMOTE_REPO_TTL = timedelta(days=7)
+#: How long a repository is known to be missing: it may be created any time,
+#: e.g. when a fork is made for a first pending merge.
+REMOTE_REPO_MISSING_TTL = timedelta(days=1)
+
+
+def _cached_remote_repo_exists(url: str) -> bool | None:
+    """Return the cached answer of `remote_repo_exists`, or None if unknown or expired."""
+    entry = remote_repo_cache.lookup(url)
+    if entry is None:
+        return None
+    ttl = REMOTE_REPO_TTL if entry.value else REMOTE_REPO_MISSING_TTL
+    return entry.value if entry.age < ttl else None
+
+
+def _probe_remote_repo(url: str) -> bool | None:
+    """Ask the remote whether the repository at ``url`` exists.
+
+    Only ``HEAD`` is requested, to keep the ref advertisement small. Returns
+    None when the answer is unknown (e.g. network failure), as opposed to
+    False for a repository the server reports as missing.
+    """
+    cmd = ["git", "ls-remote", url, "HEAD"]
+    result = subprocess.run(
+        cmd, capture_output=True, text=True, env=get_venv(network=ssh.track(cmd))
+    )
+    if result.returncode == 0:
+        return True
+    if "Repository not found" in (result.stderr or ""):
+        return False
+    return None
+
+
 def remote_repo_exists(url: str) -> bool:
     """Return True if the github repository at ``url`` is reachable.
 
@@ -41,12 +81,65 @@ def remote_repo_exists(url: str) -> bool:
     ``Repository not found``, which is exactly what registering targeted remotes
     is meant to prevent.
 
-    Results are cached because ``setup_submodule_remotes`` is called twice per
-    submodule (autoshare cache and working tree), so the network probe would
-    otherwise be repeated.
+    Answers are cached on disk (see `remote_repo_cache`): the same few hundred
+    repositories are probed by every ``otools-submodule update``, and each probe
+    costs an SSH handshake. Missing repositories are remembered for a shorter
+    time than existing ones; failed probes are not remembered at all.
     """
-    result = subprocess.run(["git", "ls-remote", url], capture_output=True)
-    return result.returncode == 0
+    exists = _cached_remote_repo_exists(url)
+    if exists is None:
+        exists = _probe_remote_repo(url)
+        if exists is not None:
+            remote_repo_cache.set(url, exists)
+    return bool(exists)
+
+
+def prefetch_remote_repos(
+    urls: Iterable[str],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    batch_lookup: Callable[[list[str]], Mapping[str, bool]] | None = None,
+) -> None:
+    """Probe, ``max_workers`` at a time, the ``urls`` `remote_repo_exists` has
+    no fresh answer for, and cache the answers.
+
+    :param batch_lookup: answers for many URLs at once (e.g.
+        `gh.remote_repos_exist`); the URLs it leaves out are probed one by one
+    """
+    urls = [
+        url for url in dict.fromkeys(urls) if _cached_remote_repo_exists(url) is None
+    ]
+    if not urls:
+        return
+    answers = dict(batch_lookup(urls)) if batch_lookup else {}
+    to_probe = [url for url in urls if url not in answers]
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for url, exists in zip(
+                to_probe, pool.map(_probe_remote_repo, to_probe), strict=True
+            ):
+                if exists is not None:
+                    answers[url] = exists
+    remote_repo_cache.update(answers)
+
+
+def ls_remote(url: str, *patterns: str) -> dict[str, str] | None:
+    """Return the refs of the repository at ``url`` matching ``patterns`` (see
+    ``git ls-remote``), as a mapping of ref name to SHA, with a single request.
+
+    Returns None when the repository can't be reached.
+    """
+    cmd = ["git", "ls-remote", url, *patterns]
+    result = subprocess.run(
+        cmd, capture_output=True, text=True, env=get_venv(network=ssh.track(cmd))
+    )
+    if result.returncode != 0:
+        logger.debug("Cannot list the refs of %s: %s", url, result.stderr.strip())
+        return None
+    refs = {}
+    for line in result.stdout.splitlines():
+        sha, __, ref = line.partition("\t")
+        refs[ref] = sha
+    return refs
 
 
 def get_remotes(git_dir: str | Path) -> dict[str, str]:
@@ -61,12 +154,24 @@ def get_remotes(git_dir: str | Path) -> dict[str, str]:
     return remotes
 
 
-def ensure_remote(git_dir: str | Path, remote_name: str, url: str) -> bool:
+def ensure_remote(
+    git_dir: str | Path,
+    remote_name: str,
+    url: str,
+    remotes: Mapping[str, str] | None = None,
+) -> bool:
     """Add a named remote if it doesn't already exist.
 
+    :param remotes: the remotes of the repo, as returned by :func:`get_remotes`,
+        to save a lookup when the caller already knows them
+
     Returns True if the remote was added, False if it was already present.
     """
-    if remote_exists(git_dir, remote_name):
+    if remotes is not None:
+        exists = remote_name in remotes
+    else:
+        exists = remote_exists(git_dir, remote_name)
+    if exists:
         return False
     run(
         ["git", "-C", str(git_dir), "remote", "add", remote_name, url],
@@ -75,79 +180,383 @@ def ensure_remote(git_dir: str | Path, remote_name: str, url: str) -> bool:
     return True
 
 
-def fetch_targeted(git_dir: str | Path, remote_name: str, refspec: str) -> None:
-    """Fetch a single refspec from a named remote, emitting a warning on failure."""
+def fetch_targeted(git_dir: str | Path, remote_name: str, *refspecs: str) -> bool:
+    """Fetch ``refspecs`` from a named remote, emitting a warning on failure.
+
+    The refspecs all go in a single protocol v2 fetch: the refs are then
+    filtered on the server side, and the objects negotiated once. Returns
+    whether the fetch succeeded.
+    """
     try:
         run(
-            ["git", "-C", str(git_dir), "fetch", remote_name, refspec],
+            [
+                "git",
+                "-C",
+                str(git_dir),
+                "-c",
+                "protocol.version=2",
+                "fetch",
+                remote_name,
+                *refspecs,
+            ],
             check=True,
         )
     except subprocess.CalledProcessError as e:
         ui.echo(
-            f"WARNING: fetch {remote_name} {refspec} in {git_dir} failed: {e}",
+            f"WARNING: fetch {remote_name} {' '.join(refspecs)} in {git_dir} failed: {e}",
             fg="yellow",
         )
+        return False
+    return True
 
 
-def setup_submodule_remotes(
-    repo_path: str | Path,
+def _submodule_remote_urls(submodule_url: str, company_remote: str) -> tuple[str, str]:
+    """Return the URLs of the OCA and company repositories of a submodule."""
+    repo_name = _repo_name_from_url(submodule_url)
+    return (
+        f"git@github.com:OCA/{repo_name}.git",
+        f"git@github.com:{company_remote}/{repo_name}.git",
+    )
+
+
+def prefetch_submodule_remotes(
+    submodules: Iterable["SubmoduleInfo"],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    batch_lookup: Callable[[list[str]], Mapping[str, bool]] | None = None,
+) -> None:
+    """Probe at once the repositories `setup_submodule_remotes` will have to
+    check for ``submodules``, see `prefetch_remote_repos`.
+
+    Like `plan_submodule_fetches`, a repository is not probed when its remote
+    is already configured where `submodule_update` sets the remotes up: the
+    autoshare cache of the submodule, and its working tree.
+    """
+    project_id = get_project_id(raise_if_missing=False)
+    company_remote = proj_config.company_git_remote
+    submodules = list(submodules)
+    names = ["OCA", company_remote] if project_id else ["OCA"]
+
+    def missing_remotes(submodule):
+        __, autoshare_repo = find_autoshare_repository([submodule.url])
+        repos = [build_path(submodule.path)]
+        if autoshare_repo:
+            repos.append(Path(autoshare_repo.repo_dir))
+        missing = set()
+        for repo_path in repos:
+            remotes = _local_remotes(repo_path)
+            missing.update(name for name in names if name not in remotes)
+        return missing
+
+    urls = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for submodule, missing in zip(
+            submodules, pool.map(missing_remotes, submodules), strict=True
+        ):
+            oca_url, c2c_url = _submodule_remote_urls(submodule.url, company_remote)
+            if "OCA" in missing:
+                urls.append(oca_url)
+            if company_remote in missing:
+                urls.append(c2c_url)
+    prefetch_remote_repos(urls, max_workers=max_workers, batch_lookup=batch_lookup)
+
+
+def _local_remotes(repo_path: Path) -> Mapping[str, str]:
+    """Return the remotes of the repository at ``repo_path``, none if it is
+    not cloned yet."""
+    # A bare repo (autoshare cache), or a working tree: not the superproject
+    # a missing submodule's directory is part of
+    if not (repo_path / ".git").exists() and not (repo_path / "HEAD").is_file():
+        return {}
+    try:
+        return get_remotes(repo_path)
+    except subprocess.CalledProcessError:
+        return {}
+
+
+class RemoteFetch(NamedTuple):
+    """What to fetch from a remote, see `plan_submodule_fetches`."""
+
+    url: str
+    refspecs: list[str]
+
+
+def plan_submodule_fetches(
     submodule_url: str,
     base_branch: str,
     project_id: str | None,
     company_remote: str,
-) -> None:
-    """Ensure OCA and <company_remote> (e.g. camptocamp) remotes exist and fetch targeted branches.
+    remotes: Mapping[str, str],
+) -> dict[str, RemoteFetch]:
+    """Return what a submodule repository needs to fetch, by remote name.
 
-    Fetch strategy:
       OCA              -> base branch only (e.g. refs/heads/18.0)
       <company_remote> -> merge-branch-<project_id>-* only (skipped when project_id is None)
 
-    A remote is only added when the corresponding github repository actually
+    A remote is only planned when the corresponding github repository actually
     exists. Many submodules are not OCA repositories (e.g. private
     ``<company_remote>/...`` modules), so blindly adding an ``OCA/<repo>`` remote
     would point at a non-existent repository and break git's fallback fetch.
 
     The (network) existence probe is skipped when the remote is already
-    configured locally: an existing remote is trusted and only re-fetched.
+    configured locally, i.e. in ``remotes``: an existing remote is trusted and
+    only re-fetched.
+    """
+    oca_url, c2c_url = _submodule_remote_urls(submodule_url, company_remote)
+    plan = {}
+    if "OCA" in remotes or remote_repo_exists(oca_url):
+        plan["OCA"] = RemoteFetch(
+            oca_url, [f"+refs/heads/{base_branch}:refs/remotes/OCA/{base_branch}"]
+        )
+    if project_id and (company_remote in remotes or remote_repo_exists(c2c_url)):
+        plan[company_remote] = RemoteFetch(
+            c2c_url,
+            [
+                f"+refs/heads/merge-branch-{project_id}-*"
+                f":refs/remotes/{company_remote}/merge-branch-{project_id}-*"
+            ],
+        )
+    return plan
+
+
+def _objects_dir(repo_path: str | Path) -> Path:
+    git_path = run(["git", "-C", str(repo_path), "rev-parse", "--git-path", "objects"])
+    return (Path(repo_path) / git_path).resolve()
+
+
+def borrows_objects_from(repo_path: str | Path, other_repo: str | Path) -> bool:
+    """Tell whether ``repo_path`` reads the objects of ``other_repo`` through
+    its alternates, as a submodule cloned with ``--reference`` does."""
+    alternates = _objects_dir(repo_path) / "info" / "alternates"
+    try:
+        lines = alternates.read_text().splitlines()
+    except OSError:
+        return False
+    objects = _objects_dir(other_repo)
+    return any(
+        line.strip() and (alternates.parent.parent / line.strip()).resolve() == objects
+        for line in lines
+    )
+
+
+def mirror_remote_refs(
+    source_repo: str | Path, repo_path: str | Path, refspecs: Iterable[str]
+) -> int:
+    """Copy to ``repo_path`` the refs ``source_repo`` fetched with ``refspecs``.
+
+    Meant for a repository reading the objects of ``source_repo`` through its
+    alternates (see `borrows_objects_from`): its remote-tracking refs are then
+    brought up to date without any network access. Returns the number of refs
+    copied.
+    """
+    # The destination side of a refspec is the remote-tracking ref (or glob)
+    patterns = [refspec.rpartition(":")[2] for refspec in refspecs]
+    output = run(
+        [
+            "git",
+            "-C",
+            str(source_repo),
+            "for-each-ref",
+            "--format=%(objectname) %(refname)",
+            *patterns,
+        ],
+        check=True,
+    )
+    refs = {}
+    for line in output.splitlines():
+        sha, _, ref = line.partition(" ")
+        refs[ref] = sha
+    update_refs(repo_path, refs)
+    return len(refs)
+
+
+def _packed_size(repo_path: str | Path) -> int:
+    """Return the size of the object store of ``repo_path``, in bytes."""
+    output = run(["git", "-C", str(repo_path), "count-objects", "-v"])
+    stats = dict(line.split(": ", 1) for line in output.splitlines() if ": " in line)
+    return (int(stats.get("size", 0)) + int(stats.get("size-pack", 0))) * 1024
+
+
+class RemotesReport(NamedTuple):
+    """What `setup_submodule_remotes` did, for the debug logs."""
+
+    #: True if the remotes were fetched, False if mirrored from another repo
+    fetched: bool
+    seconds: float
+    #: How much the object store grew by, when the remotes were fetched and
+    #: debug logs are on, None otherwise
+    size: int | None = None
+
+
+def setup_submodule_remotes(
+    repo_path: str | Path,
+    submodule_url: str,
+    base_branch: str,
+    project_id: str | None,
+    company_remote: str,
+    reference: str | Path | None = None,
+) -> RemotesReport:
+    """Ensure OCA and <company_remote> (e.g. camptocamp) remotes exist and fetch targeted branches.
+
+    What is fetched from which remote comes from `plan_submodule_fetches`:
+    each remote is then fetched once, with all its refspecs.
+
+    :param reference: a repository whose objects ``repo_path`` may read
+        through its alternates, typically the autoshare cache of a submodule
+        working tree; when it does, the refs ``reference`` fetched are
+        mirrored rather than fetched again
 
     Safe to call on both submodule working trees and autoshare bare caches.
     """
-    repo_name = _repo_name_from_url(submodule_url)
-    oca_url = f"git@github.com:OCA/{repo_name}.git"
-    c2c_url = f"git@github.com:{company_remote}/{repo_name}.git"
-
-    if remote_exists(repo_path, "OCA") or remote_repo_exists(oca_url):
-        ensure_remote(repo_path, "OCA", oca_url)
-        fetch_targeted(
-            repo_path,
-            "OCA",
-            f"+refs/heads/{base_branch}:refs/remotes/OCA/{base_branch}",
-        )
+    start = time.monotonic()
+    # Looked up once, rather than asking git about each remote in turn
+    remotes = get_remotes(repo_path)
+    plan = plan_submodule_fetches(
+        submodule_url, base_branch, project_id, company_remote, remotes
+    )
+    for remote_name, fetch in plan.items():
+        ensure_remote(repo_path, remote_name, fetch.url, remotes=remotes)
+
+    if reference and borrows_objects_from(repo_path, reference):
+        refspecs = [refspec for fetch in plan.values() for refspec in fetch.refspecs]
+        mirror_remote_refs(reference, repo_path, refspecs)
+        return RemotesReport(False, time.monotonic() - start)
+
+    measure = logger.isEnabledFor(logging.DEBUG)
+    size_before = _packed_size(repo_path) if measure else 0
+    for remote_name, fetch in plan.items():
+        fetch_targeted(repo_path, remote_name, *fetch.refspecs)
+    seconds = time.monotonic() - start
+    size = _packed_size(repo_path) - size_before if measure else None
+    return RemotesReport(True, seconds, size)
 
-    if project_id and (
-        remote_exists(repo_path, company_remote) or remote_repo_exists(c2c_url)
-    ):
-        ensure_remote(repo_path, company_remote, c2c_url)
-        fetch_targeted(
-            repo_path,
-            company_remote,
-            f"+refs/heads/merge-branch-{project_id}-*"
-            f":refs/remotes/{company_remote}/merge-branch-{project_id}-*",
-        )
+
+#: The ref pinning the recorded commit of a submodule, see `pin_submodule_commit`
+PINNED_REF = "refs/c2c-sync/pinned"
+
+
+def get_pinned_shas(*submodule_paths: str | PathLike) -> dict[str, str]:
+    """Return the commit SHAs recorded in the parent repo HEAD, by submodule path.
+
+    A single recursive ``git ls-tree`` answers for every submodule at once.
+
+    :param submodule_paths: the submodules to look up, all of them if omitted
+    """
+    cmd = ["git", "ls-tree", "-r", "-z", "HEAD"]
+    if submodule_paths:
+        cmd += ["--", *(str(path) for path in submodule_paths)]
+    try:
+        output = run(cmd, cwd=root_path(), check=True, drop_trailing_spaces=False)
+    except subprocess.CalledProcessError:
+        return {}
+    shas = {}
+    for entry in output.split("\0"):
+        # "160000 commit <sha>\t<path>"
+        info, _, path = entry.strip("\n").partition("\t")
+        parts = info.split()
+        if len(parts) == 3 and parts[1] == "commit":
+            shas[path] = parts[2]
+    return shas
 
 
 def get_pinned_sha(submodule_path: str | PathLike) -> str | None:
     """Return the commit SHA recorded in the parent repo HEAD for this submodule."""
-    try:
-        output = run(["git", "ls-tree", "HEAD", str(submodule_path)], check=True)
-        if output:
-            # "160000 commit <sha>\t<path>"
-            parts = output.split()
-            if len(parts) >= 3:
-                return parts[2]
-    except (subprocess.CalledProcessError, IndexError):
-        pass
-    return None
+    return get_pinned_shas(submodule_path).get(str(submodule_path))
+
+
+class ObjectChecker:
+    """Answer object lookups in a repo through one ``git cat-file --batch-check``.
+
+    The process is started once and then fed a revision per line, which saves
+    a ``git`` process per lookup. Use it as a context manager:
+
+    .. code-block:: python
+
+        with ObjectChecker(repo_path) as objects:
+            if objects.exists(f"{sha}^{{commit}}"):
+                ...
+
+    Lookups may come from several threads.
+    """
+
+    def __init__(self, repo_path: str | Path):
+        self.repo_path = repo_path
+        self._process: subprocess.Popen | None = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._process = subprocess.Popen(
+            ["git", "-C", str(self.repo_path), "cat-file", "--batch-check"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        return self
+
+    def __exit__(self, *exc_info):
+        process, self._process = self._process, None
+        if process is not None:
+            assert process.stdin is not None
+            process.stdin.close()
+            process.wait()
+
+    def resolve(self, rev: str) -> tuple[str, str] | None:
+        """Return the ``(sha, type)`` of ``rev``, or None when it can't be found."""
+        if self._process is None:
+            raise RuntimeError("ObjectChecker must be used as a context manager")
+        assert self._process.stdin is not None and self._process.stdout is not None
+        with self._lock:
+            self._process.stdin.write(f"{rev}\n")
+            self._process.stdin.flush()
+            line = self._process.stdout.readline()
+        # "<sha> <type> <size>", or "<rev> missing" / "<rev> ambiguous"
+        parts = line.split()
+        if len(parts) != 3:
+            return None
+        return parts[0], parts[1]
+
+    def exists(self, rev: str) -> bool:
+        """Tell whether ``rev`` resolves to an object of the repo."""
+        return self.resolve(rev) is not None
+
+
+def update_refs(repo_path: str | Path, refs: Mapping[str, str]) -> None:
+    """Point each of ``refs`` (a mapping of ref name to SHA) to its SHA.
+
+    All the refs are written in a single ``git update-ref --stdin``
+    transaction: either all of them are updated, or none is.
+    """
+    if not refs:
+        return
+    lines = ["start", *(f"update {ref} {sha}" for ref, sha in refs.items()), "commit"]
+    run(
+        ["git", "-C", str(repo_path), "update-ref", "--stdin"],
+        input="\n".join(lines) + "\n",
+        check=True,
+    )
+
+
+def delete_refs(repo_path: str | Path, refs: Iterable[str]) -> None:
+    """Delete ``refs``, in a single ``git update-ref --stdin`` transaction."""
+    refs = list(refs)
+    if not refs:
+        return
+    lines = ["start", *(f"delete {ref}" for ref in refs), "commit"]
+    run(
+        ["git", "-C", str(repo_path), "update-ref", "--stdin"],
+        input="\n".join(lines) + "\n",
+        check=True,
+    )
+
+
+def object_exists(repo_path: str | Path, rev: str) -> bool:
+    """Tell whether ``rev`` (e.g. ``<sha>^{commit}``) names an object of the
+    repo at ``repo_path``, with a single ``git cat-file -e``: see
+    `ObjectChecker` to look up many."""
+    result = subprocess.run(
+        ["git", "-C", str(repo_path), "cat-file", "-e", rev], capture_output=True
+    )
+    return result.returncode == 0
 
 
 def pin_submodule_commit(repo_path: str | Path, pinned_sha: str) -> bool:
@@ -159,70 +568,133 @@ def pin_submodule_commit(repo_path: str | Path, pinned_sha: str) -> bool:
     Pinning a local ref makes the commit reachable from --all so the fallback
     never triggers.
 
+    ``update-ref`` checks the commit on its own, which saves starting a
+    ``cat-file`` process for a single lookup.
+
     Returns True if the ref was set, False if the commit is not in the object store.
     """
-    check = subprocess.run(
-        ["git", "-C", str(repo_path), "cat-file", "-e", f"{pinned_sha}^{{commit}}"],
-        capture_output=True,
-    )
-    if check.returncode != 0:
+    try:
+        update_refs(repo_path, {PINNED_REF: pinned_sha})
+    except subprocess.CalledProcessError:
+        # update-ref refuses to point a ref to a missing object
         return False
-    run(
-        [
-            "git",
-            "-C",
-            str(repo_path),
-            "update-ref",
-            "refs/c2c-sync/pinned",
-            pinned_sha,
-        ],
-        check=True,
-    )
     return True
 
 
-class SubmoduleInfo(NamedTuple):
-    path: str
-    url: str
-    branch: str | None
-    exists: bool
-    cloned: bool
+#: Kept for the callers predating `gitmodules.Submodule`
+SubmoduleInfo = Submodule
+
+
+def _run_network(cmd, cwd=None):
+    """Run a git command talking to a remote, with its output on the terminal
+    (see `os_exec.run_streamed`)."""
+    ssh.track(cmd)
+    run_streamed(cmd, cwd=cwd, env=get_venv(network=True))
+
+
+#: How `_checkout_repo` gets the objects of a new clone:
+#:
+#: * ``full``: the whole repository, history included
+#: * ``blobless``: the history (commits and trees) of the commit to check out,
+#:   the file contents being fetched on demand (``--filter=blob:none``)
+#: * ``shallow``: the commit to check out only, without any history
+CLONE_MODES = ("full", "blobless", "shallow")
+
 
+def get_odoo_core(hash, dest="src/odoo", org="odoo", mode="full"):
+    _checkout_repo(org, "odoo", build_path(dest), hash, mode=mode)
 
-def get_odoo_core(hash, dest="src/odoo", org="odoo"):
-    _checkout_repo(org, "odoo", build_path(dest), hash)
 
+def get_odoo_enterprise(hash, dest="src/enterprise", org="odoo", mode="full"):
+    _checkout_repo(org, "enterprise", build_path(dest), hash, mode=mode)
 
-def get_odoo_enterprise(hash, dest="src/enterprise", org="odoo"):
-    _checkout_repo(org, "enterprise", build_path(dest), hash)
 
+def _format_size(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    value = float(size)
+    for unit in ("KiB", "MiB"):
+        value /= 1024
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+    return f"{value / 1024:.1f} GiB"
 
-def _checkout_repo(org, repo, dest, ref, depth=None):
+
+def _is_partial_clone(dest: Path) -> bool:
+    """Tell whether ``dest`` was cloned with a partial mode, see `CLONE_MODES`."""
+    if (dest / ".git" / "shallow").exists():
+        return True
+    result = subprocess.run(
+        ["git", "-C", str(dest), "config", "remote.origin.promisor"],
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip() == "true"
+
+
+def _checkout_repo(org, repo, dest, ref, depth=None, mode="full"):
+    """Check out ``ref`` of github repository ``org/repo`` in ``dest``.
+
+    :param mode: how to get the objects of a new clone, see `CLONE_MODES`.
+        Partial modes don't apply when an autoshare cache is available, nor to
+        a full clone made earlier. When the server refuses the partial fetch,
+        the ref is fetched in full.
+    """
     repo_url = f"git@github.com:{org}/{repo}"
     __, autoshare_repo = find_autoshare_repository([repo_url])
     dest = Path(dest)
+    start = time.monotonic()
+    partial = mode != "full" and not autoshare_repo
     # If the repository doesn't exist, clone it (without checkout)
     if not (dest / ".git").is_dir():
-        ui.echo(f"Cloning {org}/{repo} on {ref}, be patient..")
-        if autoshare_repo:
-            command = "autoshare-clone"
+        if partial:
+            # Cloning would fetch the default branch: only set up the remote
+            # so that the fetch below gets nothing but ``ref``.
+            ui.echo(f"Initializing {org}/{repo} for a {mode} fetch of {ref}")
+            run(["git", "init", "--quiet", str(dest)], check=True)
+            run(
+                ["git", "-C", str(dest), "remote", "add", "origin", repo_url],
+                check=True,
+            )
         else:
-            command = "clone"
-        args = [
-            "--quiet",
-            "--no-checkout",
-        ]
-        if depth:
-            args.extend(["--depth", str(depth)])
-        args.extend([repo_url, str(dest)])
-        subprocess.run(["git", command, *args], check=True)
+            ui.echo(f"Cloning {org}/{repo} on {ref}, be patient..")
+            if autoshare_repo:
+                command = "autoshare-clone"
+            else:
+                command = "clone"
+            args = [
+                "--quiet",
+                "--no-checkout",
+            ]
+            if depth:
+                args.extend(["--depth", str(depth)])
+            args.extend([repo_url, str(dest)])
+            _run_network(["git", command, *args])
+    else:
+        partial = partial and _is_partial_clone(dest)
     # Fetch the ref to checkout
     ui.echo(f"Fetching {org}/{repo} {ref}")
     args = ["--quiet"]
+    partial_args = []
+    if partial and mode == "blobless":
+        partial_args = ["--filter=blob:none"]
+    elif partial and mode == "shallow":
+        depth = depth or 1
     if depth:
-        args.extend(["--depth", str(depth)])
-    args.extend(["origin", ref])
-    subprocess.run(["git", "-C", str(dest), "fetch", *args], check=True)
+        partial_args = [*partial_args, "--depth", str(depth)]
+    try:
+        _run_network(
+            ["git", "-C", str(dest), "fetch", *args, *partial_args, "origin", ref]
+        )
+    except subprocess.CalledProcessError:
+        if not partial:
+            raise
+        ui.echo(
+            f"WARNING: the {mode} fetch of {org}/{repo} {ref} was refused,"
+            " fetching it in full",
+            fg="yellow",
+        )
+        _run_network(["git", "-C", str(dest), "fetch", *args, "origin", ref])
     # Checkout
     ui.echo(f"Checking out {org}/{repo} {ref}..")
     git_args = [
@@ -231,7 +703,228 @@ def _checkout_repo(org, repo, dest, ref, depth=None):
         "-c",
         "advice.detachedHead=false",
     ]
-    subprocess.run(["git", *git_args, "checkout", "--force", ref], check=True)
+    # A blobless clone fetches the file contents while checking them out
+    _run_network(["git", *git_args, "checkout", "--force", ref])
+    ui.echo(
+        f"{org}/{repo} checked out in {time.monotonic() - start:.1f}s,"
+        f" with {_format_size(_packed_size(dest))} of git objects"
+    )
+
+
+def deepen_repo(dest: str | Path, depth: int | None = None) -> None:
+    """Fetch more history for a shallow clone made by `_checkout_repo`:
+    ``depth`` more commits, or the whole history if None."""
+    dest = Path(dest)
+    if not (dest / ".git" / "shallow").exists():
+        ui.echo(f"{dest} is not a shallow clone, nothing to deepen")
+        return
+    args = [f"--deepen={depth}"] if depth else ["--unshallow"]
+    head = run(["git", "-C", str(dest), "rev-parse", "HEAD"], check=True)
+    ui.echo(f"Fetching more history in {dest}")
+    _run_network(["git", "-C", str(dest), "fetch", "--quiet", *args, "origin", head])
+    ui.echo(f"{dest} now has {_format_size(_packed_size(dest))} of git objects")
+
+
+#: Namespace of the refs to the result of applying patches, see `apply_patches`
+PATCHES_REF_PREFIX = "refs/otools/patches/"
+
+
+def patch_series_keys(base: str, patches: Iterable[str | Path]) -> list[str]:
+    """Return the cache key of each prefix of the ``patches`` series applied on
+    ``base``, a commit SHA: the n-th key depends on the content of the first n
+    patches."""
+    digest = hashlib.sha256(base.encode())
+    keys = []
+    for patch in patches:
+        digest.update(hashlib.sha256(Path(patch).read_bytes()).digest())
+        keys.append(digest.copy().hexdigest())
+    return keys
+
+
+def apply_patches(repo_path: str | Path, base: str, patches: Iterable[str | Path]):
+    """Apply ``patches``, in order, with ``git am --3way`` on ``base``, checked
+    out in ``repo_path``.
+
+    The commit resulting of each patch is kept under `PATCHES_REF_PREFIX`,
+    keyed by the commit of ``base``: a series applied before is only checked
+    out, and only the patches after the first one that changed since are
+    applied again. Once applied, the refs of the other series are dropped,
+    unless a worktree of the repo is at their commit.
+    """
+    patches = list(patches)
+    if not patches:
+        return
+    # A branch moves: its name would key the series of an older commit
+    try:
+        base = run(
+            [
+                "git",
+                "-C",
+                str(repo_path),
+                "rev-parse",
+                "--verify",
+                f"{base}^{{commit}}",
+            ],
+            check=True,
+        )
+    except subprocess.CalledProcessError:
+        # Not known by that name here: it is what is checked out
+        base = run(["git", "-C", str(repo_path), "rev-parse", "HEAD"], check=True)
+    keys = patch_series_keys(base, patches)
+    cached = dict(
+        line.split(" ", 1)[::-1]
+        for line in run(
+            [
+                "git",
+                "-C",
+                str(repo_path),
+                "for-each-ref",
+                "--format=%(objectname) %(refname)",
+                PATCHES_REF_PREFIX,
+            ],
+            check=True,
+        ).splitlines()
+    )
+    done = 0
+    for i in range(len(keys), 0, -1):
+        if PATCHES_REF_PREFIX + keys[i - 1] in cached:
+            done = i
+            break
+    if done:
+        ui.echo(f"Using {done} cached patch(es) of {len(patches)} in {repo_path}")
+        run(
+            [
+                "git",
+                "-C",
+                str(repo_path),
+                "-c",
+                "advice.detachedHead=false",
+                "checkout",
+                "--force",
+                "--detach",
+                PATCHES_REF_PREFIX + keys[done - 1],
+            ],
+            check=True,
+        )
+    for patch, key in zip(patches[done:], keys[done:], strict=True):
+        ui.echo(f"Applying patch {Path(patch).name} to {repo_path}")
+        run(["git", "-C", str(repo_path), "am", "--3way", str(patch)], check=True)
+        head = run(["git", "-C", str(repo_path), "rev-parse", "HEAD"], check=True)
+        update_refs(repo_path, {PATCHES_REF_PREFIX + key: head})
+    _prune_patch_refs(
+        repo_path, cached, keep={PATCHES_REF_PREFIX + key for key in keys}
+    )
+
+
+def _prune_patch_refs(repo_path: str | Path, refs: Mapping[str, str], keep: set[str]):
+    """Delete ``refs``, the commit of each patches ref, but for ``keep`` and
+    the ones another worktree of the repo (e.g. in the odoo store) is at."""
+    worktrees = run(
+        ["git", "-C", str(repo_path), "worktree", "list", "--porcelain"], check=True
+    )
+    heads = {
+        line.removeprefix("HEAD ")
+        for line in worktrees.splitlines()
+        if line.startswith("HEAD ")
+    }
+    delete_refs(
+        repo_path,
+        [ref for ref, sha in refs.items() if ref not in keep and sha not in heads],
+    )
+
+
+def is_toplevel(repo_path: str | Path) -> bool:
+    """Tell whether ``repo_path`` is the root of a git repository, and not some
+    directory in one (e.g. a submodule not cloned yet)."""
+    result = subprocess.run(
+        ["git", "-C", str(repo_path), "rev-parse", "--show-toplevel"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return False
+    return Path(result.stdout.strip()).resolve() == Path(repo_path).resolve()
+
+
+def is_merged_into(repo_path: str | Path, head: str, base: str) -> bool | None:
+    """Tell from the local history whether the commit ``head`` is merged into
+    ``base``.
+
+    It is when it is an ancestor of ``base`` (a merge commit or a fast-forward),
+    or when each of its own commits has an equivalent one, with the same patch
+    id, in ``base`` (see ``git cherry``): a rebase merge, or the squash merge of
+    a single commit.
+
+    Returns None when the history can't tell: the commits may have been squashed
+    together, or changed while merged, or ``head`` may just not be merged.
+    """
+    ancestor = subprocess.run(
+        ["git", "-C", str(repo_path), "merge-base", "--is-ancestor", head, base],
+        capture_output=True,
+    )
+    if ancestor.returncode == 0:
+        return True
+    if ancestor.returncode != 1:
+        # e.g. a missing commit
+        return None
+    try:
+        output = run(["git", "-C", str(repo_path), "cherry", base, head], check=True)
+    except subprocess.CalledProcessError:
+        return None
+    # "- <sha>" for a commit with an equivalent in base, "+ <sha>" otherwise
+    marks = [line[:1] for line in output.splitlines()]
+    if marks and all(mark == "-" for mark in marks):
+        return True
+    return None
+
+
+class MergeTree(NamedTuple):
+    """The result of `merge_tree`."""
+
+    tree: str
+    #: The paths with conflicts, none for a clean merge
+    conflicts: list[str]
+
+
+def merge_tree(repo_path: str | Path, base: str, head: str) -> MergeTree:
+    """Merge the commit ``head`` into the commit ``base``, in the object
+    database only: neither the working tree, the index nor any ref changes.
+
+    Needs git 2.38 (``git merge-tree --write-tree``). Raises
+    `subprocess.CalledProcessError` when the merge can't be tried at all (e.g. a
+    missing commit).
+    """
+    cmd = [
+        "git",
+        "-C",
+        str(repo_path),
+        "merge-tree",
+        "--write-tree",
+        "--name-only",
+        "--no-messages",
+        base,
+        head,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    # 0 for a clean merge, 1 for conflicts, but also for a missing commit
+    if result.returncode not in (0, 1) or not result.stdout:
+        raise subprocess.CalledProcessError(
+            result.returncode, cmd, result.stdout, result.stderr
+        )
+    tree, *conflicts = result.stdout.splitlines()
+    return MergeTree(tree, [path for path in conflicts if path])
+
+
+def commit_tree(repo_path: str | Path, tree: str, *parents: str) -> str:
+    """Create a commit of ``tree`` with ``parents``, without moving any ref,
+    and return its SHA."""
+    cmd = ["git", "-C", str(repo_path)]
+    # A throwaway commit: whoever the user is, or isn't configured to be
+    cmd += ["-c", "user.name=otools", "-c", "user.email=otools@localhost"]
+    cmd += ["commit-tree", tree, "-m", "otools merge check"]
+    for parent in parents:
+        cmd += ["-p", parent]
+    return run(cmd, check=True)
 
 
 def _get_gitmodules():
@@ -240,26 +933,19 @@ def _get_gitmodules():
 
 def iter_gitmodules(
     filter_path: str | PathLike | None = None,
-) -> Iterator[SubmoduleInfo]:
+) -> Iterator[Submodule]:
     """Yields the submodules from `.gitmodules`
 
+    The file is only parsed again when it changed, see `load_gitmodules`.
+
     :param filter_path: if provided, only yield the submodules on the given path
     """
-    config = GitConfigParser(str(_get_gitmodules()), read_only=True)
-    if filter_path:
-        filter_path = Path(filter_path)
-    for section in config.sections():
-        info = dict(config.items(section))
-        assert "path" in info, f"Missing `path` in {section}"
-        assert "url" in info, f"Missing `url` in {section}"
-        if filter_path and not Path(info["path"]).is_relative_to(filter_path):
-            continue
-        path = Path(build_path(info["path"]))
-        exists = path.exists()
-        cloned = exists and Path(path / ".git").exists()
-        yield SubmoduleInfo(
-            info["path"], info["url"], info.get("branch"), exists, cloned
-        )
+    yield from load_gitmodules(_get_gitmodules()).filter(filter_path)
+
+
+def get_submodule(path: str | PathLike) -> Submodule | None:
+    """Return the submodule at ``path`` in `.gitmodules`, or None."""
+    return load_gitmodules(_get_gitmodules()).get(path)
 
 
 def submodule_init(submodule: SubmoduleInfo) -> None:
@@ -276,26 +962,57 @@ def submodule_add(submodule: SubmoduleInfo) -> None:
     args = ["--force", submodule.url, str(submodule.path)]
     if submodule.branch:
         args = ["-b", submodule.branch, *args]
-    subprocess.run(cmd + args, check=True)
+    _run_network(cmd + args, cwd=root_path())
+
 
+def submodule_sync(*paths: str | PathLike):
+    """Submodule sync
 
-def submodule_sync(path: str | PathLike):
-    """Submodule sync"""
+    :param paths: the submodules to sync, all of them if omitted
+    """
     sync_cmd = ["git", "submodule", "sync"]
-    if path:
-        sync_cmd += ["--", str(path)]
-    run(sync_cmd, check=True)
+    if any(paths):
+        sync_cmd += ["--", *(str(path) for path in paths if path)]
+    run(sync_cmd, cwd=root_path(), check=True)
+
+
+def submodule_register(*paths: str | PathLike):
+    """Register the given submodules in the superproject's ``.git/config``.
+
+    This is the ``--init`` part of ``git submodule update --init``: once done,
+    updating a submodule does not write the superproject configuration
+    anymore, so that several submodules can be updated concurrently without
+    racing for its lock.
+    """
+    if not paths:
+        return
+    run(
+        ["git", "submodule", "init", "--", *(str(path) for path in paths)],
+        cwd=root_path(),
+        check=True,
+    )
+
+
+def submodule_update(
+    path: str | PathLike, pinned_shas: Mapping[str, str] | None = None
+):
+    """Submodule update
 
+    Every command targets its repository explicitly (``cwd=`` or ``-C``), so
+    different submodules can be updated concurrently, provided they were
+    registered beforehand (see :func:`submodule_register`).
 
-def submodule_update(path: str | PathLike):
-    """Submodule update"""
+    :param pinned_shas: the recorded commits of the submodules, as returned by
+        :func:`get_pinned_shas`, when the caller looked them up in one go
+    """
     cmd = ["git", "submodule", "update", "--init"]
     args = []
     # Use git-autoshare if available
-    submodule = next(iter_gitmodules(filter_path=path), None)
+    submodule = get_submodule(path)
     project_id: str | None = None
     base_branch: str = get_odoo_version()
     company_remote = proj_config.company_git_remote
+    reference = cache_report = None
     if submodule:
         ui.echo(f"Updating submodule {submodule.path}")
         project_id = get_project_id(raise_if_missing=False)
@@ -308,32 +1025,49 @@ def submodule_update(path: str | PathLike):
             # that the recorded commit is reachable from a named ref in the cache.
             # This prevents git's fallback fetch from reaching parent-repo remotes
             # (including any 'me' remote) via blocked file:// transport.
-            setup_submodule_remotes(
-                autoshare_repo.repo_dir,
+            reference = autoshare_repo.repo_dir
+            cache_report = setup_submodule_remotes(
+                reference,
                 submodule.url,
                 base_branch,
                 project_id,
                 company_remote,
             )
-            args += ["--reference", autoshare_repo.repo_dir]
+            args += ["--reference", reference]
         else:
             ui.echo(
                 f"Auto-share conf not found for {submodule.url}. You may want to check your auto-share configuration."
             )
     args.append(str(path))
-    run(cmd + args, check=True)
+    run(cmd + args, cwd=root_path(), check=True)
     # After the submodule is updated: ensure it has OCA/<company_remote> remotes and
     # pin the recorded commit so subsequent git operations never trigger the
-    # fallback fetch path.
+    # fallback fetch path. The working tree reads its objects from the
+    # autoshare cache, which just fetched them: its refs are copied from there.
     if submodule and Path(build_path(submodule.path)).exists():
-        setup_submodule_remotes(
+        report = setup_submodule_remotes(
             build_path(submodule.path),
             submodule.url,
             base_branch,
             project_id,
             company_remote,
+            reference=reference,
         )
-        pinned_sha = get_pinned_sha(submodule.path)
+        if cache_report and not report.fetched:
+            logger.debug(
+                "%s: remote refs copied from the autoshare cache in %.2fs, saving"
+                " a fetch of %.2fs%s",
+                submodule.path,
+                report.seconds,
+                cache_report.seconds,
+                f" and {cache_report.size} bytes"
+                if cache_report.size is not None
+                else "",
+            )
+        if pinned_shas is not None:
+            pinned_sha = pinned_shas.get(str(submodule.path))
+        else:
+            pinned_sha = get_pinned_sha(submodule.path)
         if pinned_sha:
             pin_submodule_commit(build_path(submodule.path), pinned_sha)
 
@@ -398,15 +1132,18 @@ def get_submodule_commit(path):
         return None
 
 
-def submodule_upgrade(path, url, branch=None):
+def submodule_upgrade(path, url, branch=None, commit_before=None):
     """Upgrade a submodule to the latest remote commit.
 
     :param path: submodule path (relative to project root)
     :param url: submodule remote url
     :param branch: if set, force checkout of this specific branch
+    :param commit_before: the commit the submodule is at, when the caller
+        knows it, e.g. its recorded commit (see `get_pinned_shas`) right after
+        a `submodule_update`
     :returns: True if the submodule was upgraded, False otherwise
     """
-    commit_before = get_submodule_commit(path)
+    commit_before = commit_before or get_submodule_commit(path)
     abs_path = str(build_path(path))
     if branch:
         run(["git", "-C", abs_path, "reset", "HEAD", "--hard"], check=True)
@@ -415,7 +1152,7 @@ def submodule_upgrade(path, url, branch=None):
     else:
         cmd = ["git", "submodule", "update", "-f", "--remote", "--checkout"]
         # Use git-autoshare if available
-        submodule = next(iter_gitmodules(filter_path=path), None)
+        submodule = get_submodule(path)
         if submodule:
             __, autoshare_repo = find_autoshare_repository([submodule.url])
             if autoshare_repo and Path(autoshare_repo.repo_dir).exists():
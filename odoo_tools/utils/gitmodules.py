@@ -0,0 +1,208 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""Read-only model of the project's ``.gitmodules`` file.
+
+The file is parsed once, and parsed again only when it changes on disk, into
+a table indexed by submodule path, URL and repository name. The parser covers
+the git-config syntax used in ``.gitmodules`` files and does not depend on
+GitPython, so that read-only commands don't have to import it.
+"""
+
+import re
+import threading
+from os import PathLike
+from pathlib import Path, PurePosixPath
+from typing import NamedTuple
+
+from .path import build_path
+
+RE_SECTION = re.compile(
+    r'\[\s*(?P<section>[A-Za-z0-9.-]+)(?:\s+"(?P<subsection>(?:[^"\\]|\\.)*)")?\s*\]'
+)
+RE_VARIABLE = re.compile(r"(?P<name>[A-Za-z][A-Za-z0-9-]*)\s*(?P<assign>=?)")
+ESCAPES = {"n": "\n", "t": "\t", "b": "\b", "\\": "\\", '"': '"'}
+
+
+def repo_name_from_url(url: str) -> str:
+    """Extract repository name from a GitHub SSH or HTTPS URL."""
+    return url.rstrip("/").split("/")[-1].removesuffix(".git")
+
+
+def _url_key(url: str) -> str:
+    return url.rstrip("/").removesuffix(".git")
+
+
+def _path_key(path: str | PathLike) -> str:
+    return PurePosixPath(path).as_posix()
+
+
+class Submodule(NamedTuple):
+    path: str
+    url: str
+    branch: str | None
+    #: The name of the submodule section, usually the same as its path
+    name: str | None = None
+
+    @property
+    def repo_name(self) -> str:
+        return repo_name_from_url(self.url)
+
+    @property
+    def exists(self) -> bool:
+        """Whether the submodule directory exists (checked on each access)."""
+        return Path(build_path(self.path)).exists()
+
+    @property
+    def cloned(self) -> bool:
+        """Whether the submodule is checked out (checked on each access)."""
+        return (Path(build_path(self.path)) / ".git").exists()
+
+
+def _parse_value(text: str, lines) -> str:
+    """Parse a variable value starting at ``text``, pulling the next lines of
+    ``lines`` for continuations."""
+    value = []
+    pending_spaces = ""
+    quoted = False
+    while True:
+        i = 0
+        while i < len(text):
+            char = text[i]
+            if char == "\\":
+                if i + 1 == len(text):
+                    # A line continuation
+                    break
+                value.append(pending_spaces + ESCAPES.get(text[i + 1], text[i + 1]))
+                pending_spaces = ""
+                i += 2
+                continue
+            if char == '"':
+                quoted = not quoted
+            elif not quoted and char in "#;":
+                return "".join(value)
+            elif not quoted and char.isspace():
+                # Spaces are kept only between words
+                if value:
+                    pending_spaces += char
+            else:
+                value.append(pending_spaces + char)
+                pending_spaces = ""
+            i += 1
+        else:
+            return "".join(value)
+        text = next(lines, "").rstrip("\n")
+
+
+def parse_gitmodules(text: str) -> list[Submodule]:
+    """Parse the content of a ``.gitmodules`` file."""
+    sections: dict[str, dict[str, str]] = {}
+    current: dict[str, str] | None = None
+    lines = iter(text.splitlines())
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            match = RE_SECTION.match(line)
+            if not match:
+                raise ValueError(f"Invalid section header in .gitmodules: {line}")
+            current = None
+            if match["section"].lower() == "submodule" and match["subsection"]:
+                name = re.sub(r"\\(.)", r"\1", match["subsection"])
+                current = sections.setdefault(name, {})
+            line = line[match.end() :].strip()
+        if not line or line[0] in "#;":
+            continue
+        match = RE_VARIABLE.match(line)
+        if not match:
+            raise ValueError(f"Invalid line in .gitmodules: {line}")
+        value = _parse_value(line[match.end() :], lines) if match["assign"] else "true"
+        if current is not None:
+            # Variable names are case insensitive; the last value wins
+            current[match["name"].lower()] = value
+    submodules = []
+    for name, info in sections.items():
+        assert "path" in info, f"Missing `path` in submodule {name}"
+        assert "url" in info, f"Missing `url` in submodule {name}"
+        submodules.append(
+            Submodule(info["path"], info["url"], info.get("branch"), name)
+        )
+    return submodules
+
+
+class GitmodulesTable:
+    """The submodules of a ``.gitmodules`` file, in file order, with O(1)
+    lookups by path, URL and repository name."""
+
+    def __init__(self, submodules: list[Submodule]):
+        self.submodules = tuple(submodules)
+        self._by_path = {_path_key(sub.path): sub for sub in self.submodules}
+        self._by_url = {_url_key(sub.url): sub for sub in self.submodules}
+        self._by_repo_name: dict[str, list[Submodule]] = {}
+        for sub in self.submodules:
+            self._by_repo_name.setdefault(sub.repo_name, []).append(sub)
+
+    def __iter__(self):
+        return iter(self.submodules)
+
+    def __len__(self):
+        return len(self.submodules)
+
+    def get(self, path: str | PathLike) -> Submodule | None:
+        """Return the submodule at ``path`` (relative to the project root)."""
+        return self._by_path.get(_path_key(path))
+
+    def by_url(self, url: str) -> Submodule | None:
+        """Return the submodule cloned from ``url``, with or without ``.git``."""
+        return self._by_url.get(_url_key(url))
+
+    def by_repo_name(self, repo_name: str) -> list[Submodule]:
+        """Return the submodules of the repositories named ``repo_name``."""
+        return list(self._by_repo_name.get(repo_name, ()))
+
+    def filter(self, path: str | PathLike | None = None) -> list[Submodule]:
+        """Return the submodules at or under ``path``, or all of them."""
+        if not path:
+            return list(self.submodules)
+        if submodule := self.get(path):
+            return [submodule]
+        path = PurePosixPath(path)
+        return [
+            sub
+            for sub in self.submodules
+            if PurePosixPath(sub.path).is_relative_to(path)
+        ]
+
+
+_lock = threading.Lock()
+#: Parsed tables, with the (mtime, size) of the file they were parsed from
+_tables: dict[Path, tuple[tuple[int, int], GitmodulesTable]] = {}
+
+
+def load_gitmodules(path: str | PathLike | None = None) -> GitmodulesTable:
+    """Return the submodule table of ``path``, the project's ``.gitmodules``
+    by default.
+
+    The table is parsed again only when the file's modification time or size
+    changed. A missing file gives an empty table.
+    """
+    path = Path(path or build_path(".gitmodules"))
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return GitmodulesTable([])
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _tables.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+    table = GitmodulesTable(parse_gitmodules(path.read_text()))
+    with _lock:
+        _tables[path] = (key, table)
+    return table
+
+
+def clear_cache():
+    """Forget the parsed tables, e.g. after editing a file within the
+    resolution of its modification time."""
+    with _lock:
+        _tables.clear()
@@ -0,0 +1,186 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""Find the conflicts between the pending merges of a repo, before aggregating.
+
+git-aggregator stops at the first conflict, once everything is fetched and the
+working tree of the submodule reset. `check_repo` fetches all the merges of a
+repo at once, then merges them with ``git merge-tree``, in the object database
+only: the working tree, the index and the branches are left alone.
+"""
+
+import itertools
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import click
+
+from . import gh, git
+from .click import DEFAULT_MAX_WORKERS
+from .pending_merge import Repo
+
+#: Where the merges are fetched, by remote and ref
+CHECK_REF_PREFIX = "refs/otools/check/"
+
+
+@dataclass
+class Merge:
+    """A merge of the aggregation of a repo."""
+
+    #: How the merge is shown: its line in the merges file, or the PR applied
+    #: as a patch
+    label: str
+    url: str
+    #: What is fetched from ``url``
+    ref: str
+    #: Where it is fetched to
+    local_ref: str
+
+
+@dataclass
+class MergeCheck:
+    """The conflicts found by `check_repo`. Each comes with its paths."""
+
+    repo: Repo
+    #: The merges that could not be fetched, left out of the check
+    missing: list[str] = field(default_factory=list)
+    #: The first merge conflicting with the ones before it, in order: where
+    #: the aggregation would stop
+    first_conflict: tuple[str, list[str]] | None = None
+    #: The merges conflicting with the base on their own
+    base_conflicts: list[tuple[str, list[str]]] = field(default_factory=list)
+    #: The pairs of merges conflicting with each other, on top of the base
+    pair_conflicts: list[tuple[str, str, list[str]]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.first_conflict)
+
+
+def _merges(repo: Repo) -> list[Merge]:
+    """Return the merges of ``repo``, from its base on. The PRs applied as a
+    patch come last, merged as their head: they conflict where that does."""
+    config = repo.merges_config()
+    remotes = config.get("remotes") or {}
+    merges = []
+    for line in config.get("merges") or []:
+        remote, __, ref = str(line).partition(" ")
+        if remote not in remotes:
+            raise click.ClickException(
+                f"{line}: unknown remote in the merges file of {repo.name}"
+            )
+        local_ref = f"{CHECK_REF_PREFIX}{remote}/{ref.removeprefix('refs/')}"
+        merges.append(Merge(str(line), str(remotes[remote]), ref, local_ref))
+    urls_by_repo = {}
+    for url in remotes.values():
+        try:
+            urls_by_repo.setdefault(gh.parse_remote_url(url), str(url))
+        except ValueError:
+            continue
+    for pr in repo._iter_pending_pull_requests():
+        if not pr.is_patch:
+            continue
+        owner, repo_name, number = pr.key
+        url = urls_by_repo.get((owner, repo_name)) or repo.build_ssh_url(
+            owner, repo_name
+        )
+        merges.append(
+            Merge(
+                f"{pr.shortcut} (patch)",
+                url,
+                f"refs/pull/{number}/head",
+                f"{CHECK_REF_PREFIX}patch/{owner}/{repo_name}/{number}",
+            )
+        )
+    return merges
+
+
+def _fetch(repo: Repo, merges: list[Merge]) -> dict[str, str]:
+    """Fetch ``merges``, one fetch per remote, and return the commit of each
+    one fetched, by label.
+
+    A missing ref fails the fetch of all the refs of its remote: they are then
+    fetched one by one, to tell which ones are missing.
+    """
+    by_url: dict[str, list[Merge]] = {}
+    for merge in merges:
+        by_url.setdefault(merge.url, []).append(merge)
+    fetched = []
+    for url, url_merges in by_url.items():
+        refspecs = [f"+{merge.ref}:{merge.local_ref}" for merge in url_merges]
+        if git.fetch_targeted(repo.abs_path, url, *refspecs):
+            fetched += url_merges
+        elif len(url_merges) > 1:
+            fetched += [
+                merge
+                for merge, refspec in zip(url_merges, refspecs, strict=True)
+                if git.fetch_targeted(repo.abs_path, url, refspec)
+            ]
+    commits = {}
+    # Only the refs just fetched: the others may be the ones of an earlier check
+    with git.ObjectChecker(repo.abs_path) as objects:
+        for merge in fetched:
+            resolved = objects.resolve(f"{merge.local_ref}^{{commit}}")
+            if resolved is not None:
+                commits[merge.label] = resolved[0]
+    return commits
+
+
+def check_repo(repo: Repo) -> MergeCheck:
+    """Merge the merges of ``repo`` in order, as git-aggregator would, then
+    each of them on top of the base, then each pair of them, to tell which
+    ones conflict (see `MergeCheck`)."""
+    if not git.is_toplevel(repo.abs_path):
+        raise click.ClickException(f"{repo.path} is not cloned yet")
+    check = MergeCheck(repo)
+    merges = _merges(repo)
+    if not merges:
+        return check
+    commits = _fetch(repo, merges)
+    check.missing = [merge.label for merge in merges if merge.label not in commits]
+    if merges[0].label not in commits:
+        # Nothing to merge onto
+        return check
+    base, *merges = [merge for merge in merges if merge.label in commits]
+    path = repo.abs_path
+    base_commit = commits[base.label]
+    # In order, up to the first conflict
+    current = base_commit
+    for merge in merges:
+        result = git.merge_tree(path, current, commits[merge.label])
+        if result.conflicts:
+            check.first_conflict = (merge.label, result.conflicts)
+            break
+        current = git.commit_tree(path, result.tree, current, commits[merge.label])
+    # On their own
+    onto_base = {}
+    for merge in merges:
+        result = git.merge_tree(path, base_commit, commits[merge.label])
+        if result.conflicts:
+            check.base_conflicts.append((merge.label, result.conflicts))
+        else:
+            onto_base[merge.label] = git.commit_tree(
+                path, result.tree, base_commit, commits[merge.label]
+            )
+    # By pairs
+    for first, second in itertools.combinations(onto_base, 2):
+        result = git.merge_tree(path, onto_base[first], commits[second])
+        if result.conflicts:
+            check.pair_conflicts.append((first, second, result.conflicts))
+    return check
+
+
+def check_repos(
+    repos: list[Repo], max_workers: int = DEFAULT_MAX_WORKERS
+) -> Iterator[tuple[Repo, MergeCheck | None, BaseException | None]]:
+    """Check ``repos`` (see `check_repo`), ``max_workers`` at a time, yielding
+    each repo as it is done, with its check or the error that stopped it."""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(check_repo, repo): repo for repo in repos}
+        for future in as_completed(futures):
+            repo = futures[future]
+            try:
+                yield repo, future.result(), None
+            except Exception as exc:
+                yield repo, None, exc
@@ -0,0 +1,267 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""A store of odoo core and enterprise checkouts, shared by all the projects.
+
+It lives under ``get_cache_path()``, with one bare mirror per upstream
+repository, and one ``git worktree`` of that mirror per commit to check out.
+A project's ``src/odoo`` and ``src/enterprise`` are then symlinks to the
+worktrees of its commits: switching to a commit already checked out for any
+project only changes the link.
+
+Worktrees are keyed by commit, and by the patches applied on top of it, if
+any. The least recently used ones are removed when the worktrees take more
+room than a disk budget (see `BUDGET_ENV_VAR`), but for the ones a project
+still links to.
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import subprocess
+import time
+from collections.abc import Iterable
+from contextlib import contextmanager
+from pathlib import Path
+
+from . import git, ui
+from .cache import JsonCache
+from .misc import get_cache_path
+from .os_exec import run
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR_NAME = "odoo-src"
+#: The disk budget of the worktrees, in GiB
+BUDGET_ENV_VAR = "OTOOLS_ODOO_STORE_BUDGET"
+DEFAULT_BUDGET_GIB = 20
+
+#: Where the commits checked out are fetched to, in the mirrors: a ref keeps
+#: them from being garbage collected under a worktree
+STORE_REF_PREFIX = "refs/otools/store/"
+
+#: The worktrees of the store, by path relative to the store, with their size
+#: in bytes. The time they were stored at is the time they were last used.
+worktrees_index = JsonCache("odoo-src-store.json")
+#: The links of the projects to the worktrees of the store (see `link`): the
+#: worktree of each link, by path of the link
+links_index = JsonCache("odoo-src-links.json")
+#: The worktrees checked out by this process, still to be linked
+_checked_out: set[str] = set()
+
+
+def store_path() -> Path:
+    return get_cache_path() / STORE_DIR_NAME
+
+
+def get_budget() -> int:
+    """Return the disk budget of the worktrees, in bytes."""
+    try:
+        budget = float(os.getenv(BUDGET_ENV_VAR) or DEFAULT_BUDGET_GIB)
+    except ValueError:
+        ui.echo(f"WARNING: invalid {BUDGET_ENV_VAR}, using the default", fg="yellow")
+        budget = DEFAULT_BUDGET_GIB
+    return int(budget * 1024**3)
+
+
+@contextmanager
+def _store_lock():
+    """Hold the lock of the store, against the other threads and processes
+    changing it at the same time."""
+    path = store_path()
+    path.mkdir(parents=True, exist_ok=True)
+    with (path / ".lock").open("w") as fobj:
+        fcntl.flock(fobj, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fobj, fcntl.LOCK_UN)
+
+
+def _dir_size(path: Path) -> int:
+    size = 0
+    for root, __, files in os.walk(path):
+        for name in files:
+            try:
+                size += (Path(root) / name).lstat().st_size
+            except OSError:
+                continue
+    return size
+
+
+def patches_digest(patches: Iterable[Path]) -> str | None:
+    """Return a digest of the content of ``patches``, in order, or None if none."""
+    digest = hashlib.sha256()
+    empty = True
+    for patch in patches:
+        digest.update(Path(patch).read_bytes())
+        empty = False
+    return None if empty else digest.hexdigest()[:12]
+
+
+def ensure_mirror(org: str, repo: str, ref: str) -> Path:
+    """Return the bare mirror of ``org/repo``, fetching ``ref`` if it lacks it."""
+    mirror = store_path() / "mirrors" / org / f"{repo}.git"
+    if not mirror.is_dir():
+        run(["git", "init", "--quiet", "--bare", str(mirror)], check=True)
+        run(
+            [
+                "git",
+                "-C",
+                str(mirror),
+                "remote",
+                "add",
+                "origin",
+                f"git@github.com:{org}/{repo}",
+            ],
+            check=True,
+        )
+    has_ref = subprocess.run(
+        ["git", "-C", str(mirror), "cat-file", "-e", f"{ref}^{{commit}}"],
+        capture_output=True,
+    )
+    if has_ref.returncode != 0:
+        ui.echo(f"Fetching {org}/{repo} {ref} in the shared store, be patient..")
+        git._run_network(
+            [
+                "git",
+                "-C",
+                str(mirror),
+                "fetch",
+                "--quiet",
+                "origin",
+                f"+{ref}:{STORE_REF_PREFIX}{ref}",
+            ]
+        )
+    return mirror
+
+
+def checkout(org: str, repo: str, ref: str, patches: Iterable[Path] = ()) -> Path:
+    """Return a worktree of ``org/repo`` at ``ref`` with ``patches`` applied,
+    creating it if the store does not have it yet."""
+    patches = sorted(patches)
+    key = ref
+    if digest := patches_digest(patches):
+        key = f"{ref}-{digest}"
+    worktree = store_path() / "worktrees" / org / repo / key
+    index_key = worktree.relative_to(store_path()).as_posix()
+    entry = worktrees_index.lookup(index_key)
+    if worktree.is_dir() and entry is not None:
+        ui.echo(f"Using {org}/{repo} {key} from the shared store")
+        # Refresh its last use
+        worktrees_index.set(index_key, entry.value)
+        return worktree
+    start = time.monotonic()
+    mirror = ensure_mirror(org, repo, ref)
+    if worktree.exists():
+        # Left over by an interrupted run
+        run(["git", "-C", str(mirror), "worktree", "remove", "--force", str(worktree)])
+    run(["git", "-C", str(mirror), "worktree", "prune"], check=True)
+    ui.echo(f"Checking out {org}/{repo} {key} in the shared store..")
+    run(
+        ["git", "-C", str(mirror), "worktree", "add", "--detach", str(worktree), ref],
+        check=True,
+    )
+    # The results of the patches are shared by the worktrees of the mirror
+    git.apply_patches(worktree, ref, patches)
+    size = _dir_size(worktree)
+    worktrees_index.set(index_key, size)
+    _checked_out.add(index_key)
+    ui.echo(f"{org}/{repo} {key} checked out in {time.monotonic() - start:.1f}s")
+    evict(keep=index_key)
+    return worktree
+
+
+def link(dest: Path, worktree: Path):
+    """Point ``dest`` to ``worktree``, replacing the link to a former one.
+
+    A link to a worktree of the store is recorded: `evict` leaves the
+    worktree alone as long as the link points to it.
+    """
+    if dest.is_symlink():
+        dest.unlink()
+    elif dest.exists():
+        ui.exit_msg(
+            f"{dest} is a checkout of its own: remove it to use the shared store"
+        )
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    dest.symlink_to(worktree, target_is_directory=True)
+    if worktree.is_relative_to(store_path()):
+        index_key = worktree.relative_to(store_path()).as_posix()
+        links_index.set(str(dest.absolute()), index_key)
+        _checked_out.discard(index_key)
+
+
+def _linked_worktrees() -> dict[str, str]:
+    """Return the worktrees the projects link to, by path relative to the
+    store, with one of their links. The links gone are forgotten."""
+    linked = {}
+    gone = []
+    for dest in links_index.keys():
+        entry = links_index.lookup(dest)
+        path = Path(dest)
+        if (
+            entry is None
+            or not path.is_symlink()
+            or path.readlink() != store_path() / entry.value
+        ):
+            gone.append(dest)
+            continue
+        linked.setdefault(entry.value, dest)
+    if gone:
+        links_index.invalidate(*gone)
+    return linked
+
+
+def evict(budget: int | None = None, keep: str | None = None):
+    """Remove the least recently used worktrees until they fit in ``budget``
+    bytes (see `get_budget`), never removing ``keep``, the worktrees a
+    project links to (see `link`), nor the ones checked out to be linked.
+
+    Evictions are serialized, between the threads and processes of otools.
+    """
+    budget = get_budget() if budget is None else budget
+    with _store_lock():
+        linked = _linked_worktrees()
+        entries = []
+        for index_key in worktrees_index.keys():
+            entry = worktrees_index.lookup(index_key)
+            if entry is not None:
+                entries.append((entry.stored_at, index_key, entry.value))
+        total = sum(size for __, __, size in entries)
+        for __, index_key, size in sorted(entries):
+            if total <= budget:
+                break
+            if index_key == keep or index_key in _checked_out:
+                continue
+            if index_key in linked:
+                logger.debug("%s is linked from %s, kept", index_key, linked[index_key])
+                continue
+            _remove_worktree(index_key)
+            total -= size
+    if total > budget:
+        ui.echo(
+            "WARNING: the worktrees in use exceed the budget of the shared store",
+            fg="yellow",
+        )
+    logger.debug("Shared odoo store: %d bytes of worktrees", total)
+
+
+def _remove_worktree(index_key: str):
+    worktree = store_path() / index_key
+    # worktrees/<org>/<repo>/<key>
+    __, org, repo, key = Path(index_key).parts
+    mirror = store_path() / "mirrors" / org / f"{repo}.git"
+    ui.echo(f"Removing {org}/{repo} {worktree.name} from the shared store")
+    run(["git", "-C", str(mirror), "worktree", "remove", "--force", str(worktree)])
+    worktrees_index.invalidate(index_key)
+    # The commit may go, unless another worktree uses it: <ref>[-<patches>]
+    ref = re.sub(r"-[0-9a-f]{12}$", "", key)
+    prefix = f"worktrees/{org}/{repo}/{ref}"
+    if not any(
+        other == prefix or other.startswith(f"{prefix}-")
+        for other in worktrees_index.keys()
+    ):
+        run(["git", "-C", str(mirror), "update-ref", "-d", f"{STORE_REF_PREFIX}{ref}"])
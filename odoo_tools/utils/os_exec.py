@@ -6,34 +6,49 @@ import shlex
 import shutil
 import subprocess
 import sys
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
-import click
+from . import ssh, ui
 
+# Per-thread state: the `CancelScope` the processes of `run_streamed` belong to
+_local = threading.local()
 
-def get_venv():
+
+def get_venv(network=False):
     """Return an environment that includes the virtualenv in the PATH
 
     When running otools from a virtualenv, where dependencies console scripts
     might not have been installed globally, we need make sure the PATH is set
     correctly so that the executables are found.
+
+    :param network: whether the command may talk to a remote (see
+        `ssh.track`): git is then told to share its SSH connections, see
+        `ssh.git_ssh_command`.
     """
+    env = os.environ
     env_PATH = os.getenv("PATH")
-    # If PATH is not set, we're likely running the tests
-    if not env_PATH:
-        return os.environ
     bin_path = Path(sys.executable).parent
+    # If PATH is not set, we're likely running the tests
     # If the bin_path is already there, perhaps this is a global install
-    if str(bin_path) in env_PATH:
-        return os.environ
-    # Return a copy of the environment, with the venv bin path prepended to PATH
-    env = os.environ.copy()
-    env["PATH"] = f"{bin_path}:{env_PATH}"
+    if env_PATH and str(bin_path) not in env_PATH:
+        # Return a copy of the environment, with the venv bin path prepended to PATH
+        env = os.environ.copy()
+        env["PATH"] = f"{bin_path}:{env_PATH}"
+    if network and (ssh_command := ssh.git_ssh_command()):
+        env = dict(env, GIT_SSH_COMMAND=ssh_command)
     return env
 
 
 def run(
-    cmd, drop_trailing_spaces=True, check=False, with_env=None, verbose=False, cwd=None
+    cmd,
+    drop_trailing_spaces=True,
+    check=False,
+    with_env=None,
+    verbose=False,
+    cwd=None,
+    input=None,
 ):
     """Execute system commands and return output.
 
@@ -42,16 +57,24 @@ def run(
     :param with_env: a dictionary of environment variables to set, or None.
     :param verbose: if True, print the command before running it.
     :param cwd: the working directory to run the command in, or None.
+    :param input: a string to feed to the command on its standard input, or None.
     """
     if isinstance(cmd, str):
         cmd = shlex.split(cmd)
     if verbose:
-        click.echo(click.style(f"Running: {shlex.join(cmd)}", fg="bright_black"))
-    env = get_venv()
+        ui.echo(f"Running: {shlex.join(cmd)}", fg="bright_black")
+    env = get_venv(network=ssh.track(cmd))
     if with_env:
         env.update(with_env)
     try:
-        res = subprocess.run(cmd, capture_output=True, env=env, check=check, cwd=cwd)
+        res = subprocess.run(
+            cmd,
+            capture_output=True,
+            env=env,
+            check=check,
+            cwd=cwd,
+            input=input.encode() if input is not None else None,
+        )
     except subprocess.CalledProcessError as e:
         if e.stderr:
             print(e.stderr.decode(), file=sys.stderr)
@@ -67,3 +90,80 @@ def run(
 
 def has_exec(name):
     return bool(shutil.which(name))
+
+
+class CancelScope:
+    """Cancellation of concurrent jobs, e.g. the pipelines of
+    ``project._run_concurrently``.
+
+    Once cancelled, the processes the jobs run with `run_streamed`, from
+    within `enter`, are terminated instead of running to their end.
+    """
+
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._processes: set[subprocess.Popen] = set()
+        self._lock = threading.Lock()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled.set()
+            processes = list(self._processes)
+        for process in processes:
+            process.terminate()
+
+    @contextmanager
+    def enter(self):
+        """Make the processes of `run_streamed` from the current thread part
+        of the scope."""
+        previous = getattr(_local, "scope", None)
+        _local.scope = self
+        try:
+            yield self
+        finally:
+            _local.scope = previous
+
+    def _add(self, process: subprocess.Popen) -> bool:
+        with self._lock:
+            if self._cancelled.is_set():
+                return False
+            self._processes.add(process)
+            return True
+
+    def _discard(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.discard(process)
+
+
+def run_streamed(cmd, cwd=None, env=None):
+    """Run ``cmd``, printing its output with `ui.echo` line by line, as it
+    comes, so that it is labelled or captured like the other messages of the
+    thread (see `ui.label_output`, `ui.capture_output`).
+
+    Within a `CancelScope`, the process is terminated when the scope gets
+    cancelled. Raises `subprocess.CalledProcessError` when it fails.
+    """
+    process = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    scope = getattr(_local, "scope", None)
+    if scope is not None and not scope._add(process):
+        process.terminate()
+    try:
+        assert process.stdout is not None
+        for line in process.stdout:
+            ui.echo(line.rstrip("\n"), err=True)
+        returncode = process.wait()
+    finally:
+        if scope is not None:
+            scope._discard(process)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
@@ -0,0 +1,125 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""Local cache of the ``.patch`` files of the PRs applied as patches.
+
+A PR applied as a patch is a ``curl -sSL <url> | git am ...`` command in the
+``shell_command_after`` of its repo: each aggregation would download it again,
+one patch after the other. `prefetch` downloads them all at once beforehand,
+and `local_commands` has the commands read the downloaded files instead.
+
+The files are named after the head commit of their PR: a patch whose commit
+is known and already downloaded is not asked for again. Otherwise, the last
+download is revalidated with its ``ETag``.
+"""
+
+import hashlib
+import logging
+import re
+import shlex
+import tempfile
+from collections.abc import Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from . import gh_api
+from .cache import JsonCache
+from .click import DEFAULT_MAX_WORKERS
+from .misc import get_cache_path
+
+logger = logging.getLogger(__name__)
+
+#: The download of a patch, in a ``shell_command_after``
+PATCH_CMD_RE = re.compile(
+    r"curl -sSL (?P<url>https://github\.com/\S+/pull/\d+\.patch)(?=\s*\|)"
+)
+DIR_NAME = "patches"
+#: url -> the ``etag`` and ``file`` of its last download
+downloads = JsonCache("patches.json")
+
+
+def patch_urls(commands: Iterable[str]) -> list[str]:
+    """Return the URLs of the patches downloaded by ``commands``."""
+    return [
+        match["url"] for cmd in commands if (match := PATCH_CMD_RE.search(str(cmd)))
+    ]
+
+
+def _path(key: str) -> Path:
+    return get_cache_path() / DIR_NAME / f"{key}.patch"
+
+
+def _write(path: Path, content: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as fobj:
+        fobj.write(content)
+    Path(fobj.name).replace(path)
+
+
+def fetch(url: str, sha: str | None = None) -> Path:
+    """Return the local file of the patch at ``url``, downloading it if needed.
+
+    :param sha: the head commit of the PR, if known: its patch is then only
+        downloaded once
+
+    Raises ``requests.RequestException`` or `OSError` on failure.
+    """
+    if sha and (path := _path(sha)).is_file():
+        return path
+    entry = downloads.lookup(url)
+    last = entry.value if entry and isinstance(entry.value, dict) else {}
+    headers = {}
+    cached = _path(last["file"]) if last.get("file") else None
+    if cached and cached.is_file() and last.get("etag"):
+        headers["If-None-Match"] = last["etag"]
+    response = gh_api.get_client().get(url, headers=headers)
+    if cached and headers and response.status_code == 304:
+        content = cached.read_bytes()
+        etag = last["etag"]
+    else:
+        content = response.content
+        etag = response.headers.get("ETag")
+    key = sha or hashlib.sha256(content).hexdigest()
+    path = _path(key)
+    if path != cached or not path.is_file():
+        _write(path, content)
+    downloads.set(url, {"etag": etag, "file": key})
+    return path
+
+
+def prefetch(
+    urls: Mapping[str, str | None], max_workers: int = DEFAULT_MAX_WORKERS
+) -> dict[str, Path]:
+    """Fetch the patches of ``urls``, mapped to the head commit of their PR
+    if known, all at once (see `fetch`), and return their file by URL.
+
+    Like the other caches, a failure is only logged: the patches that could
+    not be fetched are left out.
+    """
+
+    def fetch_or_none(url):
+        try:
+            return fetch(url, urls[url])
+        except (requests.RequestException, OSError) as exc:
+            logger.debug("Cannot prefetch %s: %s", url, exc)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        paths = dict(zip(urls, pool.map(fetch_or_none, urls), strict=True))
+    return {url: path for url, path in paths.items() if path is not None}
+
+
+def local_commands(commands: Iterable[str], paths: Mapping[str, Path]) -> list[str]:
+    """Return ``commands`` reading the patches of ``paths``, by URL, from their
+    file instead of downloading them."""
+
+    def read_file(match):
+        if match["url"] not in paths:
+            return match[0]
+        return f"cat {shlex.quote(str(paths[match['url']]))}"
+
+    return [PATCH_CMD_RE.sub(read_file, str(cmd), count=1) for cmd in commands]
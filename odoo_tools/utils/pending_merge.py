@@ -1,11 +1,22 @@
 # Copyright 2017 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import hashlib
+import json
 import logging
 import os
 import re
-from collections.abc import Iterator
+import tempfile
+from collections.abc import Callable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass, field
+from datetime import timedelta
 from pathlib import Path
 
 import click
@@ -14,17 +25,21 @@ from ruamel.yaml.comments import CommentedMap, CommentedSeq
 
 from ..exceptions import PathNotFound
 from ..utils.misc import get_docker_image_commit_hashes
-from . import gh, git, ui
+from . import aggregator, gh, gh_api, git, patch_cache, ui
+from .cache import JsonCache
+from .click import DEFAULT_MAX_WORKERS
 from .config import config
 from .os_exec import run
 from .path import build_path
 from .proj import get_project_id, get_project_manifest_key
 from .yaml import (
-    append_seq_item_with_comments,
-    remove_seq_item_with_comments,
+    clear_documents,
+    document_lock,
+    dump_document,
+    edit_seq_with_comments,
+    load_document,
     sequence_item_indent,
     yaml_dump,
-    yaml_load,
 )
 
 logger = logging.getLogger(__name__)
@@ -65,6 +80,11 @@ class PendingPR:
     def url(self) -> str:
         return f"https://github.com/{self.owner}/{self.repo}/pull/{self.pr}"
 
+    @property
+    def key(self) -> tuple[str, str, int]:
+        """The ``(owner, repo, number)`` identifying the PR on GitHub."""
+        return self.owner, self.repo or self._repo.name, self.pr
+
     @property
     def is_enriched(self) -> bool:
         return self.state is not None
@@ -88,10 +108,11 @@ class PendingPR:
 
     def remove_from_merges_file(self) -> None:
         """Drop this pull request from its repo's pending-merges file."""
-        if self.is_patch:
-            self._repo.remove_pending_pull_from_patches(self.owner, self.pr)
-        else:
-            self._repo.remove_pending_pull(self.owner, self.pr)
+        with document_lock:
+            if self.is_patch:
+                self._repo.remove_pending_pull_from_patches(self.owner, self.pr)
+            else:
+                self._repo.remove_pending_pull(self.owner, self.pr)
 
     def enrich_with_github(self) -> None:
         """Fetch the PR's GitHub state and update this instance in place.
@@ -103,6 +124,21 @@ class PendingPR:
         data = self._repo.api_get(
             f"/pulls/{self.pr}", upstream=self.owner, repo=self.repo
         )
+        self.update_from_github(data)
+
+    def github_data(self) -> dict:
+        """Return the GitHub data of the PR, as `update_from_github` takes it."""
+        return {
+            "state": self.state,
+            "merged": self.merged,
+            "labels": [{"name": label} for label in self.labels],
+            "number": self.number,
+            "title": self.title,
+            "updated_at": self.updated_at,
+        }
+
+    def update_from_github(self, data: dict) -> None:
+        """Update this instance from the GitHub API data of the PR."""
         self.state = data.get("state") or ""
         self.merged = bool(data.get("merged"))
         self.labels = [label["name"] for label in data.get("labels") or []]
@@ -111,6 +147,337 @@ class PendingPR:
         self.updated_at = data.get("updated_at")
 
 
+#: The last known GitHub state of pending PRs, by `PendingPR.shortcut`
+pr_state_cache = JsonCache("pull-requests.json")
+#: How long the state of an open PR is trusted, in minutes: by default it is
+#: asked again on each run (cheaply, see `gh_api.ResponseCache`)
+OPEN_PR_TTL_ENV_VAR = "OTOOLS_OPEN_PR_TTL"
+DEFAULT_OPEN_PR_TTL = timedelta(0)
+#: How long the state of a closed, unmerged PR is trusted, in minutes. A
+#: merged PR can't change anymore: its state is trusted forever.
+CLOSED_PR_TTL_ENV_VAR = "OTOOLS_CLOSED_PR_TTL"
+DEFAULT_CLOSED_PR_TTL = timedelta(days=1)
+#: Where the heads of pending PRs are fetched, by owner, repo and number, to
+#: tell from the local history whether they are merged
+PULL_REF_PREFIX = "refs/otools/pull/"
+#: The fingerprint of the inputs of the last aggregation of each repo, by its
+#: path, with the commit it resulted in, see `Repo.rebuild_consolidation_branch`
+aggregation_cache = JsonCache("aggregations.json")
+#: A merges entry pinning a commit rather than naming a ref: only a full SHA,
+#: a branch may well be named like an abbreviated one (e.g. ``cafe123``)
+COMMIT_SHA_RE = re.compile(r"[0-9a-f]{40}")
+#: A ``shell_command_after`` line fetching a commit, see `Repo.add_pending_commit`
+#: (an abbreviated SHA is left out: it can't be resolved remotely, and is
+#: pinned by the command itself)
+FETCH_COMMIT_RE = re.compile(r"git fetch (?P<remote>\S+) (?P<sha>[0-9a-f]{40})")
+#: The suffix of the lock file of a pending-merges file, see `Repo.write_lock`
+LOCK_SUFFIX = ".lock"
+LOCK_HEADER = (
+    "Written by otools-pending after each aggregation: the commits it used.\n"
+    "See `otools-pending outdated` and `otools-pending aggregate --locked`."
+)
+
+
+def _ttl(env_var: str, default: timedelta) -> timedelta:
+    try:
+        return timedelta(minutes=float(os.environ[env_var]))
+    except KeyError:
+        return default
+    except ValueError:
+        logger.warning("Invalid %s, using the default", env_var)
+        return default
+
+
+def _remote_ref_sha(refs: dict[str, str] | None, ref: str) -> str | None:
+    """Return the SHA of ``ref`` among the ``refs`` of `git.ls_remote`, looking
+    for it as git-aggregator does: as a full ref name, a branch, or a tag."""
+    if refs is None:
+        return None
+    for name in (ref, f"refs/heads/{ref}", f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}"):
+        if name in refs:
+            return refs[name]
+    return None
+
+
+def _patch_repo_url(pr: PendingPR) -> str:
+    """The URL of the GitHub repository of ``pr``, a PR applied as a patch."""
+    return f"https://github.com/{pr.owner}/{pr.repo}.git"
+
+
+def _resolve_refs(inputs: list[tuple[str, str]], partial=False) -> list[dict] | None:
+    """Return the SHA of each ``(url, ref)`` of ``inputs``, as a list of
+    ``{"url": ..., "ref": ..., "sha": ...}``, or None if one can't be resolved
+    (unless ``partial``: its SHA is None then).
+
+    The refs are asked for with one ``git ls-remote`` per URL, all at once;
+    the commits are taken as they are.
+    """
+    # url -> refs to ask for
+    wanted: dict[str, list[str]] = {}
+    for url, ref in inputs:
+        if not COMMIT_SHA_RE.fullmatch(ref):
+            wanted.setdefault(url, []).append(ref)
+    listed = {}
+    if wanted:
+        with ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS) as pool:
+            listed = dict(
+                zip(
+                    wanted,
+                    pool.map(lambda url: git.ls_remote(url, *wanted[url]), wanted),
+                    strict=True,
+                )
+            )
+    refs = []
+    for url, ref in inputs:
+        if COMMIT_SHA_RE.fullmatch(ref):
+            sha = ref
+        else:
+            sha = _remote_ref_sha(listed[url], ref)
+        if sha is None and not partial:
+            return None
+        refs.append({"url": url, "ref": ref, "sha": sha})
+    return refs
+
+
+def _cached_github_data(pr: PendingPR) -> dict | None:
+    """Return the GitHub data of ``pr`` remembered from an earlier run, if
+    its state can still be trusted."""
+    entry = pr_state_cache.lookup(pr.shortcut)
+    if entry is None or not isinstance(entry.value, dict):
+        return None
+    data = entry.value
+    if data.get("merged"):
+        return data
+    if data.get("state") == "closed":
+        ttl = _ttl(CLOSED_PR_TTL_ENV_VAR, DEFAULT_CLOSED_PR_TTL)
+    else:
+        ttl = _ttl(OPEN_PR_TTL_ENV_VAR, DEFAULT_OPEN_PR_TTL)
+    return data if entry.age < ttl else None
+
+
+def enrich_pull_requests(
+    prs: list[PendingPR],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    refresh=False,
+    from_history=False,
+) -> Iterator[tuple[PendingPR, BaseException | None]]:
+    """Enrich ``prs`` with their GitHub state, ``max_workers`` calls at a time,
+    no more than the connections of the shared client (see
+    `gh_api.MAX_POOL_SIZE`).
+
+    The state of each PR is remembered in `pr_state_cache`: only the PRs
+    whose state may have changed since are looked up again (see
+    `OPEN_PR_TTL_ENV_VAR` and `CLOSED_PR_TTL_ENV_VAR`), or all of them with
+    ``refresh``.
+
+    They are looked up with batched GraphQL queries (see
+    `gh.pull_requests_info`), falling back on one REST call per PR (see
+    `PendingPR.enrich_with_github`) without a ``GITHUB_TOKEN``, or for the PRs
+    a query didn't answer.
+
+    With ``from_history``, the PRs the local git history of their repo shows
+    as merged (see `detect_merged_prs`) are not looked up at all: only the
+    ``merged`` state of those is known.
+
+    Yields each PR as soon as it is enriched, with the exception raised on
+    failure, or None: the state of a failed PR is left unknown.
+    """
+    to_fetch = []
+    for pr in prs:
+        data = None if refresh else _cached_github_data(pr)
+        if data is None:
+            to_fetch.append(pr)
+            continue
+        pr.update_from_github(data)
+        yield pr, None
+    fetched = {}
+    try:
+        if from_history and to_fetch:
+            merged = detect_merged_prs(to_fetch, max_workers)
+            for pr in merged:
+                pr.update_from_github(
+                    {"state": "closed", "merged": True, "number": pr.pr}
+                )
+                # A merged PR stays merged: not checked again on the next runs
+                fetched[pr.shortcut] = pr.github_data()
+                yield pr, None
+            to_fetch = [pr for pr in to_fetch if pr not in merged]
+        for pr, error in _fetch_pull_requests(to_fetch, max_workers):
+            if error is None:
+                fetched[pr.shortcut] = pr.github_data()
+            yield pr, error
+    finally:
+        pr_state_cache.update(fetched)
+
+
+def _fetch_pull_requests(
+    prs: list[PendingPR], max_workers: int
+) -> Iterator[tuple[PendingPR, BaseException | None]]:
+    # A thread more than the connections would only wait for one
+    max_workers = min(max_workers, gh_api.get_client().pool_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        calls = {}
+        for start in range(0, len(prs), gh.GRAPHQL_PR_BATCH_SIZE):
+            batch = prs[start : start + gh.GRAPHQL_PR_BATCH_SIZE]
+            keys = [pr.key for pr in batch]
+            calls[pool.submit(gh.pull_requests_info, keys)] = batch
+        pending = set(calls)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                prs_or_pr = calls.pop(future)
+                if isinstance(prs_or_pr, PendingPR):
+                    yield prs_or_pr, future.exception()
+                    continue
+                answers = future.result()
+                for pr in prs_or_pr:
+                    if (data := answers.get(pr.key)) is None:
+                        # The REST API for the PRs the query didn't answer
+                        rest_call = pool.submit(pr.enrich_with_github)
+                        calls[rest_call] = pr
+                        pending.add(rest_call)
+                        continue
+                    pr.update_from_github(data)
+                    yield pr, None
+
+
+def detect_merged_prs(
+    prs: list[PendingPR], max_workers: int = DEFAULT_MAX_WORKERS
+) -> list[PendingPR]:
+    """Return which of ``prs`` the local git history of their repos shows as
+    merged (see `Repo.merged_prs_from_history`), ``max_workers`` repos at a
+    time.
+
+    A repo whose history can't be checked is only logged: the GitHub API then
+    has to tell about its PRs.
+    """
+    by_repo: dict[Repo, list[PendingPR]] = {}
+    for pr in prs:
+        by_repo.setdefault(pr._repo, []).append(pr)
+    merged = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        calls = {
+            pool.submit(repo.merged_prs_from_history, repo_prs): repo
+            for repo, repo_prs in by_repo.items()
+        }
+        for future, repo in calls.items():
+            try:
+                merged += future.result()
+            except Exception as exc:
+                logger.debug("Cannot check the history of %s: %s", repo.name, exc)
+    return merged
+
+
+def purge_merged_prs_of(
+    repos: list["Repo"], max_workers: int = DEFAULT_MAX_WORKERS, refresh=False
+) -> Iterator[PendingPR]:
+    """Remove the merged pull requests of ``repos`` from their pending-merges
+    files, like `Repo.purge_merged_prs` does for one repo, but looking them
+    all up at once: the histories of the repos are checked ``max_workers`` at
+    a time, and the other PRs are asked to GitHub in batches.
+
+    Yields the merged PRs as soon as they are known. Each file is written
+    once, and the repos left without any PR are then disposed of.
+    """
+    prs = [pr for repo in repos for pr in repo._iter_pending_pull_requests()]
+    with ExitStack() as transactions:
+        for repo in repos:
+            transactions.enter_context(repo.transaction())
+        for pr, error in enrich_pull_requests(
+            prs, max_workers=max_workers, refresh=refresh, from_history=True
+        ):
+            if error is not None:
+                # Left in place: we can't tell whether it was merged
+                logger.warning("Could not get status of %s: %s", pr.shortcut, error)
+                continue
+            if not pr.merged:
+                continue
+            pr.remove_from_merges_file()
+            yield pr
+    for repo in repos:
+        if not repo.has_any_pr_left():
+            repo._handle_empty_merges_file()
+
+
+class MergesTransaction:
+    """Changes to a pending-merges file, written at once, see `Repo.transaction`.
+
+    The lines removed from and appended to the sequences of the repo's config
+    (e.g. ``merges``) are collected, and applied in a single comment-preserving
+    pass per sequence (see `yaml.edit_seq_with_comments`) on `commit`. The
+    side effects registered with `on_commit` only run once the file is written.
+    """
+
+    def __init__(self, path: Path, config_key: str):
+        self.path = path
+        self.config_key = config_key
+        # The document of the file, or a new one for a file yet to be created
+        self.data = (load_document(path) if path.exists() else None) or CommentedMap()
+        # Whether the document was changed in place, and must be written
+        self.dirty = False
+        # sequence name -> removed values / appended (value, comment lines)
+        self._removed: dict[str, list[str]] = {}
+        self._appended: dict[str, list[tuple[str, list[str]]]] = {}
+        # sequences whose key is dropped, rather than left empty, once empty
+        self._drop_empty: set[str] = set()
+        # run after the file is written, not at all when the transaction aborts
+        self._on_commit: list[Callable[[], None]] = []
+
+    def lines(self, name: str) -> list[str]:
+        """Return the values of the sequence ``name``, as they are once the
+        transaction is committed."""
+        config = self.data.get(self.config_key) or {}
+        removed = self._removed.get(name, [])
+        lines = [line for line in config.get(name) or [] if line not in removed]
+        return lines + [value for value, __ in self._appended.get(name, [])]
+
+    def remove(self, name: str, value: str, drop_empty: bool = False):
+        if value in self.lines(name):
+            self._removed.setdefault(name, []).append(value)
+            if drop_empty:
+                self._drop_empty.add(name)
+
+    def append(self, name: str, value: str, comment: list[str] | None = None):
+        if value not in self.lines(name):
+            self._appended.setdefault(name, []).append((value, comment or []))
+
+    def on_commit(self, callback: Callable[[], None]):
+        """Run ``callback`` once the transaction is committed, e.g. to change
+        the submodule's config only along with its merges file."""
+        self._on_commit.append(callback)
+
+    def commit(self):
+        names = dict.fromkeys([*self._removed, *self._appended])
+        config = self.data.get(self.config_key)
+        if config is None:
+            if not self._appended:
+                # Nothing to remove from a repo without config
+                names = {}
+            else:
+                config = self.data[self.config_key] = CommentedMap()
+        for name in names:
+            seq = config.get(name) or CommentedSeq()
+            edit_seq_with_comments(
+                seq,
+                remove=self._removed.get(name, []),
+                append=self._appended.get(name, []),
+                comment_indent=sequence_item_indent(),
+            )
+            if seq or name not in self._drop_empty:
+                config[name] = seq if seq else None
+            else:
+                config.pop(name, None)
+            self.dirty = True
+        if self.dirty:
+            dump_document(self.path, self.data)
+        for callback in self._on_commit:
+            callback()
+
+
+#: The open transactions, by path of their pending-merges file
+_transactions: dict[Path, MergesTransaction] = {}
+
+
 class Repo:
     """Handle checked out repositories and their pending merges."""
 
@@ -121,6 +488,7 @@ class Repo:
         self.ext_src_rel_path = config.ext_src_rel_path
         self.pending_merge_rel_path = config.pending_merge_rel_path
         self.pending_merge_abs_path = build_path(self.pending_merge_rel_path)
+        self.pending_merge_lock = config.pending_merge_lock
         self.path = self.make_repo_path(name_or_path)
         self.abs_path = build_path(self.path)
         # ensure that given submodule is a mature submodule
@@ -177,7 +545,10 @@ class Repo:
 
     def has_pending_merges(self):
         # either empty or commented out
-        return bool(self.abs_merges_path.exists() and self.merges_config())
+        return bool(
+            (self.abs_merges_path in _transactions or self.abs_merges_path.exists())
+            and self.merges_config()
+        )
 
     def has_any_pr_left(self):
         if not self.has_pending_merges():
@@ -189,21 +560,65 @@ class Repo:
         return pr_refs or pr_patches
 
     def merges_config(self):
-        data = yaml_load(self.abs_merges_path.read_text()) or {}
+        """Return the config of the repo in its pending-merges file.
+
+        The file is only parsed again when it changed (see
+        `yaml.load_document`): the config is shared by all the callers, who
+        must change it under `yaml.document_lock`, and write it with
+        `update_merges_config`. Within a `transaction`, the lines it removes or
+        appends show in `MergesTransaction.lines` only, until it is committed.
+        """
+        if transaction := _transactions.get(self.abs_merges_path):
+            data = transaction.data
+        else:
+            data = load_document(self.abs_merges_path) or {}
+        return data.get(self.config_key, {})
+
+    @property
+    def config_key(self) -> str:
+        """The key of the repo's config in its pending-merges file."""
         # FIXME: this should be relative
         # to the position of the pending merge folder
-        repo_relpath = ".." / self.path
-        return data.get(repo_relpath.as_posix(), {})
+        return (".." / self.path).as_posix()
 
     def update_merges_config(self, config):
-        # get former config if any
-        if self.abs_merges_path.exists():
-            data = yaml_load(self.abs_merges_path.read_text())
-        else:
-            data = {}
-        data[(".." / self.path).as_posix()] = config
-        with self.abs_merges_path.open("w") as fobj:
-            yaml_dump(data, fobj)
+        with self.transaction() as transaction:
+            transaction.data[self.config_key] = config
+            transaction.dirty = True
+
+    @contextmanager
+    def transaction(self):
+        """Group the changes to the pending-merges file made within, through
+        this or any other `Repo` of the same file.
+
+        The pull requests removed and added (see `MergesTransaction`) are
+        applied in one pass, and the file is written once, on leaving the
+        block. On error, none of the changes is written.
+        """
+        path = self.abs_merges_path
+        with document_lock:
+            transaction = _transactions.get(path)
+            if transaction is None:
+                transaction = MergesTransaction(path, self.config_key)
+                _transactions[path] = transaction
+                outer = True
+            else:
+                outer = False
+        if not outer:
+            # Part of the enclosing one
+            yield transaction
+            return
+        try:
+            yield transaction
+            with document_lock:
+                transaction.commit()
+        except BaseException:
+            # Drop the changes made in place to the shared document
+            clear_documents(path)
+            raise
+        finally:
+            with document_lock:
+                _transactions.pop(path, None)
 
     def api_url(self, upstream=None, repo=None):
         return f"https://api.github.com/repos/{upstream or self.company_git_remote}/{repo or self.name}"
@@ -212,20 +627,17 @@ class Repo:
         """Get ``path`` (eg. ``/pulls/1234``) under this repo's GitHub API
         endpoint and return the decoded JSON.
 
-        Raises ``requests.RequestException`` (eg. ``HTTPError`` on a missing PR
-        or a rate-limit 403, or a timeout/connection error) on failure; callers
-        are expected to catch and decide how to surface it.
+        Goes through the shared `gh_api.GitHubClient`, which retries
+        rate-limited and failing calls, and only downloads a response again
+        when it changed since the last call. Raises ``requests.RequestException``
+        (eg. ``HTTPError`` on a missing PR or once the retries are exhausted)
+        on failure; callers are expected to catch and decide how to surface it.
         """
-        headers = {}
-        if token := os.environ.get("GITHUB_TOKEN"):
-            headers["Authorization"] = f"token {token}"
-        response = requests.get(
+        client = gh_api.get_client()
+        return client.get_json(
             self.api_url(upstream=upstream, repo=repo) + path,
-            headers=headers,
-            timeout=30,
+            headers=client.auth_headers(),
         )
-        response.raise_for_status()
-        return response.json()
 
     def ssh_url(self, namespace=None):
         namespace = namespace or self.company_git_remote
@@ -282,8 +694,12 @@ class Repo:
                 base_merge = f"{upstream} {hashes[self.name.lower()]}"
 
         config.insert(2, "merges", CommentedSeq([base_merge]))
-        self.update_merges_config(config)
-        git.submodule_set_url(self.path, remote_company_url)
+        with self.transaction() as transaction:
+            self.update_merges_config(config)
+            # Not to point the submodule to the fork if the file is not written
+            transaction.on_commit(
+                lambda: git.submodule_set_url(self.path, remote_company_url)
+            )
 
     def update_pending_merges_file_base_merge(self, skip_questions: bool = False):
         """Checks that the base merge for an odoo/enterprise repository us up-to-date"""
@@ -359,55 +775,46 @@ class Repo:
         return comment
 
     def _add_pending_pull_request(self, upstream, pull_id):
-        conf = self.merges_config()
         pending_mrg_line = f"{upstream} refs/pull/{pull_id}/head"
-        if pending_mrg_line in conf.get("merges", {}):
-            ui.echo(
-                f"Requested pending merge is already mentioned in {self.abs_merges_path} "
+        with self.transaction() as transaction:
+            if pending_mrg_line in transaction.lines("merges"):
+                ui.echo(
+                    f"Requested pending merge is already mentioned in {self.abs_merges_path} "
+                )
+                return True
+
+            comment = self._prepare_pending_pull_request_comment_lines(
+                upstream, pull_id
             )
-            return True
-
-        comment = self._prepare_pending_pull_request_comment_lines(upstream, pull_id)
-
-        known_remotes = conf["remotes"]
-        if upstream not in known_remotes:
-            known_remotes.insert(0, upstream, self.ssh_url(upstream))
-        # Append the new pending merge at the end of the list, keeping the
-        # comment blocks of the existing entries anchored to them, and aligning
-        # the new comment with the merge items.
-        append_seq_item_with_comments(
-            conf["merges"],
-            pending_mrg_line,
-            comment=comment,
-            comment_indent=sequence_item_indent(),
-        )
-        self.update_merges_config(conf)
+
+            known_remotes = self.merges_config()["remotes"]
+            if upstream not in known_remotes:
+                known_remotes.insert(0, upstream, self.ssh_url(upstream))
+                transaction.dirty = True
+            # Append the new pending merge at the end of the list, keeping the
+            # comment blocks of the existing entries anchored to them, and
+            # aligning the new comment with the merge items.
+            transaction.append("merges", pending_mrg_line, comment=comment)
         return True
 
     def _add_pending_pull_request_patch(self, upstream, pull_id):
-        conf = self.merges_config()
         patch_url = f"https://github.com/{upstream}/{self.name}/pull/{pull_id}.patch"
         line = f"curl -sSL {patch_url} | git am -3 --keep-non-patch --exclude '*requirements.txt'"
-        patches = conf.get("shell_command_after") or CommentedSeq()
-        if line in patches:
-            ui.echo(
-                f"{self.abs_merges_path} already contains a reference to {patch_url}"
+        with self.transaction() as transaction:
+            if line in transaction.lines("shell_command_after"):
+                ui.echo(
+                    f"{self.abs_merges_path} already contains a reference to {patch_url}"
+                )
+                return True
+
+            comment = self._prepare_pending_pull_request_comment_lines(
+                upstream, pull_id
             )
-            return True
-
-        comment = self._prepare_pending_pull_request_comment_lines(upstream, pull_id)
-
-        # Append the new patch at the end of the list, keeping the comment
-        # blocks of the existing entries anchored to them, and aligning the new
-        # comment with the shell command items.
-        append_seq_item_with_comments(
-            patches,
-            line,
-            comment=comment,
-            comment_indent=sequence_item_indent(),
-        )
-        conf["shell_command_after"] = patches
-        self.update_merges_config(conf)
+
+            # Append the new patch at the end of the list, keeping the comment
+            # blocks of the existing entries anchored to them, and aligning the
+            # new comment with the shell command items.
+            transaction.append("shell_command_after", line, comment=comment)
         ui.echo(f"📋 patch {patch_url} has been added")
         return True
 
@@ -436,7 +843,6 @@ class Repo:
             ]
 
     def add_pending_commit(self, upstream, commit_sha, skip_questions=True):
-        conf = self.merges_config()
         # TODO search in local git history for full hash
         if len(commit_sha) < 40:
             ui.ask_or_abort(
@@ -447,105 +853,113 @@ class Repo:
         fetch_commit_line, pending_mrg_line = self._get_pending_commit_lines(
             upstream, commit_sha
         )
+        with self.transaction() as transaction:
+            if pending_mrg_line in transaction.lines("shell_command_after"):
+                ui.echo(
+                    f"Requested pending merge is mentioned in {self.abs_merges_path} already"
+                )
+                return True
 
-        if pending_mrg_line in conf.get("shell_command_after", {}):
-            ui.echo(
-                f"Requested pending merge is mentioned in {self.abs_merges_path} already"
-            )
-            return True
-        if "shell_command_after" not in conf:
-            conf["shell_command_after"] = CommentedSeq()
-
-        # TODO propose a default comment format
-        comment = ""
-        if not skip_questions:
-            comment = input(
-                "Comment? (would appear just above new pending merge, optional):\n"
-            )
-        conf["shell_command_after"].extend([fetch_commit_line, pending_mrg_line])
-        # Add a comment in the list of shell commands
-        if comment:
-            pos = conf["shell_command_after"].index(fetch_commit_line)
-            conf["shell_command_after"].yaml_set_comment_before_after_key(
-                pos, before=comment, indent=2
+            # TODO propose a default comment format
+            comment = ""
+            if not skip_questions:
+                comment = input(
+                    "Comment? (would appear just above new pending merge, optional):\n"
+                )
+            # Add the comment above the commands of the commit
+            transaction.append(
+                "shell_command_after",
+                fetch_commit_line,
+                comment=comment.splitlines(),
             )
-        self.update_merges_config(conf)
+            transaction.append("shell_command_after", pending_mrg_line)
         ui.echo(f"📋 cherry pick {upstream}/{commit_sha} has been added")
         return True
 
     def remove_pending_commit(self, upstream, commit_sha):
-        conf = self.merges_config()
         lines_to_drop = self._get_pending_commit_lines(upstream, commit_sha)
-        if lines_to_drop[0] not in conf.get(
-            "shell_command_after", {}
-        ) and lines_to_drop[1] not in conf.get("shell_command_after", {}):
-            ui.exit_msg(
-                f"No such reference found in {self.abs_merges_path},"
-                " having troubles removing that:\n"
-                f"Looking for:\n- {lines_to_drop[0]}\n- {lines_to_drop[1]}"
-            )
-        for line in lines_to_drop:
-            if line in conf["shell_command_after"]:
-                remove_seq_item_with_comments(conf["shell_command_after"], line)
-        if not conf["shell_command_after"]:
-            del conf["shell_command_after"]
-        self.update_merges_config(conf)
+        with self.transaction() as transaction:
+            commands = transaction.lines("shell_command_after")
+            if not any(line in commands for line in lines_to_drop):
+                ui.exit_msg(
+                    f"No such reference found in {self.abs_merges_path},"
+                    " having troubles removing that:\n"
+                    f"Looking for:\n- {lines_to_drop[0]}\n- {lines_to_drop[1]}"
+                )
+            for line in lines_to_drop:
+                transaction.remove("shell_command_after", line, drop_empty=True)
         print(f"✨ cherry pick {upstream}/{commit_sha} has been removed")
 
     def remove_pending_pull(self, upstream, pull_id):
-        conf = self.merges_config()
         line_to_drop = f"{upstream} refs/pull/{pull_id}/head"
-        if line_to_drop not in conf["merges"]:
-            ui.exit_msg(
-                f"No such reference found in {self.abs_merges_path},"
-                " having troubles removing that:\n"
-                f"Looking for: {line_to_drop}"
-            )
-        remove_seq_item_with_comments(conf["merges"], line_to_drop)
-        self.update_merges_config(conf)
+        with self.transaction() as transaction:
+            if line_to_drop not in transaction.lines("merges"):
+                ui.exit_msg(
+                    f"No such reference found in {self.abs_merges_path},"
+                    " having troubles removing that:\n"
+                    f"Looking for: {line_to_drop}"
+                )
+            transaction.remove("merges", line_to_drop)
 
     def remove_pending_pull_from_patches(self, upstream, pull_id):
-        conf = self.merges_config()
-        patches = conf.get("shell_command_after") or []
-        if not patches:
-            return
-        line_bit_to_drop = f"pull/{pull_id}.patch"
-        found = False
-        for line in patches:
-            if line_bit_to_drop in line:
-                remove_seq_item_with_comments(patches, line)
-                found = True
-                break
-        if not found:
-            ui.exit_msg(
-                f"No such reference found in {self.abs_merges_path},"
-                " having troubles removing that:\n"
-                f"Looking for: {line_bit_to_drop}"
-            )
-        conf["shell_command_after"] = patches if patches else None
-        self.update_merges_config(conf)
+        with self.transaction() as transaction:
+            patches = transaction.lines("shell_command_after")
+            if not patches:
+                return
+            line_bit_to_drop = f"pull/{pull_id}.patch"
+            for line in patches:
+                if line_bit_to_drop in line:
+                    transaction.remove("shell_command_after", line)
+                    break
+            else:
+                ui.exit_msg(
+                    f"No such reference found in {self.abs_merges_path},"
+                    " having troubles removing that:\n"
+                    f"Looking for: {line_bit_to_drop}"
+                )
 
     # aggregator API
-    def run_aggregate(self, **kwargs):
-        """Aggregate the pending merges using the git-aggregator CLI.
+    def run_aggregate(self, config=None, **kwargs):
+        """Aggregate the pending merges with git-aggregator.
 
         The aggregation happens on the local branch declared as ``target`` in
         the merges file, which acts as a local scratch branch: pushing the
         result to a permanent, dynamically named remote branch is handled
         separately by :meth:`push_to_remote`.
 
-        Extra keyword arguments are passed through to :func:`run`.
+        :param config: the config to aggregate instead of the one of the
+            merges file (e.g. `locked_config`)
+
+        git-aggregator runs in process, on the config already loaded, and the
+        time taken by each phase is returned (see `aggregator.aggregate`).
+        Unless `aggregator.IN_PROCESS_ENV_VAR` is ``0``: then the
+        ``gitaggregate`` command is run, extra keyword arguments being passed
+        through to :func:`run`, and None is returned.
         """
+        if aggregator.is_enabled():
+            if kwargs.get("verbose", True):
+                ui.echo(f"Aggregating {self.path}", fg="bright_black")
+            # Where gitaggregate finds the repo, see below
+            return aggregator.aggregate(
+                self.pending_merge_abs_path / self.config_key,
+                self.merges_config() if config is None else config,
+            )
         # The merges file keys are paths relative to the pending-merges
         # folder (e.g. ``../odoo/external-src/<name>``), and gitaggregate
         # resolves them against the process working directory.
         kwargs.setdefault("cwd", self.pending_merge_abs_path)
         kwargs.setdefault("check", True)
         kwargs.setdefault("verbose", True)
-        run(
-            ["gitaggregate", "--config", str(self.abs_merges_path), "aggregate"],
-            **kwargs,
-        )
+        if config is None:
+            run(
+                ["gitaggregate", "--config", str(self.abs_merges_path), "aggregate"],
+                **kwargs,
+            )
+            return
+        with tempfile.NamedTemporaryFile("w", suffix=".yml") as fobj:
+            yaml_dump({self.config_key: config}, fobj)
+            fobj.flush()
+            run(["gitaggregate", "--config", fobj.name, "aggregate"], **kwargs)
 
     def _iter_pending_pull_requests(self) -> Iterator[PendingPR]:
         merges_config = self.merges_config()
@@ -589,29 +1003,65 @@ class Repo:
                 is_patch=True,
             )
 
-    def purge_merged_prs(self) -> Iterator[PendingPR]:
+    def merged_prs_from_history(self, prs: list[PendingPR]) -> list[PendingPR]:
+        """Return which of ``prs``, pending PRs of this repo, its local git
+        history shows as merged into the base branch (see `git.is_merged_into`).
+
+        The heads of the PRs are fetched under `PULL_REF_PREFIX` together with
+        the base branch, one fetch per remote, without going through the GitHub
+        API. A failed fetch leaves the refs of an earlier run, if any. The PRs
+        not returned are the ones the history can't tell about.
+        """
+        if not prs or not git.is_toplevel(self.abs_path):
+            return []
+        # Run from worker threads: read the shared config at once
+        with document_lock:
+            merges_config = self.merges_config()
+            remotes = dict(merges_config.get("remotes") or {})
+            # The first ``merges`` entry is the base ref (e.g. ``OCA 16.0``)
+            base = str((merges_config.get("merges") or [""])[0]).split()
+        if len(base) != 2 or base[0] not in remotes:
+            return []
+        base_remote, base_branch = base
+        base_ref = f"refs/remotes/{base_remote}/{base_branch}"
+        urls_by_repo = {}
+        for url in remotes.values():
+            try:
+                urls_by_repo.setdefault(gh.parse_remote_url(url), url)
+            except ValueError:
+                continue
+        refspecs = {remotes[base_remote]: [f"+refs/heads/{base_branch}:{base_ref}"]}
+        head_refs = {}
+        for pr in prs:
+            owner, repo, number = pr.key
+            url = urls_by_repo.get((owner, repo)) or self.build_ssh_url(owner, repo)
+            head_refs[pr.key] = f"{PULL_REF_PREFIX}{owner}/{repo}/{number}"
+            refspecs.setdefault(url, []).append(
+                f"+refs/pull/{number}/head:{head_refs[pr.key]}"
+            )
+        for url, url_refspecs in refspecs.items():
+            git.fetch_targeted(self.abs_path, url, *url_refspecs)
+        return [
+            pr
+            for pr in prs
+            if git.is_merged_into(self.abs_path, head_refs[pr.key], base_ref)
+        ]
+
+    def purge_merged_prs(self, refresh=False) -> Iterator[PendingPR]:
         """Remove merged pull requests from the pending-merges file.
 
-        Iterates the local pending-merges, enriches each one via the GitHub
-        API, and yields the merged ones as soon as they are removed so that
-        callers can report progress in real time.
+        Iterates the local pending-merges, enriches them via the GitHub API
+        unless the local history shows them merged (see `enrich_pull_requests`,
+        and ``refresh`` to ignore the states known from earlier runs), and
+        yields the merged ones as soon as they are known so that callers can
+        report progress in real time. The file is written once, with all the
+        removals (see `transaction`).
 
         A PR whose GitHub status can't be fetched (rate limit, timeout, …) is
         left in place: we can't tell whether it was merged, so removing it
-        would be unsafe.
+        would be unsafe. See `purge_merged_prs_of` for many repos at once.
         """
-        for pr in self._iter_pending_pull_requests():
-            try:
-                pr.enrich_with_github()
-            except requests.RequestException as exc:
-                logger.warning("Could not get status of %s: %s", pr.shortcut, exc)
-                continue
-            if not pr.merged:
-                continue
-            pr.remove_from_merges_file()
-            yield pr
-        if not self.has_any_pr_left():
-            self._handle_empty_merges_file()
+        yield from purge_merged_prs_of([self], refresh=refresh)
 
     def _handle_empty_merges_file(self):
         """Reset the submodule to the upstream branch and drop the merges file.
@@ -638,8 +1088,9 @@ class Repo:
             git.submodule_set_url(self.path, new_remote_url, remote=remote)
         git.checkout(odoo_version, remote=remote, cwd=self.abs_path)
         self.abs_merges_path.unlink(missing_ok=True)
+        self.abs_lock_path.unlink(missing_ok=True)
 
-    def push_to_remote(self, target_branch=None):
+    def push_to_remote(self, target_branch=None, verbose=True):
         """Push the aggregated HEAD to the company remote as ``target_branch``.
 
         The branch name embeds the project commit hash, giving the aggregated
@@ -656,13 +1107,326 @@ class Repo:
             f"git push -f {self.company_git_remote} HEAD:refs/heads/{target_branch}",
             cwd=self.abs_path,
             check=True,
-            verbose=True,
+            verbose=verbose,
+        )
+
+    @property
+    def abs_lock_path(self) -> Path:
+        """The lock file of the repo, next to its pending-merges file (see
+        `write_lock`)."""
+        return self.abs_merges_path.with_suffix(LOCK_SUFFIX)
+
+    def _aggregation_inputs(self) -> list[tuple[str, str]] | None:
+        """Return the ``(url, ref)`` of each commit the aggregation of the repo
+        uses: its merges, the head of each PR it applies as a patch, and the
+        commits fetched by its ``shell_command_after``. None when a merge
+        names an unknown remote."""
+        config = self.merges_config()
+        if not config:
+            return None
+        remotes = config.get("remotes") or {}
+        inputs = []
+        for line in config.get("merges") or []:
+            remote, __, ref = str(line).partition(" ")
+            if remote not in remotes:
+                return None
+            inputs.append((str(remotes[remote]), ref))
+        for pr in self._iter_pending_pull_requests():
+            if pr.is_patch:
+                inputs.append((_patch_repo_url(pr), f"refs/pull/{pr.pr}/head"))
+        for cmd in config.get("shell_command_after") or []:
+            match = FETCH_COMMIT_RE.fullmatch(str(cmd).strip())
+            if match and match["remote"] in remotes:
+                inputs.append((str(remotes[match["remote"]]), match["sha"]))
+        return inputs
+
+    def resolve_aggregation_inputs(self) -> list[dict] | None:
+        """Return the commits the aggregation of the repo uses (see
+        `_aggregation_inputs`), as ``{"url": ..., "ref": ..., "sha": ...}``.
+
+        The refs are resolved with one ``git ls-remote`` per remote, without
+        fetching anything. Returns None when one of them can't be resolved.
+        """
+        inputs = self._aggregation_inputs()
+        if inputs is None:
+            return None
+        return _resolve_refs(inputs)
+
+    def _fingerprint(self, refs: list[dict]) -> str:
+        config = self.merges_config()
+        inputs = {
+            "refs": [[ref["url"], ref["ref"], ref["sha"]] for ref in refs],
+            "remotes": {
+                str(name): str(url)
+                for name, url in (config.get("remotes") or {}).items()
+            },
+            "target": str(config.get("target") or ""),
+            "shell_command_after": [
+                str(cmd) for cmd in config.get("shell_command_after") or []
+            ],
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def aggregation_fingerprint(self) -> str | None:
+        """Return a digest of everything the aggregation of the repo depends
+        on: the SHA of each commit it uses (see `resolve_aggregation_inputs`),
+        its remotes, its target and its ``shell_command_after``.
+
+        Returns None when one of the commits can't be resolved.
+        """
+        refs = self.resolve_aggregation_inputs()
+        return None if refs is None else self._fingerprint(refs)
+
+    def read_lock(self) -> list[dict] | None:
+        """Return the commits recorded by `write_lock`, or None without a lock."""
+        if not self.abs_lock_path.exists():
+            return None
+        data = load_document(self.abs_lock_path) or {}
+        return [
+            {key: str(ref[key]) for key in ("url", "ref", "sha")}
+            for ref in data.get("refs") or []
+        ]
+
+    def write_lock(self, refs: list[dict]):
+        """Record ``refs``, the commits an aggregation used, in the lock file."""
+        data = CommentedMap(refs=[dict(ref) for ref in refs])
+        data.yaml_set_start_comment(LOCK_HEADER)
+        dump_document(self.abs_lock_path, data)
+
+    def lock_changes(self) -> list[tuple[str, str, str | None, str | None]] | None:
+        """Return the ``(url, ref, locked SHA, current SHA)`` of each commit of
+        the aggregation that is not the one of the lock file anymore, asking
+        the remotes with one ``git ls-remote`` each, without fetching anything.
+
+        The locked SHA is None for a commit added since the lock file was
+        written, the current one for a commit removed since, or that can't be
+        resolved. Returns None without a lock file.
+
+        Raises `click.ClickException` when the commits of the aggregation are
+        unknown (see `_aggregation_inputs`): all of them would look removed.
+        """
+        locked = self.read_lock()
+        if locked is None:
+            return None
+        inputs = self._aggregation_inputs()
+        if inputs is None:
+            raise click.ClickException(
+                f"The merges of {self.name} can't be resolved:"
+                " no merges config, or a merge names an unknown remote"
+            )
+        locked_shas = {(ref["url"], ref["ref"]): ref["sha"] for ref in locked}
+        changes = []
+        for ref in _resolve_refs(inputs, partial=True) or []:
+            locked_sha = locked_shas.get((ref["url"], ref["ref"]))
+            if locked_sha != ref["sha"]:
+                changes.append((ref["url"], ref["ref"], locked_sha, ref["sha"]))
+        for (url, ref), locked_sha in locked_shas.items():
+            if (url, ref) not in inputs:
+                changes.append((url, ref, locked_sha, None))
+        return changes
+
+    def locked_config(self, refs: list[dict]) -> dict:
+        """Return the merges config with each merge pinned to its commit among
+        ``refs``, for git-aggregator to rebuild exactly that state.
+
+        Raises `click.ClickException` when a merge is not among ``refs``.
+        """
+        config = self.merges_config()
+        remotes = config.get("remotes") or {}
+        shas = {(ref["url"], ref["ref"]): ref["sha"] for ref in refs}
+        merges = []
+        for line in config.get("merges") or []:
+            remote, __, ref = str(line).partition(" ")
+            sha = shas.get((str(remotes.get(remote)), ref))
+            if sha is None:
+                raise click.ClickException(
+                    f"{line} is not in the lock file of {self.name}"
+                )
+            merges.append(f"{remote} {sha}")
+        return dict(config, merges=merges)
+
+    def _check_locked_patches(self, refs: list[dict]):
+        """Raise `click.ClickException` unless the PRs applied as patches are
+        still at their commit among ``refs``: a patch URL can't be pinned."""
+        locked = {(ref["url"], ref["ref"]): ref["sha"] for ref in refs}
+        inputs = [
+            (_patch_repo_url(pr), f"refs/pull/{pr.pr}/head")
+            for pr in self._iter_pending_pull_requests()
+            if pr.is_patch
+        ]
+        current = _resolve_refs(inputs) if inputs else []
+        if current is None:
+            raise click.ClickException(f"Cannot resolve the patches of {self.name}")
+        for ref in current:
+            if locked.get((ref["url"], ref["ref"])) != ref["sha"]:
+                raise click.ClickException(
+                    f"The patch of {ref['url']} {ref['ref']} changed since the "
+                    f"lock file of {self.name} was written"
+                )
+
+    def _with_local_patches(self, config: dict | None, refs: list[dict] | None):
+        """Return ``config``, the merges config if None, with the patches of its
+        ``shell_command_after`` read from the local cache (see `patch_cache`).
+
+        The head commit of each PR applied as a patch is taken from ``refs``
+        (see `resolve_aggregation_inputs`), when given. ``config`` is returned
+        as is when it has no patch to prefetch.
+        """
+        base = self.merges_config() if config is None else config
+        commands = [str(cmd) for cmd in base.get("shell_command_after") or []]
+        urls = patch_cache.patch_urls(commands)
+        if not urls:
+            return config
+        shas = {(ref["url"], ref["ref"]): ref["sha"] for ref in refs or []}
+        pr_shas = {
+            f"https://github.com/{pr.owner}/{pr.repo}/pull/{pr.pr}.patch": shas.get(
+                (_patch_repo_url(pr), f"refs/pull/{pr.pr}/head")
+            )
+            for pr in self._iter_pending_pull_requests()
+            if pr.is_patch
+        }
+        paths = patch_cache.prefetch({url: pr_shas.get(url) for url in urls})
+        if not paths:
+            return config
+        return dict(
+            base, shell_command_after=patch_cache.local_commands(commands, paths)
         )
 
-    def rebuild_consolidation_branch(self, push=False, target_branch=None):
-        self.run_aggregate()
+    def _reuse_aggregation(self, fingerprint: str) -> dict | None:
+        """Check out the commit of the last aggregation again if it had the same
+        ``fingerprint``. Return the entry of `aggregation_cache` of the last
+        aggregation, or None when it can't be reused."""
+        entry = aggregation_cache.lookup(str(self.abs_path))
+        if entry is None or not isinstance(entry.value, dict):
+            return None
+        last = entry.value
+        commit = last.get("commit")
+        if last.get("fingerprint") != fingerprint or not commit:
+            return None
+        if not git.object_exists(self.abs_path, f"{commit}^{{commit}}"):
+            return None
+        # The local branch git-aggregator would have reset
+        target = str(self.merges_config().get("target") or "").split()
+        branch = target[-1] if target else "_git_aggregated"
+        run(["git", "checkout", "-B", branch, commit], cwd=self.abs_path, check=True)
+        return last
+
+    def rebuild_consolidation_branch(
+        self, push=False, target_branch=None, verbose=True, reuse=True, locked=False
+    ) -> bool:
+        """Aggregate the pending merges, then push the result if ``push``.
+
+        With ``reuse``, when none of the inputs of the aggregation changed
+        since the last one (see `aggregation_fingerprint`), its commit is
+        checked out instead, without aggregating: it is only pushed if
+        ``push`` and it was not pushed to ``target_branch`` yet. Return
+        whether the branch was rebuilt.
+
+        With ``locked``, the commits recorded in the lock file are aggregated
+        (see `locked_config`). Otherwise, when the project enables lock files,
+        the commits aggregated are recorded in it (see `write_lock`).
+
+        The PRs applied as a patch are downloaded beforehand, and applied from
+        the local cache (see `patch_cache`).
+        """
+        if push:
+            # Resolved first: reusing an aggregation depends on it
+            target_branch = target_branch or gh.get_target_branch()
+        # Only a repo of its own, or one git-aggregator is about to create, has
+        # commits to check out again
+        is_new = not self.abs_path.exists() or not any(self.abs_path.iterdir())
+        own_repo = is_new or git.is_toplevel(self.abs_path)
+        refs = config = None
+        if locked:
+            refs = self.read_lock()
+            if refs is None:
+                raise click.ClickException(
+                    f"{self.name} has no lock file: {self.abs_lock_path}"
+                )
+            self._check_locked_patches(refs)
+            config = self.locked_config(refs)
+        elif own_repo and (reuse or self.pending_merge_lock):
+            refs = self.resolve_aggregation_inputs()
+            if refs is not None and self.pending_merge_lock:
+                # The commits recorded are the ones aggregated, even if a
+                # branch moves meanwhile
+                config = self.locked_config(refs)
+        fingerprint = None
+        if reuse and own_repo and refs is not None:
+            fingerprint = self._fingerprint(refs)
+        if fingerprint is not None and (last := self._reuse_aggregation(fingerprint)):
+            logger.debug("%s is unchanged, reusing %s", self.path, last["commit"])
+            if push and last.get("pushed") != target_branch:
+                # The branch names the commit of the project: a new one is
+                # pushed for each, with the same aggregated commit
+                self.push_to_remote(target_branch=target_branch, verbose=verbose)
+                aggregation_cache.set(
+                    str(self.abs_path), dict(last, pushed=target_branch)
+                )
+            return False
+        config = self._with_local_patches(config, refs)
+        self.run_aggregate(config=config, verbose=verbose)
         if push:
-            self.push_to_remote(target_branch=target_branch)
+            self.push_to_remote(target_branch=target_branch, verbose=verbose)
+        if refs is not None and self.pending_merge_lock and not locked:
+            self.write_lock(refs)
+        if fingerprint is not None:
+            commit = run(["git", "rev-parse", "HEAD"], cwd=self.abs_path, check=True)
+            aggregation_cache.set(
+                str(self.abs_path),
+                {
+                    "fingerprint": fingerprint,
+                    "commit": commit,
+                    # The branch pushed to, if any
+                    "pushed": target_branch if push else None,
+                },
+            )
+        return True
+
+
+def aggregate_repos(
+    repos: list[Repo],
+    push=True,
+    target_branch=None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    reuse=True,
+    locked=False,
+) -> Iterator[tuple[Repo, bool, BaseException | None, list]]:
+    """Aggregate ``repos``, then push each of them unless ``push`` is False,
+    ``max_workers`` repos at a time (see `Repo.rebuild_consolidation_branch`).
+
+    Each repo is aggregated in its own working directory, with its output
+    captured (see `ui.capture_output`). The repos are yielded as they are
+    done, with whether they were rebuilt, the error that stopped them if any,
+    and their output, to `ui.replay`: a failed repo does not stop the others.
+    """
+    if push:
+        # Resolved once for all, as it may ask for a confirmation
+        target_branch = target_branch or gh.get_target_branch()
+
+    outputs = {}  # repo -> messages collected by ui.capture_output
+
+    def rebuild(repo):
+        with ui.capture_output() as output:
+            outputs[repo] = output
+            return repo.rebuild_consolidation_branch(
+                push=push,
+                target_branch=target_branch,
+                verbose=False,
+                reuse=reuse,
+                locked=locked,
+            )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(rebuild, repo): repo for repo in repos}
+        for future in as_completed(futures):
+            repo = futures[future]
+            try:
+                rebuilt = future.result()
+            except Exception as exc:
+                yield repo, False, exc, outputs.get(repo, [])
+            else:
+                yield repo, rebuilt, None, outputs.get(repo, [])
 
 
 def add_pending(entity_url, aggregate=True, patch=False, push=True):
@@ -737,10 +1501,10 @@ def make_merge_branch_name(version):
 
 def get_new_remote_url(repo: Repo, force_remote: str | bool = False):
     if repo.has_pending_merges():
-        with repo.abs_merges_path.open() as pending_merges:
+        with document_lock:
             # read everything we can reach
             # for reading purposes only
-            data = yaml_load(pending_merges)
+            data = load_document(repo.abs_merges_path)
             submodule_pending_config = data[(Path("..") / repo.path).as_posix()]
             merges_in_action = submodule_pending_config["merges"]
             registered_remotes = submodule_pending_config["remotes"]
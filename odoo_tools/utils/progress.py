@@ -0,0 +1,132 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""Live grid of the progress of a command, one row per item it works on.
+
+Rebuilding a whole ``rich`` table after each result makes N updates cost
+O(N²), and the terminal becomes the bottleneck with hundreds of rows. With
+`ProgressGrid`, an update only replaces the cells of its own row, and the
+grid is assembled at most ``refresh_per_second`` times a second, whatever the
+number of updates.
+"""
+
+import threading
+from collections import Counter
+from collections.abc import Hashable, Sequence
+
+from rich.console import Console, Group
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
+
+#: Lines kept free under the live view of a grid taller than the terminal
+SUMMARY_MARGIN = 2
+
+
+class ProgressGrid:
+    """A live `rich.table.Table` grid, with one row per key.
+
+    :param columns: the keyword arguments of `Table.add_column` for each column
+    :param console: the console to render the grid on
+
+    Use it as a context manager, around the work updating the rows:
+
+    .. code-block:: python
+
+        grid = ProgressGrid([{"no_wrap": True}, {}], console=console)
+        for repo in repos:
+            grid.set_row(repo, [spinner, repo.name], status="pending")
+        with grid:
+            for repo in do_the_work(repos):
+                grid.set_row(repo, ["[green]●[/]", repo.name], status="done")
+
+    When the rows don't fit in the terminal, the live view is a summary of the
+    rows by status, followed by the rows updated last. The whole grid is
+    printed once the work is done.
+    """
+
+    def __init__(
+        self,
+        columns: Sequence[dict],
+        console: Console,
+        refresh_per_second: float = 10,
+    ):
+        self.columns = columns
+        self.console = console
+        self.refresh_per_second = refresh_per_second
+        self._lock = threading.Lock()
+        # key -> (cells, status), in display order
+        self._rows: dict[Hashable, tuple[Sequence, str]] = {}
+        # The keys of the rows, from the least to the most recently updated
+        self._updated: dict[Hashable, None] = {}
+        self._live: Live | None = None
+        # Set once the work is done, for the last render to show every row
+        self._done = False
+
+    def set_row(self, key: Hashable, cells: Sequence, status: str = ""):
+        """Show ``cells`` on the row of ``key``, added at the end if new.
+
+        :param status: what the row is counted as in the summary view
+        """
+        with self._lock:
+            self._rows[key] = (cells, status)
+            self._updated.pop(key, None)
+            self._updated[key] = None
+
+    def remove_row(self, key: Hashable):
+        with self._lock:
+            self._rows.pop(key, None)
+            self._updated.pop(key, None)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _table(self, keys) -> Table:
+        grid = Table.grid(padding=(0, 1))
+        for column in self.columns:
+            grid.add_column(**column)
+        for key in keys:
+            grid.add_row(*self._rows[key][0])
+        return grid
+
+    def _summary(self) -> Text:
+        counts = Counter(status for __, status in self._rows.values())
+        return Text(
+            ", ".join(f"{count} {status}" for status, count in counts.items() if status)
+            or f"{len(self._rows)} rows",
+            style="bold",
+        )
+
+    def render(self):
+        """Return the renderable of the grid, in the summary view while the
+        rows don't fit in the terminal."""
+        with self._lock:
+            # A line for the summary
+            room = self.console.height - SUMMARY_MARGIN - 1
+            if self._done or len(self._rows) <= room + 1:
+                return self._table(list(self._rows))
+            recent = list(self._updated)[-room:] if room > 0 else []
+            return Group(self._summary(), self._table(recent))
+
+    def __enter__(self):
+        self._done = False
+        self._live = Live(
+            console=self.console,
+            refresh_per_second=self.refresh_per_second,
+            get_renderable=self.render,
+        )
+        self._live.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        live, self._live = self._live, None
+        assert live is not None
+        # The last render is printed in full, whatever its height
+        self._done = True
+        live.__exit__(*exc_info)
+
+    def print(self):
+        """Print the whole grid, e.g. when there is no work to follow."""
+        with self._lock:
+            table = self._table(list(self._rows))
+        self.console.print(table)
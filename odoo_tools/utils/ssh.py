@@ -0,0 +1,193 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+"""Share one SSH connection to GitHub among the git commands otools runs.
+
+Every fetch, push or ``ls-remote`` over SSH otherwise opens its own connection,
+paying for a full handshake and authentication. With OpenSSH connection
+multiplexing the first connection becomes a "master" which the following ones
+go through (see ``ControlMaster`` in ssh_config(5)).
+
+The ssh command is handed to git through ``GIT_SSH_COMMAND``, in the
+environment built by `os_exec.get_venv`. A ``GIT_SSH_COMMAND`` or ``GIT_SSH``
+of the user's own is left alone.
+"""
+
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import threading
+from functools import cache, wraps
+from pathlib import Path
+
+import click
+
+from . import misc
+
+logger = logging.getLogger(__name__)
+
+#: Set to ``0`` to turn connection sharing off
+ENABLE_ENV_VAR = "OTOOLS_SSH_MULTIPLEXING"
+#: How long the shared connection stays up once idle, as a ssh_config
+#: ``ControlPersist`` value (e.g. ``10m``), so that the next otools commands
+#: reuse it. When unset, it is closed at the end of every command.
+PERSIST_ENV_VAR = "OTOOLS_SSH_PERSIST"
+#: How long the shared connection stays up once idle, during a command
+DEFAULT_PERSIST = "60s"
+#: The ``user@host`` of the shared connections
+HOSTS = ("git@github.com",)
+
+_CLOSE_META_KEY = "odoo_tools.ssh.close"
+
+_lock = threading.Lock()
+_network_commands = 0
+
+
+def control_dir() -> Path:
+    """The directory holding the sockets of the shared connections."""
+    return misc.get_cache_path() / "ssh"
+
+
+def is_enabled() -> bool:
+    if os.getenv(ENABLE_ENV_VAR, "1") == "0" or not _has_ssh():
+        return False
+    return not (os.getenv("GIT_SSH_COMMAND") or os.getenv("GIT_SSH"))
+
+
+@cache
+def _has_ssh() -> bool:
+    # Looked up once per process, not for every git command
+    return bool(shutil.which("ssh"))
+
+
+def _control_path(directory: Path) -> str:
+    # ``%C`` is a hash of the connection's user, host and port: short enough
+    # for the size limit of socket paths.
+    return f"ControlPath={directory / '%C'}"
+
+
+def _control_options() -> list[str]:
+    return ["-o", _control_path(control_dir())]
+
+
+def git_ssh_command() -> str | None:
+    """Return the ``GIT_SSH_COMMAND`` sharing connections, or None if disabled."""
+    if not is_enabled():
+        return None
+    return _git_ssh_command(
+        control_dir(), os.getenv(PERSIST_ENV_VAR) or DEFAULT_PERSIST
+    )
+
+
+@cache
+def _git_ssh_command(directory: Path, persist: str) -> str | None:
+    # Created once per process, not for every git command
+    try:
+        directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    except OSError as exc:
+        logger.debug("Cannot create the SSH control directory: %s", exc)
+        return None
+    return shlex.join(
+        [
+            "ssh",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            _control_path(directory),
+            "-o",
+            f"ControlPersist={persist}",
+        ]
+    )
+
+
+def _is_network_command(cmd) -> bool:
+    """Tell whether ``cmd`` is a git command that may talk to a remote."""
+    if not cmd:
+        return False
+    if Path(cmd[0]).name == "gitaggregate":
+        return True
+    if Path(cmd[0]).name != "git":
+        return False
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ("-C", "-c"):
+            next(args, None)
+        elif not arg.startswith("-"):
+            if arg == "submodule":
+                return "update" in cmd or "add" in cmd
+            return arg in (
+                "fetch",
+                "push",
+                "pull",
+                "ls-remote",
+                "clone",
+                "autoshare-clone",
+                "autoshare-submodule-add",
+            )
+    return False
+
+
+def track(cmd) -> bool:
+    """Count ``cmd`` in the summary of `close` if it may talk to a remote, and
+    return whether it may."""
+    global _network_commands
+    if not _is_network_command(cmd):
+        return False
+    with _lock:
+        _network_commands += 1
+    return True
+
+
+def _is_master_running(host: str) -> bool:
+    result = subprocess.run(
+        ["ssh", *_control_options(), "-O", "check", host], capture_output=True
+    )
+    return result.returncode == 0
+
+
+def close():
+    """Log how many git network commands ran while the connections were
+    shared, then close them unless they are meant to persist (see
+    `PERSIST_ENV_VAR`).
+    """
+    global _network_commands
+    if not is_enabled():
+        return
+    with _lock:
+        count, _network_commands = _network_commands, 0
+    if not count:
+        return
+    for host in HOSTS:
+        if not _is_master_running(host):
+            continue
+        logger.debug(
+            "%d git network command(s) ran while the SSH connection to %s was shared",
+            count,
+            host,
+        )
+        if os.getenv(PERSIST_ENV_VAR):
+            continue
+        subprocess.run(
+            ["ssh", *_control_options(), "-O", "exit", host], capture_output=True
+        )
+
+
+def with_ssh_multiplexing(func):
+    """Decorator for click group/command callbacks: `close` the shared SSH
+    connections once the whole command line has run.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        ctx = click.get_current_context(silent=True)
+        if ctx is not None:
+            root = ctx.find_root()
+            # The root context is closed last, after any subcommand
+            if not root.meta.get(_CLOSE_META_KEY):
+                root.meta[_CLOSE_META_KEY] = True
+                root.call_on_close(close)
+        return func(*args, **kwargs)
+
+    return wrapper
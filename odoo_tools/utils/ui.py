@@ -2,6 +2,8 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 import os
+import threading
+from contextlib import contextmanager
 
 import click
 from rich.console import Console
@@ -12,6 +14,10 @@ from ..exceptions import Exit
 # mixed with a command's stdout (e.g. JSON output or a live-rendered table).
 err_console = Console(stderr=True)
 
+# Per-thread state: the messages `echo` collects instead of printing them, see
+# `capture_output`, and the label it prefixes them with, see `label_output`.
+_local = threading.local()
+
 
 def exit_msg(msg):
     raise Exit(msg)
@@ -44,6 +50,13 @@ def ask_or_abort(message):
 
 
 def echo(msg, *pa, **kw):
+    label = getattr(_local, "label", None)
+    if label:
+        msg = f"[{label}] {msg}"
+    captured = getattr(_local, "captured", None)
+    if captured is not None:
+        captured.append((msg, pa, kw))
+        return
     cmd = click.echo
     if kw.get("fg"):
         cmd = click.secho
@@ -56,3 +69,42 @@ def ask_question(message, **prompt_kwargs):
     Wrapper around ``click.prompt()``
     """
     return click.prompt(message, **prompt_kwargs)
+
+
+@contextmanager
+def capture_output():
+    """Collect what `echo` prints from the current thread, instead of printing it.
+
+    Meant for work running on a thread pool: the messages of concurrent jobs
+    would otherwise interleave (and fight with a live-rendered table). Yields
+    the list the messages are collected in, to be printed later on with
+    `replay`. Only the current thread is affected.
+    """
+    previous = getattr(_local, "captured", None)
+    captured = []
+    _local.captured = captured
+    try:
+        yield captured
+    finally:
+        _local.captured = previous
+
+
+def replay(captured):
+    """Print the messages collected by `capture_output`."""
+    for msg, pa, kw in captured:
+        echo(msg, *pa, **kw)
+
+
+@contextmanager
+def label_output(label):
+    """Prefix what `echo` prints from the current thread with ``[label]``.
+
+    Meant for jobs running concurrently whose output is printed as it comes:
+    the lines of the jobs interleave, but each tells which job it is from.
+    """
+    previous = getattr(_local, "label", None)
+    _local.label = label
+    try:
+        yield
+    finally:
+        _local.label = previous
@@ -21,6 +21,7 @@ import requests
 from packaging.version import InvalidVersion, Version
 
 from .. import __version__
+from . import gh_api
 from .misc import get_cache_path
 
 logger = logging.getLogger(__name__)
@@ -36,9 +37,10 @@ SKIP_ENV_VAR = "OTOOLS_SKIP_UPDATE_CHECK"
 
 def _fetch_latest_version() -> str | None:
     try:
-        response = requests.get(RELEASES_URL, timeout=FETCH_TIMEOUT)
-        response.raise_for_status()
-        data = response.json()
+        # Not worth a retry: the check runs again on the next command
+        data = gh_api.get_client().get_json(
+            RELEASES_URL, timeout=FETCH_TIMEOUT, retries=0
+        )
     except (requests.RequestException, ValueError) as exc:
         logger.debug("Failed to fetch latest odoo-tools version: %s", exc)
         return None
@@ -1,7 +1,10 @@
 # Copyright 2017 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import tempfile
+import threading
 from pathlib import Path
+from typing import Any
 
 # TODO: do we really need this to edit such files?
 from ruamel.yaml import YAML
@@ -24,6 +27,69 @@ def yaml_dump(data, fileob):
     yaml.dump(data, fileob)
 
 
+#: Held while reading or changing a document of `load_document`: the other
+#: threads using it never see a change half done
+document_lock = threading.RLock()
+# Loaded documents, by path, with the (mtime, size) of the file they come from
+_documents: dict[Path, tuple[tuple[int, int], Any]] = {}
+
+
+def _file_key(path: Path) -> tuple[int, int]:
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_document(path: str | Path):
+    """Return the document of the YAML file at ``path``.
+
+    The file is parsed again only when its modification time or size changed:
+    every caller gets the same object otherwise. Changes to it are written
+    with `dump_document`, under `document_lock`.
+    """
+    path = Path(path)
+    with document_lock:
+        key = _file_key(path)
+        cached = _documents.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        data = yaml_load(path.read_text())
+        _documents[path] = (key, data)
+        return data
+
+
+def dump_document(path: str | Path, data):
+    """Write ``data`` to the YAML file at ``path``, as the document
+    `load_document` returns from now on."""
+    path = Path(path)
+    with document_lock:
+        # Renamed over the file once written: git-aggregator or a concurrent
+        # command never read it half written
+        with tempfile.NamedTemporaryFile(
+            "w", dir=path.parent, prefix=f".{path.name}.", delete=False
+        ) as fobj:
+            yaml_dump(data, fobj)
+        try:
+            mode = path.stat().st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        # Not the private mode of a temporary file
+        tmp_path = Path(fobj.name)
+        tmp_path.chmod(mode)
+        tmp_path.replace(path)
+        _documents[path] = (_file_key(path), data)
+
+
+def clear_documents(*paths: str | Path):
+    """Forget the loaded documents of ``paths``, or all of them, e.g. after
+    editing a file within the resolution of its modification time, or
+    dropping changes made to a document."""
+    with document_lock:
+        if not paths:
+            _documents.clear()
+        for path in paths:
+            _documents.pop(Path(path), None)
+
+
 def _comment_token(value, column=0):
     return CommentToken(value, CommentMark(column), None)
 
@@ -102,6 +168,37 @@ def _rebuild_seq_comments(seq, eol, above):
         seq.ca.items[i] = [token, None, None, None]
 
 
+def edit_seq_with_comments(seq, remove=(), append=(), comment_indent=""):
+    """Remove the ``remove`` values from a ruamel ``CommentedSeq``, then append
+    the ``(value, comment)`` pairs of ``append``, keeping every other item's
+    comments anchored to that item.
+
+    The comments are normalised (see :func:`_normalize_seq_comments`) and
+    rebuilt once for all the changes: see :func:`remove_seq_item_with_comments`
+    and :func:`append_seq_item_with_comments` for the details of each change.
+    """
+    eol, above = _normalize_seq_comments(seq)
+    # raises ValueError if absent, like list.remove
+    for idx in sorted({seq.index(value) for value in remove}, reverse=True):
+        # Drop the item together with its own inline + preceding-block comments.
+        # ``above[idx + 1]`` shifts into ``idx``, staying anchored to the survivor.
+        del seq[idx]
+        eol.pop(idx)
+        above.pop(idx)
+    for value, comment in append:
+        length = len(seq)  # index the appended item will occupy
+        seq.append(value)
+        eol.append(None)  # new last item: no end-of-line comment
+        if comment:
+            block = "".join(
+                f"{comment_indent}# {line.replace(chr(10), ' ')}\n" for line in comment
+            )
+            # ``above[length]`` is the block printed before the new last item.
+            above[length] = (above[length] or "") + block
+        above.append(None)  # new trailing slot: empty
+    _rebuild_seq_comments(seq, eol, above)
+
+
 def remove_seq_item_with_comments(seq, value):
     """Remove ``value`` from a ruamel ``CommentedSeq`` along with the comments
     that belong to it (its end-of-line comment and the block above it), keeping
@@ -116,14 +213,7 @@ def remove_seq_item_with_comments(seq, value):
     dropping the removed item's entries, then rebuilding ``ca.items`` and the
     start comment.
     """
-    idx = seq.index(value)  # raises ValueError if absent, like list.remove
-    eol, above = _normalize_seq_comments(seq)
-    # Drop the item together with its own inline + preceding-block comments.
-    # ``above[idx + 1]`` shifts into ``idx``, staying anchored to the survivor.
-    del seq[idx]
-    eol.pop(idx)
-    above.pop(idx)
-    _rebuild_seq_comments(seq, eol, above)
+    edit_seq_with_comments(seq, remove=[value])
 
 
 def sequence_item_indent(depth=1):
@@ -151,18 +241,9 @@ def append_seq_item_with_comments(seq, value, comment=None, comment_indent=""):
     ``{comment_indent}# {line}``. ``comment_indent`` should line the comment up
     with the rendered list items (see :func:`sequence_item_indent`).
     """
-    eol, above = _normalize_seq_comments(seq)
-    length = len(seq)  # index the appended item will occupy
-    seq.append(value)
-    eol.append(None)  # new last item: no end-of-line comment
-    if comment:
-        block = "".join(
-            f"{comment_indent}# {line.replace(chr(10), ' ')}\n" for line in comment
-        )
-        # ``above[length]`` is the block printed before the new last item.
-        above[length] = (above[length] or "") + block
-    above.append(None)  # new trailing slot: empty
-    _rebuild_seq_comments(seq, eol, above)
+    edit_seq_with_comments(
+        seq, append=[(value, comment)], comment_indent=comment_indent
+    )
 
 
 def update_yml_file(path, new_data, main_key=None):
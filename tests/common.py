@@ -1,5 +1,6 @@
 # Copyright 2023 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+import io
 import shutil
 from contextlib import contextmanager
 from pathlib import Path
@@ -241,11 +242,46 @@ def mock_pending_merge_repo_paths(
     return path
 
 
+def make_upstream_repo(path):
+    """Create an upstream repo at ``path``, with a ``14.0`` branch and a
+    ``feature`` branch one commit ahead."""
+    repo = git.Repo.init(path, initial_branch="14.0")
+    with repo.config_writer() as cfg:
+        cfg.set_value("user", "email", "test@test.com")
+        cfg.set_value("user", "name", "Test")
+        cfg.set_value("commit", "gpgsign", "false")
+    (Path(path) / "README").write_text("hello")
+    repo.index.add(["README"])
+    repo.index.commit("say hello")
+    repo.create_head("feature").checkout()
+    (Path(path) / "FEATURE").write_text("feature")
+    repo.index.add(["FEATURE"])
+    repo.index.commit("add feature")
+    repo.heads["14.0"].checkout()
+    return repo
+
+
 class MockCompletedProcess:
-    def __init__(self, args=None, stdout=None, returncode=0):
+    def __init__(self, args=None, stdout=None, returncode=0, stderr=None):
         self.args = args
         self.returncode = returncode
         self.stdout = stdout
+        self.stderr = stderr
+
+
+class MockPopen(MockCompletedProcess):
+    """A finished process, as returned by `MockSubprocessRun.popen`."""
+
+    def __init__(self, args=None, stdout=None):
+        if isinstance(stdout, bytes):
+            stdout = stdout.decode()
+        super().__init__(args, stdout=io.StringIO(stdout or ""))
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def terminate(self):
+        pass
 
 
 class MockSubprocessRun:
@@ -257,6 +293,10 @@ class MockSubprocessRun:
             do your test
         mock_runner.assert_completed_calls()
 
+    The commands whose output is streamed (see `os_exec.run_streamed`) go
+    through ``subprocess.Popen``: patch it with ``mock_runner.popen`` to match
+    them against the same spec.
+
     mock_spec is a list of dictionaries. The entries are used to match
     subsequent calls to subprocess.run(), in order.
 
@@ -301,6 +341,9 @@ class MockSubprocessRun:
             )
         return MockCompletedProcess(args, stdout=call_spec.get("stdout"))
 
+    def popen(self, args, **kwargs):
+        return MockPopen(args, stdout=self(args, **kwargs).stdout)
+
     def assert_completed_calls(self):
         assert not self.mock_spec, (
             f"{len(self.mock_spec)} calls missing: {self.mock_spec}"
@@ -1,9 +1,12 @@
 # Copyright 2024 Camptocamp SA (https://www.camptocamp.com).
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
+from unittest import mock
+
 import pytest
 from click.testing import CliRunner
 
+from odoo_tools.utils import cache, gh_api, gitmodules, odoo_store, patch_cache, yaml
 from odoo_tools.utils.config import config
 from odoo_tools.utils.proj import get_project_manifest
 
@@ -72,6 +75,9 @@ def all_template_versions(project):
 @pytest.fixture(autouse=True)
 def clear_caches():
     get_project_manifest.cache_clear()
+    gitmodules.clear_cache()
+    odoo_store._checked_out.clear()
+    yaml.clear_documents()
 
 
 @pytest.fixture(autouse=True)
@@ -82,3 +88,36 @@ def skip_update_check(monkeypatch):
     environment variable in their own fixture.
     """
     monkeypatch.setenv("OTOOLS_SKIP_UPDATE_CHECK", "1")
+
+
+@pytest.fixture(autouse=True)
+def no_ssh_multiplexing(monkeypatch):
+    """Leave the ssh command of git alone in every test.
+
+    The tests of the SSH connection sharing opt in by clearing this
+    environment variable in their own fixture.
+    """
+    monkeypatch.setenv("OTOOLS_SSH_MULTIPLEXING", "0")
+
+
+@pytest.fixture(autouse=True)
+def github_client():
+    """Give every test a GitHub client of its own, retrying without waiting."""
+    with (
+        mock.patch.object(gh_api, "_client", None),
+        mock.patch.object(gh_api.GitHubClient, "_wait"),
+    ):
+        yield gh_api.get_client()
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path):
+    """Keep the persistent caches of every test out of the user's cache."""
+    path = tmp_path / "otools-cache"
+    with (
+        mock.patch.object(cache, "get_cache_path", return_value=path),
+        mock.patch.object(odoo_store, "get_cache_path", return_value=path),
+        mock.patch.object(gh_api, "get_cache_path", return_value=path),
+        mock.patch.object(patch_cache, "get_cache_path", return_value=path),
+    ):
+        yield path
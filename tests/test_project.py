@@ -2,12 +2,16 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 import os
+import subprocess
+import threading
+import time
 from pathlib import Path
 from unittest import mock
 
 import pytest
 
 from odoo_tools.cli.project import checkout_local_odoo, init
+from odoo_tools.utils import git, ui
 from odoo_tools.utils.config import config
 from odoo_tools.utils.path import build_path
 
@@ -168,6 +172,8 @@ def test_checkout_local_odoo(runner):
                 # "sim_call": sim_touch,
                 # "sim_call_args": ["foo"],
             },
+            # the size of the checkout, reported
+            {"args": ["git", "-C", str(odoo_src_path / "odoo"), "count-objects", "-v"]},
             {
                 "args": [
                     "git",
@@ -207,12 +213,26 @@ def test_checkout_local_odoo(runner):
                 # "sim_call": sim_touch,
                 # "sim_call_args": ["foo"],
             },
+            # the size of the checkout, reported
+            {
+                "args": [
+                    "git",
+                    "-C",
+                    str(odoo_src_path / "enterprise"),
+                    "count-objects",
+                    "-v",
+                ]
+            },
         ]
     )
-    with mock.patch("subprocess.run", mock_fn):
+    with (
+        mock.patch("subprocess.run", mock_fn),
+        mock.patch("subprocess.Popen", mock_fn.popen),
+    ):
         runner.invoke(
             checkout_local_odoo,
-            ["--odoo-hash", "12345", "--enterprise-hash", "56789"],
+            # one after the other, for the order of the calls
+            ["--odoo-hash", "12345", "--enterprise-hash", "56789", "--jobs", "1"],
             catch_exceptions=False,
         )
 
@@ -267,6 +287,8 @@ def test_local_odoo_venv(runner):
                 # "sim_call": sim_touch,
                 # "sim_call_args": ["foo"],
             },
+            # the size of the checkout, reported
+            {"args": ["git", "-C", str(odoo_src_path / "odoo"), "count-objects", "-v"]},
             {
                 "args": [
                     "git",
@@ -306,6 +328,16 @@ def test_local_odoo_venv(runner):
                 # "sim_call": sim_touch,
                 # "sim_call_args": ["foo"],
             },
+            # the size of the checkout, reported
+            {
+                "args": [
+                    "git",
+                    "-C",
+                    str(odoo_src_path / "enterprise"),
+                    "count-objects",
+                    "-v",
+                ]
+            },
             {
                 "args": lambda a: (
                     Path(a[0]).name.startswith("python") and a[2] == "ensurepip"
@@ -340,7 +372,10 @@ def test_local_odoo_venv(runner):
             },  # odoo config file generation, tested elsewhere
         ]
     )
-    with mock.patch("subprocess.run", mock_fn):
+    with (
+        mock.patch("subprocess.run", mock_fn),
+        mock.patch("subprocess.Popen", mock_fn.popen),
+    ):
         runner.invoke(
             checkout_local_odoo,
             [
@@ -349,6 +384,149 @@ def test_local_odoo_venv(runner):
                 "--enterprise-hash",
                 "56789",
                 "--venv",
+                "--jobs",
+                "1",
             ],
             catch_exceptions=False,
         )
+
+
+@pytest.mark.usefixtures("project")
+@pytest.mark.project_setup(proj_tmpl_ver=2, proj_version="16.0.1.1.0")
+def test_checkout_local_odoo_store(runner, tmp_path):
+    odoo_src_path = build_path(config.odoo_src_rel_path)
+    patch = build_path("patches/odoo/0001-fix.patch")
+    patch.parent.mkdir(parents=True)
+    patch.write_text("")
+    worktrees = {"odoo": tmp_path / "odoo-wt", "enterprise": tmp_path / "ent-wt"}
+    for worktree in worktrees.values():
+        worktree.mkdir()
+    with (
+        mock.patch(
+            "odoo_tools.utils.odoo_store.checkout",
+            side_effect=lambda org, repo, ref, patches: worktrees[repo],
+        ) as mock_checkout,
+        mock.patch("odoo_tools.cli.project.git.get_odoo_core") as mock_core,
+    ):
+        result = runner.invoke(
+            checkout_local_odoo,
+            ["--odoo-hash", "12345", "--enterprise-hash", "56789", "--store"],
+            catch_exceptions=False,
+        )
+    assert result.exit_code == 0
+    mock_core.assert_not_called()
+    assert mock_checkout.call_args_list == [
+        mock.call("odoo", "odoo", "12345", patches=[patch]),
+        mock.call("odoo", "enterprise", "56789", patches=[]),
+    ]
+    assert (odoo_src_path / "odoo").resolve() == worktrees["odoo"]
+    assert (odoo_src_path / "enterprise").resolve() == worktrees["enterprise"]
+
+
+@pytest.mark.usefixtures("project")
+@pytest.mark.project_setup(proj_tmpl_ver=2, proj_version="16.0.1.1.0")
+def test_checkout_local_odoo_concurrent(runner):
+    patch = build_path("patches/enterprise/0001-fix.patch")
+    patch.parent.mkdir(parents=True)
+    patch.write_text("")
+    enterprise_patched = threading.Event()
+
+    def get_odoo_core(*args, **kwargs):
+        # enterprise is patched without waiting for odoo core
+        assert enterprise_patched.wait(timeout=5)
+        ui.echo("core done")
+
+    def apply_patches(repo_path, base, patches):
+        enterprise_patched.set()
+
+    with (
+        mock.patch("odoo_tools.utils.git.get_odoo_core", side_effect=get_odoo_core),
+        mock.patch("odoo_tools.utils.git.get_odoo_enterprise") as mock_enterprise,
+        mock.patch(
+            "odoo_tools.utils.git.apply_patches", side_effect=apply_patches
+        ) as mock_apply,
+    ):
+        result = runner.invoke(
+            checkout_local_odoo,
+            ["--odoo-hash", "12345", "--enterprise-hash", "56789"],
+            catch_exceptions=False,
+        )
+    assert result.exit_code == 0
+    assert "[odoo] core done" in result.output
+    mock_enterprise.assert_called_once_with(
+        "56789", dest=config.odoo_src_rel_path / "enterprise", mode="full"
+    )
+    mock_apply.assert_has_calls(
+        [
+            mock.call(
+                build_path(config.odoo_src_rel_path / "enterprise"), "56789", [patch]
+            ),
+            mock.call(build_path(config.odoo_src_rel_path / "odoo"), "12345", []),
+        ]
+    )
+
+
+@pytest.mark.usefixtures("project")
+@pytest.mark.project_setup(proj_tmpl_ver=2, proj_version="16.0.1.1.0")
+def test_checkout_local_odoo_nested_patch(runner):
+    patch = build_path("patches/odoo/0001-fix.patch")
+    nested = build_path("patches/odoo/sub/0001-fix.patch")
+    nested.parent.mkdir(parents=True)
+    for path in (patch, nested):
+        path.write_text("")
+    with (
+        mock.patch("odoo_tools.utils.git.get_odoo_core"),
+        mock.patch("odoo_tools.utils.git.get_odoo_enterprise"),
+        mock.patch("odoo_tools.utils.git.apply_patches") as mock_apply,
+        mock.patch("odoo_tools.cli.project._apply_patch") as mock_apply_patch,
+    ):
+        result = runner.invoke(
+            checkout_local_odoo,
+            ["--odoo-hash", "12345", "--enterprise-hash", "56789"],
+            catch_exceptions=False,
+        )
+    assert result.exit_code == 0
+    mock_apply.assert_any_call(
+        build_path(config.odoo_src_rel_path / "odoo"), "12345", [patch]
+    )
+    # Applied in the directory it is nested in, as before
+    mock_apply_patch.assert_called_once_with(
+        nested, config.odoo_src_rel_path / "odoo" / "sub"
+    )
+
+
+@pytest.mark.usefixtures("project")
+@pytest.mark.project_setup(proj_tmpl_ver=2, proj_version="16.0.1.1.0")
+def test_checkout_local_odoo_concurrent_failure(runner):
+    patch = build_path("patches/enterprise/0001-fix.patch")
+    patch.parent.mkdir(parents=True)
+    patch.write_text("")
+    enterprise_started = threading.Event()
+
+    def get_odoo_core(*args, **kwargs):
+        assert enterprise_started.wait(timeout=5)
+        raise subprocess.CalledProcessError(128, ["git", "fetch"])
+
+    def get_odoo_enterprise(*args, **kwargs):
+        # A long clone, still running when odoo core fails
+        enterprise_started.set()
+        git._run_network(["sh", "-c", "echo cloning >&2; exec sleep 30"])
+
+    start = time.monotonic()
+    with (
+        mock.patch("odoo_tools.utils.git.get_odoo_core", side_effect=get_odoo_core),
+        mock.patch(
+            "odoo_tools.utils.git.get_odoo_enterprise",
+            side_effect=get_odoo_enterprise,
+        ),
+        mock.patch("odoo_tools.utils.git.apply_patches") as mock_apply,
+    ):
+        result = runner.invoke(
+            checkout_local_odoo, ["--odoo-hash", "12345", "--enterprise-hash", "56789"]
+        )
+    # The clone is terminated rather than waited for
+    assert time.monotonic() - start < 20
+    assert isinstance(result.exception, subprocess.CalledProcessError)
+    assert result.exception.cmd == ["git", "fetch"]
+    assert "[enterprise] Cancelled" in result.output
+    mock_apply.assert_not_called()
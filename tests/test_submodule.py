@@ -1,3 +1,4 @@
+import threading
 from pathlib import Path
 from unittest import mock
 
@@ -5,7 +6,12 @@ import pytest
 
 from odoo_tools.cli import submodule
 
-from .common import MockSubprocessRun, get_fixture_path, mock_pending_merge_repo_paths
+from .common import (
+    MockSubprocessRun,
+    assert_no_chdir,
+    get_fixture_path,
+    mock_pending_merge_repo_paths,
+)
 
 
 @pytest.mark.project_setup(
@@ -43,7 +49,10 @@ def test_init(project):
             },
         ]
     )
-    with mock.patch("subprocess.run", mock_fn):
+    with (
+        mock.patch("subprocess.run", mock_fn),
+        mock.patch("subprocess.Popen", mock_fn.popen),
+    ):
         result = project.invoke(
             submodule.init,
             [],
@@ -86,26 +95,54 @@ def test_update(project):
                     "sync",
                     "--",
                     "odoo/external-src/account-closing",
+                    "odoo/external-src/account-financial-reporting",
                 ],
             },
             {
                 "args": [
                     "git",
                     "submodule",
-                    "update",
-                    "--init",
+                    "init",
+                    "--",
                     "odoo/external-src/account-closing",
+                    "odoo/external-src/account-financial-reporting",
                 ],
             },
+            # the recorded commits, all looked up at once
             {
                 "args": [
                     "git",
-                    "submodule",
-                    "sync",
+                    "ls-tree",
+                    "-r",
+                    "-z",
+                    "HEAD",
                     "--",
+                    "odoo/external-src/account-closing",
                     "odoo/external-src/account-financial-reporting",
                 ],
             },
+            # the OCA and company repositories, all probed before the updates
+            *(
+                {
+                    "args": [
+                        "git",
+                        "ls-remote",
+                        f"git@github.com:{org}/{repo}.git",
+                        "HEAD",
+                    ]
+                }
+                for repo in ("account-closing", "account-financial-reporting")
+                for org in ("OCA", "camptocamp")
+            ),
+            {
+                "args": [
+                    "git",
+                    "submodule",
+                    "update",
+                    "--init",
+                    "odoo/external-src/account-closing",
+                ],
+            },
             {
                 "args": [
                     "git",
@@ -125,13 +162,81 @@ def test_update(project):
     ):
         result = project.invoke(
             submodule.update,
-            [],
+            # Sequential, for the calls to come in a predictable order
+            ["--jobs", "1"],
             catch_exceptions=False,
         )
     assert result.exit_code == 0
     mock_fn.assert_completed_calls()
 
 
+@pytest.mark.project_setup(
+    manifest=dict(odoo_version="16.0"),
+    proj_version="16.0.1.2.3",
+    extra_files={
+        ".gitmodules": Path(get_fixture_path("fake-gitmodules")).read_text(),
+    },
+)
+def test_update_parallel(project):
+    """Submodules are updated concurrently, without ever changing the working
+    directory, and the output of each one is kept together."""
+    both_started = threading.Barrier(2, timeout=5)
+
+    def fake_update(submodule_path, pinned_shas=None):
+        # Blocks until both updates run at the same time
+        both_started.wait()
+        submodule.ui.echo(f"Updating submodule {submodule_path}")
+        submodule.ui.echo(f"Done with {submodule_path}")
+
+    with (
+        mock.patch.object(submodule.git, "submodule_sync") as mock_sync,
+        mock.patch.object(submodule.git, "submodule_register") as mock_register,
+        mock.patch.object(submodule.git, "get_pinned_shas", return_value={}),
+        mock.patch.object(submodule.git, "prefetch_submodule_remotes"),
+        mock.patch.object(submodule.git, "submodule_update", side_effect=fake_update),
+        assert_no_chdir(),
+    ):
+        result = project.invoke(submodule.update, [], catch_exceptions=False)
+    assert result.exit_code == 0
+    paths = [
+        "odoo/external-src/account-closing",
+        "odoo/external-src/account-financial-reporting",
+    ]
+    mock_sync.assert_called_once_with(*paths)
+    mock_register.assert_called_once_with(*paths)
+    lines = result.output.splitlines()
+    for path in paths:
+        start = lines.index(f"Updating submodule {path}")
+        assert lines[start + 1] == f"Done with {path}"
+
+
+@pytest.mark.project_setup(
+    manifest=dict(odoo_version="16.0"),
+    proj_version="16.0.1.2.3",
+    extra_files={
+        ".gitmodules": Path(get_fixture_path("fake-gitmodules")).read_text(),
+    },
+)
+def test_update_parallel_failure_does_not_stop_others(project):
+    def fake_update(submodule_path, pinned_shas=None):
+        if submodule_path.endswith("account-closing"):
+            raise RuntimeError("boom")
+
+    with (
+        mock.patch.object(submodule.git, "submodule_sync"),
+        mock.patch.object(submodule.git, "submodule_register"),
+        mock.patch.object(submodule.git, "get_pinned_shas", return_value={}),
+        mock.patch.object(submodule.git, "prefetch_submodule_remotes"),
+        mock.patch.object(
+            submodule.git, "submodule_update", side_effect=fake_update
+        ) as mock_update,
+    ):
+        result = project.invoke(submodule.update, [])
+    assert result.exit_code == 1
+    assert mock_update.call_count == 2
+    assert "Failed to update odoo/external-src/account-closing" in result.output
+
+
 @pytest.mark.project_setup(
     manifest=dict(odoo_version="16.0"),
     proj_version="16.0.1.2.3",
@@ -298,6 +403,16 @@ def test_upgrade_no_pending_merges(project):
     commit_after = "bbb222"
     mock_fn = MockSubprocessRun(
         [
+            # get_pinned_shas, once for all: the commits before the upgrade
+            {
+                "args": ["git", "ls-tree", "-r", "-z", "HEAD"],
+                "stdout": (
+                    f"160000 commit {commit_before}\t"
+                    "odoo/external-src/account-closing\0"
+                    f"160000 commit {commit_after}\t"
+                    "odoo/external-src/account-financial-reporting\0"
+                ).encode(),
+            },
             # submodule_update for account-closing
             {
                 "args": [
@@ -308,13 +423,6 @@ def test_upgrade_no_pending_merges(project):
                     "odoo/external-src/account-closing",
                 ],
             },
-            # get_submodule_commit before (submodule_upgrade)
-            {
-                "args": lambda args: (
-                    args[:2] == ["git", "-C"] and args[-2:] == ["rev-parse", "HEAD"]
-                ),
-                "stdout": commit_before.encode(),
-            },
             # submodule_upgrade (no branch)
             {
                 "args": lambda args: (
@@ -346,13 +454,6 @@ def test_upgrade_no_pending_merges(project):
                     "odoo/external-src/account-financial-reporting",
                 ],
             },
-            # get_submodule_commit before
-            {
-                "args": lambda args: (
-                    args[:2] == ["git", "-C"] and args[-2:] == ["rev-parse", "HEAD"]
-                ),
-                "stdout": commit_after.encode(),
-            },
             # submodule_upgrade (no branch)
             {
                 "args": lambda args: (
@@ -419,7 +520,7 @@ def test_upgrade_with_pending_merges(project):
             return_value=True,
         ),
         mock.patch.object(
-            submodule.pm_utils.Repo, "purge_merged_prs", return_value=[]
+            submodule.pm_utils, "purge_merged_prs_of", return_value=[]
         ) as mock_purge,
         mock.patch.object(
             submodule.pm_utils.Repo, "rebuild_consolidation_branch"
@@ -434,7 +535,9 @@ def test_upgrade_with_pending_merges(project):
             catch_exceptions=False,
         )
     assert result.exit_code == 0
-    mock_purge.assert_called_once_with()
+    (repos,), kwargs = mock_purge.call_args
+    assert [str(repo.path) for repo in repos] == ["odoo/external-src/account-closing"]
+    assert kwargs == {"refresh": False}
     mock_rebuild.assert_called_once_with(push=True, target_branch="merge-branch")
 
 
@@ -460,7 +563,9 @@ def test_upgrade_pending_merges_target_branch_resolved_once(project):
             "has_any_pr_left",
             return_value=True,
         ),
-        mock.patch.object(submodule.pm_utils.Repo, "purge_merged_prs", return_value=[]),
+        mock.patch.object(
+            submodule.pm_utils, "purge_merged_prs_of", return_value=[]
+        ) as mock_purge,
         mock.patch.object(
             submodule.pm_utils.Repo, "rebuild_consolidation_branch"
         ) as mock_rebuild,
@@ -475,6 +580,10 @@ def test_upgrade_pending_merges_target_branch_resolved_once(project):
         )
     assert result.exit_code == 0
     mock_get_target_branch.assert_called_once_with()
+    # The merged PRs of both submodules are looked up at once
+    (repos,), __ = mock_purge.call_args
+    assert len(repos) == 2
+    mock_purge.assert_called_once()
     # The fixture has 2 submodules: both are re-aggregated with the same branch.
     assert mock_rebuild.call_args_list == [
         mock.call(push=True, target_branch="merge-branch"),
@@ -503,7 +612,7 @@ def test_upgrade_no_aggregate_never_resolves_target_branch(project):
             "has_any_pr_left",
             return_value=True,
         ),
-        mock.patch.object(submodule.pm_utils.Repo, "purge_merged_prs", return_value=[]),
+        mock.patch.object(submodule.pm_utils, "purge_merged_prs_of", return_value=[]),
         mock.patch.object(
             submodule.pm_utils.gh, "get_target_branch"
         ) as mock_get_target_branch,
@@ -548,7 +657,7 @@ def test_upgrade_pending_merges_options(project, options, expect_purge, expect_r
             return_value=True,
         ),
         mock.patch.object(
-            submodule.pm_utils.Repo, "purge_merged_prs", return_value=[]
+            submodule.pm_utils, "purge_merged_prs_of", return_value=[]
         ) as mock_purge,
         mock.patch.object(
             submodule.pm_utils.Repo, "rebuild_consolidation_branch"
@@ -583,11 +692,11 @@ def test_upgrade_pending_merges_options(project, options, expect_purge, expect_r
 )
 def test_upgrade_pending_merges_all_purged(project):
     # Regression test for #252: when purging removes the last pending PR,
-    # purge_merged_prs() already deletes the pending-merges file. The upgrade
+    # purge_merged_prs_of() already deletes the pending-merges file. The upgrade
     # command must NOT call _handle_empty_merges_file() again, otherwise it
     # reads the now-deleted file and crashes with FileNotFoundError.
     # True the first time (enter purge branch), False afterwards because
-    # purge_merged_prs() deleted the now-empty pending-merges file.
+    # purge_merged_prs_of() deleted the now-empty pending-merges file.
     pending_merges = iter([True])
 
     def fake_has_pending_merges(self):
@@ -601,7 +710,7 @@ def test_upgrade_pending_merges_all_purged(project):
             side_effect=fake_has_pending_merges,
         ),
         mock.patch.object(
-            submodule.pm_utils.Repo, "purge_merged_prs", return_value=[]
+            submodule.pm_utils, "purge_merged_prs_of", return_value=[]
         ) as mock_purge,
         mock.patch.object(
             submodule.pm_utils.Repo, "_handle_empty_merges_file"
@@ -615,8 +724,10 @@ def test_upgrade_pending_merges_all_purged(project):
             catch_exceptions=False,
         )
     assert result.exit_code == 0
-    mock_purge.assert_called_once_with()
-    # The caller must not re-handle the empty file; purge_merged_prs() owns it.
+    (repos,), kwargs = mock_purge.call_args
+    assert [str(repo.path) for repo in repos] == ["odoo/external-src/account-closing"]
+    assert kwargs == {"refresh": False}
+    # The caller must not re-handle the empty file; purge_merged_prs_of() owns it.
     mock_handle.assert_not_called()
 
 
@@ -632,6 +743,14 @@ def test_upgrade_force_branch(project):
     commit_after = "bbb222"
     mock_fn = MockSubprocessRun(
         [
+            # get_pinned_shas
+            {
+                "args": ["git", "ls-tree", "-r", "-z", "HEAD"],
+                "stdout": (
+                    f"160000 commit {commit_before}\t"
+                    "odoo/external-src/account-closing\0"
+                ).encode(),
+            },
             # submodule_update
             {
                 "args": [
@@ -642,13 +761,6 @@ def test_upgrade_force_branch(project):
                     "odoo/external-src/account-closing",
                 ],
             },
-            # get_submodule_commit before
-            {
-                "args": lambda args: (
-                    args[:2] == ["git", "-C"] and args[-2:] == ["rev-parse", "HEAD"]
-                ),
-                "stdout": commit_before.encode(),
-            },
             # git reset
             {
                 "args": lambda args: args[:2] == ["git", "-C"] and args[-1] == "--hard",
@@ -0,0 +1,79 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import logging
+import subprocess
+
+import git
+import pytest
+
+from odoo_tools.utils import aggregator, ui
+
+from .common import make_upstream_repo
+
+
+@pytest.fixture()
+def upstream(tmp_path):
+    return make_upstream_repo(tmp_path / "upstream")
+
+
+def test_aggregate_in_process(upstream, tmp_path):
+    target = tmp_path / "edi"
+    config = {
+        "remotes": {"upstream": upstream.working_dir},
+        "merges": ["upstream 14.0", "upstream feature"],
+        "target": "upstream merge-branch",
+        "shell_command_after": ["git tag -f aggregated"],
+    }
+    timings = aggregator.aggregate(target, config)
+    repo = git.Repo(target)
+    assert repo.active_branch.name == "merge-branch"
+    assert repo.head.commit == upstream.heads["feature"].commit
+    assert repo.tags["aggregated"].commit == repo.head.commit
+    assert set(timings) == set(aggregator.PHASES)
+    assert all(seconds > 0 for seconds in timings.values())
+    # Again, on the existing repo: reset to the base, then merged
+    aggregator.aggregate(target, config)
+    assert repo.head.commit == upstream.heads["feature"].commit
+
+
+def test_aggregate_in_process_failure_captures_output(upstream, tmp_path, capfd):
+    config = {
+        "remotes": {"upstream": upstream.working_dir},
+        "merges": ["upstream 14.0", "upstream missing"],
+        "target": "upstream merge-branch",
+    }
+    with pytest.raises(subprocess.CalledProcessError) as exc_info:
+        aggregator.aggregate(tmp_path / "edi", config)
+    assert b"missing" in exc_info.value.stderr
+    # Not on the terminal: repos are aggregated concurrently
+    assert "missing" not in capfd.readouterr().err
+
+
+def test_aggregate_in_process_logs_captured(upstream, tmp_path, capfd):
+    config = {
+        "remotes": {"upstream": upstream.working_dir},
+        "merges": ["upstream 14.0", "upstream feature"],
+        "target": "upstream merge-branch",
+    }
+    with ui.capture_output() as output:
+        aggregator.aggregate(tmp_path / "edi", config)
+    messages = [msg for msg, __, __ in output]
+    assert "Pull upstream, feature" in messages
+    # Only in the captured output
+    assert "Pull upstream" not in "".join(capfd.readouterr())
+
+
+def test_aggregate_in_process_restores_logging(upstream, tmp_path):
+    config = {
+        "remotes": {"upstream": upstream.working_dir},
+        "merges": ["upstream 14.0"],
+        "target": "upstream merge-branch",
+    }
+    git_aggregator_logger = logging.getLogger("git_aggregator")
+    repo_logger = logging.getLogger("git_aggregator.repo")
+    level = git_aggregator_logger.level
+    with ui.capture_output():
+        aggregator.aggregate(tmp_path / "edi", config)
+    assert git_aggregator_logger.level == level
+    assert not repo_logger.filters
@@ -0,0 +1,44 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import json
+from datetime import timedelta
+
+from odoo_tools.utils.cache import JsonCache
+
+DAY = timedelta(days=1)
+
+
+def test_values_persist(isolated_cache):
+    JsonCache("test.json").update({"a": True, "b": False})
+    cache = JsonCache("test.json")
+    assert cache.get("a", DAY) is True
+    assert cache.get("b", DAY) is False
+    assert cache.lookup("c") is None
+    assert set(json.loads((isolated_cache / "test.json").read_text())) == {"a", "b"}
+
+
+def test_get_honors_max_age():
+    cache = JsonCache("test.json")
+    cache.set("a", 1)
+    assert cache.get("a", max_age=timedelta(hours=1)) == 1
+    assert cache.get("a", max_age=timedelta(0), default="expired") == "expired"
+
+
+def test_invalidate():
+    cache = JsonCache("test.json")
+    cache.update({"a": 1, "b": 2, "c": 3})
+    cache.invalidate("a")
+    assert cache.lookup("a") is None
+    assert cache.get("b", DAY) == 2
+    cache.invalidate()
+    assert JsonCache("test.json").lookup("b") is None
+
+
+def test_corrupted_file_is_ignored(isolated_cache):
+    isolated_cache.mkdir()
+    (isolated_cache / "test.json").write_text("not-json")
+    cache = JsonCache("test.json")
+    assert cache.lookup("a") is None
+    cache.set("a", 1)
+    assert JsonCache("test.json").get("a", DAY) == 1
@@ -1,11 +1,17 @@
 # Copyright 2023 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import pytest
 from click.testing import CliRunner
 
 from odoo_tools.utils import os_exec as exec_utils
+from odoo_tools.utils import ui
 
 
 def test_run():
@@ -22,3 +28,32 @@ def test_has_exec():
     assert exec_utils.has_exec("ls")
     assert exec_utils.has_exec("pytest")
     assert not exec_utils.has_exec("this_does_not_exist")
+
+
+def test_run_streamed_labels_output():
+    with ui.capture_output() as captured, ui.label_output("odoo"):
+        exec_utils.run_streamed(["sh", "-c", "echo one; echo two >&2"])
+    assert [msg for msg, __, __ in captured] == ["[odoo] one", "[odoo] two"]
+    with pytest.raises(subprocess.CalledProcessError):
+        exec_utils.run_streamed(["false"])
+
+
+def test_run_streamed_cancelled():
+    scope = exec_utils.CancelScope()
+    started = threading.Event()
+
+    def run():
+        with scope.enter(), ui.capture_output():
+            started.set()
+            exec_utils.run_streamed(["sleep", "30"])
+
+    with ThreadPoolExecutor() as pool:
+        future = pool.submit(run)
+        assert started.wait(timeout=5)
+        time.sleep(0.2)
+        scope.cancel()
+        with pytest.raises(subprocess.CalledProcessError):
+            future.result(timeout=10)
+    # Started after the cancellation: terminated right away
+    with scope.enter(), pytest.raises(subprocess.CalledProcessError):
+        exec_utils.run_streamed(["sleep", "30"])
@@ -1,12 +1,14 @@
 # Copyright 2023 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import json
 import subprocess
 from pathlib import Path
 from unittest.mock import patch
 
 import git
 import pytest
+import responses
 
 from odoo_tools.utils import gh as gh_utils
 
@@ -190,3 +192,110 @@ class TestCheckGitDiff:
         Path("requirements.txt").write_text("modified")
         repo.index.add(["requirements.txt"])
         assert gh_utils.check_git_diff() is True
+
+
+class TestRemoteReposExist:
+    urls = [
+        "git@github.com:OCA/account-closing.git",
+        "git@github.com:camptocamp/account-closing.git",
+        "git@example.com:foo/bar.git",
+    ]
+
+    def test_no_token_answers_nothing(self, monkeypatch):
+        monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+        assert gh_utils.remote_repos_exist(self.urls) == {}
+
+    @responses.activate
+    def test_single_query(self, monkeypatch):
+        monkeypatch.setenv("GITHUB_TOKEN", "secret")
+        responses.add(
+            responses.POST,
+            gh_utils.GRAPHQL_URL,
+            json={
+                "data": {"r0": {"id": "R_1"}, "r1": None},
+                "errors": [{"type": "NOT_FOUND", "path": ["r1"]}],
+            },
+        )
+        # Not found, or private and out of reach of the token: left to probe
+        assert gh_utils.remote_repos_exist(self.urls) == {self.urls[0]: True}
+        assert len(responses.calls) == 1
+        request = responses.calls[0].request
+        assert request.headers["Authorization"] == "bearer secret"
+        assert isinstance(request.body, bytes)
+        assert json.loads(request.body)["variables"] == {
+            "o0": "OCA",
+            "n0": "account-closing",
+            "o1": "camptocamp",
+            "n1": "account-closing",
+        }
+
+    @responses.activate
+    def test_failure_answers_nothing(self, monkeypatch):
+        monkeypatch.setenv("GITHUB_TOKEN", "secret")
+        responses.add(responses.POST, gh_utils.GRAPHQL_URL, status=502)
+        assert gh_utils.remote_repos_exist(self.urls) == {}
+
+
+class TestPullRequestsInfo:
+    prs = [("OCA", "edi", 773), ("OCA", "edi", 774)]
+
+    def test_no_token_answers_nothing(self, monkeypatch):
+        monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+        assert gh_utils.pull_requests_info(self.prs) == {}
+
+    @responses.activate
+    def test_single_query(self, monkeypatch):
+        monkeypatch.setenv("GITHUB_TOKEN", "secret")
+        responses.add(
+            responses.POST,
+            gh_utils.GRAPHQL_URL,
+            json={
+                "data": {
+                    "p0": {
+                        "pullRequest": {
+                            "state": "OPEN",
+                            "merged": False,
+                            "number": 773,
+                            "title": "Open",
+                            "updatedAt": "2025-01-02T00:00:00Z",
+                            "labels": {"nodes": [{"name": "bug"}]},
+                        }
+                    },
+                    "p1": None,
+                },
+            },
+        )
+        assert gh_utils.pull_requests_info(self.prs) == {
+            ("OCA", "edi", 773): {
+                "state": "open",
+                "merged": False,
+                "labels": [{"name": "bug"}],
+                "number": 773,
+                "title": "Open",
+                "updated_at": "2025-01-02T00:00:00Z",
+            }
+        }
+        request = responses.calls[0].request
+        assert isinstance(request.body, bytes)
+        assert json.loads(request.body)["variables"] == {
+            "o0": "OCA",
+            "n0": "edi",
+            "p0": 773,
+            "o1": "OCA",
+            "n1": "edi",
+            "p1": 774,
+        }
+
+    @responses.activate
+    def test_batches(self, monkeypatch):
+        monkeypatch.setenv("GITHUB_TOKEN", "secret")
+        monkeypatch.setattr(gh_utils, "GRAPHQL_PR_BATCH_SIZE", 1)
+        responses.add(responses.POST, gh_utils.GRAPHQL_URL, json={"data": {}})
+        assert gh_utils.pull_requests_info(self.prs) == {}
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_failure_answers_nothing(self, monkeypatch):
+        monkeypatch.setenv("GITHUB_TOKEN", "secret")
+        responses.add(responses.POST, gh_utils.GRAPHQL_URL, status=502)
+        assert gh_utils.pull_requests_info(self.prs) == {}
@@ -0,0 +1,191 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import os
+import time
+from unittest import mock
+
+import pytest
+import requests
+import responses
+from requests.adapters import HTTPAdapter
+from responses import matchers
+
+from odoo_tools.utils import gh_api
+
+URL = "https://api.github.com/repos/OCA/edi/pulls/1"
+
+
+@responses.activate
+def test_get_retries_server_errors(github_client):
+    responses.add(responses.GET, URL, status=502)
+    responses.add(responses.GET, URL, status=503)
+    responses.add(responses.GET, URL, json={"number": 1})
+    assert github_client.get(URL).json() == {"number": 1}
+    assert len(responses.calls) == 3
+    assert github_client._wait.call_args_list == [mock.call(1.0), mock.call(2.0)]
+
+
+@responses.activate
+def test_get_gives_up_after_max_retries(github_client):
+    responses.add(responses.GET, URL, status=500)
+    with pytest.raises(requests.HTTPError):
+        github_client.get(URL)
+    assert len(responses.calls) == gh_api.MAX_RETRIES + 1
+
+
+@responses.activate
+def test_get_honors_retry_after(github_client):
+    responses.add(responses.GET, URL, status=429, headers={"Retry-After": "7"})
+    responses.add(responses.GET, URL, json={})
+    github_client.get(URL)
+    github_client._wait.assert_called_once_with(7.0)
+
+
+@responses.activate
+def test_get_waits_for_rate_limit_reset(github_client):
+    reset = int(time.time()) + 10
+    responses.add(
+        responses.GET,
+        URL,
+        status=403,
+        headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)},
+    )
+    responses.add(responses.GET, URL, json={})
+    github_client.get(URL)
+    (delay,), __ = github_client._wait.call_args
+    assert 9 <= delay <= 11
+
+
+@responses.activate
+def test_get_does_not_wait_for_distant_reset(github_client):
+    responses.add(
+        responses.GET,
+        URL,
+        status=403,
+        headers={
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(int(time.time()) + 3600),
+        },
+    )
+    with pytest.raises(requests.HTTPError):
+        github_client.get(URL)
+    github_client._wait.assert_not_called()
+
+
+@responses.activate
+def test_get_does_not_retry_forbidden(github_client):
+    responses.add(responses.GET, URL, status=403)
+    with pytest.raises(requests.HTTPError):
+        github_client.get(URL)
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_get_retries_connection_errors(github_client):
+    responses.add(responses.GET, URL, body=requests.ConnectionError("boom"))
+    responses.add(responses.GET, URL, json={})
+    github_client.get(URL)
+    assert len(responses.calls) == 2
+
+
+def test_auth_headers(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    assert gh_api.GitHubClient.auth_headers() == {"Authorization": "token secret"}
+    assert gh_api.GitHubClient.auth_headers("bearer") == {
+        "Authorization": "bearer secret"
+    }
+    monkeypatch.delenv("GITHUB_TOKEN")
+    assert gh_api.GitHubClient.auth_headers() == {}
+
+
+def test_configure_sizes_shared_pool():
+    gh_api.configure(pool_size=3)
+    client = gh_api.get_client()
+    adapter = client.session.get_adapter(URL)
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter._pool_maxsize == 3
+    gh_api.configure(pool_size=3)
+    assert gh_api.get_client() is client
+    gh_api.configure(pool_size=4)
+    assert gh_api.get_client() is not client
+
+
+def test_configure_caps_shared_pool():
+    gh_api.configure(pool_size=gh_api.MAX_POOL_SIZE + 100)
+    client = gh_api.get_client()
+    assert client.pool_size == gh_api.MAX_POOL_SIZE
+    adapter = client.session.get_adapter(URL)
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter._pool_maxsize == gh_api.MAX_POOL_SIZE
+    # The calls beyond the pool wait for a connection instead of opening one
+    assert adapter._pool_block
+    # The hosts don't evict each other's pool
+    assert adapter._pool_connections == gh_api.POOL_HOSTS
+    gh_api.configure(pool_size=gh_api.MAX_POOL_SIZE)
+    assert gh_api.get_client() is client
+
+
+@responses.activate
+def test_get_json_revalidates_cached_response(github_client):
+    responses.add(responses.GET, URL, json={"number": 1}, headers={"ETag": '"v1"'})
+    responses.add(
+        responses.GET,
+        URL,
+        status=304,
+        match=[matchers.header_matcher({"If-None-Match": '"v1"'})],
+    )
+    assert github_client.get_json(URL) == {"number": 1}
+    assert github_client.get_json(URL) == {"number": 1}
+    assert "If-None-Match" not in responses.calls[0].request.headers
+    assert (gh_api.response_cache.hits, gh_api.response_cache.misses) == (1, 1)
+
+
+@responses.activate
+def test_get_json_refreshes_changed_response(github_client):
+    responses.add(responses.GET, URL, json={"state": "open"}, headers={"ETag": "1"})
+    responses.add(responses.GET, URL, json={"state": "closed"}, headers={"ETag": "2"})
+    responses.add(
+        responses.GET,
+        URL,
+        status=304,
+        match=[matchers.header_matcher({"If-None-Match": "2"})],
+    )
+    assert github_client.get_json(URL) == {"state": "open"}
+    assert github_client.get_json(URL) == {"state": "closed"}
+    assert github_client.get_json(URL) == {"state": "closed"}
+
+
+@responses.activate
+def test_get_json_cache_per_token(github_client, monkeypatch):
+    responses.add(responses.GET, URL, json={"private": False}, headers={"ETag": "1"})
+    responses.add(responses.GET, URL, json={"private": True}, headers={"ETag": "2"})
+    assert github_client.get_json(URL) == {"private": False}
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    github_client.get_json(URL, headers=github_client.auth_headers())
+    assert "If-None-Match" not in responses.calls[1].request.headers
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = gh_api.ResponseCache()
+    for i, url in enumerate(("/one", "/two", "/six")):
+        cache.store(url, "etag", "x" * 40)
+        os.utime(cache._file(url), (i, i))
+    # Room for two responses
+    cache.max_size = 2 * cache._file("/one").stat().st_size
+    cache.touch("/one")
+    cache.evict()
+    assert cache.lookup("/one") is not None
+    assert cache.lookup("/two") is None
+    assert cache.lookup("/six") is not None
+
+
+def test_response_cache_close_logs_stats(caplog):
+    cache = gh_api.ResponseCache()
+    cache.count(hit=True)
+    cache.count(hit=False)
+    cache.count(hit=False)
+    with caplog.at_level("DEBUG", logger="odoo_tools.utils.gh_api"):
+        cache.close()
+    assert "1 hit(s), 2 miss(es)" in caplog.text
+    assert (cache.hits, cache.misses) == (0, 0)
@@ -2,6 +2,8 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
 import subprocess
+import threading
+from datetime import timedelta
 from pathlib import Path
 from unittest import mock
 
@@ -11,9 +13,15 @@ import pytest
 from odoo_tools.exceptions import ProjectConfigException
 from odoo_tools.utils import git as git_utils
 from odoo_tools.utils import proj as proj_utils
+from odoo_tools.utils.cache import JsonCache
 from odoo_tools.utils.path import build_path, root_path
 
-from .common import MockSubprocessRun, assert_no_chdir, get_fixture_path
+from .common import (
+    MockSubprocessRun,
+    assert_no_chdir,
+    get_fixture_path,
+    make_upstream_repo,
+)
 
 # ── helpers ──────────────────────────────────────────────────────────────────
 
@@ -154,6 +162,8 @@ def test_fetch_targeted_success():
                 "git",
                 "-C",
                 "/repo",
+                "-c",
+                "protocol.version=2",
                 "fetch",
                 "OCA",
                 "+refs/heads/18.0:refs/remotes/OCA/18.0",
@@ -162,6 +172,22 @@ def test_fetch_targeted_success():
         )
 
 
+def test_fetch_targeted_single_fetch_for_all_refspecs():
+    with mock.patch("odoo_tools.utils.git.run") as mock_run:
+        git_utils.fetch_targeted(
+            "/repo",
+            "OCA",
+            "+refs/heads/18.0:refs/remotes/OCA/18.0",
+            "+refs/heads/17.0:refs/remotes/OCA/17.0",
+        )
+    mock_run.assert_called_once()
+    assert mock_run.call_args.args[0][-3:] == [
+        "OCA",
+        "+refs/heads/18.0:refs/remotes/OCA/18.0",
+        "+refs/heads/17.0:refs/remotes/OCA/17.0",
+    ]
+
+
 def test_fetch_targeted_warns_on_failure():
     with (
         mock.patch(
@@ -182,7 +208,7 @@ def test_fetch_targeted_warns_on_failure():
 
 def test_setup_submodule_remotes_with_project_id():
     with (
-        mock.patch("odoo_tools.utils.git.remote_exists", return_value=False),
+        mock.patch("odoo_tools.utils.git.get_remotes", return_value={}),
         mock.patch("odoo_tools.utils.git.ensure_remote") as mock_ensure,
         mock.patch("odoo_tools.utils.git.fetch_targeted") as mock_fetch,
         mock.patch("odoo_tools.utils.git.remote_repo_exists", return_value=True),
@@ -196,12 +222,16 @@ def test_setup_submodule_remotes_with_project_id():
         )
         assert mock_ensure.call_count == 2
         mock_ensure.assert_any_call(
-            "/cache/account-payment", "OCA", "git@github.com:OCA/account-payment.git"
+            "/cache/account-payment",
+            "OCA",
+            "git@github.com:OCA/account-payment.git",
+            remotes={},
         )
         mock_ensure.assert_any_call(
             "/cache/account-payment",
             "camptocamp",
             "git@github.com:camptocamp/account-payment.git",
+            remotes={},
         )
         assert mock_fetch.call_count == 2
         mock_fetch.assert_any_call(
@@ -218,7 +248,7 @@ def test_setup_submodule_remotes_with_project_id():
 
 def test_setup_submodule_remotes_without_project_id():
     with (
-        mock.patch("odoo_tools.utils.git.remote_exists", return_value=False),
+        mock.patch("odoo_tools.utils.git.get_remotes", return_value={}),
         mock.patch("odoo_tools.utils.git.ensure_remote") as mock_ensure,
         mock.patch("odoo_tools.utils.git.fetch_targeted") as mock_fetch,
         mock.patch("odoo_tools.utils.git.remote_repo_exists", return_value=True),
@@ -232,7 +262,10 @@ def test_setup_submodule_remotes_without_project_id():
         )
         # Only OCA should be set up; camptocamp fetch is skipped when project_id is None
         mock_ensure.assert_called_once_with(
-            "/cache/account-payment", "OCA", "git@github.com:OCA/account-payment.git"
+            "/cache/account-payment",
+            "OCA",
+            "git@github.com:OCA/account-payment.git",
+            remotes={},
         )
         mock_fetch.assert_called_once_with(
             "/cache/account-payment",
@@ -253,7 +286,7 @@ def test_setup_submodule_remotes_skips_missing_oca():
         return not url.startswith("git@github.com:OCA/")
 
     with (
-        mock.patch("odoo_tools.utils.git.remote_exists", return_value=False),
+        mock.patch("odoo_tools.utils.git.get_remotes", return_value={}),
         mock.patch("odoo_tools.utils.git.ensure_remote") as mock_ensure,
         mock.patch("odoo_tools.utils.git.fetch_targeted") as mock_fetch,
         mock.patch("odoo_tools.utils.git.remote_repo_exists", side_effect=repo_exists),
@@ -270,6 +303,7 @@ def test_setup_submodule_remotes_skips_missing_oca():
             "/cache/odoo-tools",
             "camptocamp",
             "git@github.com:camptocamp/odoo-tools.git",
+            remotes={},
         )
         mock_fetch.assert_called_once_with(
             "/cache/odoo-tools",
@@ -285,7 +319,7 @@ def test_setup_submodule_remotes_skips_missing_company_fork():
         return url.startswith("git@github.com:OCA/")
 
     with (
-        mock.patch("odoo_tools.utils.git.remote_exists", return_value=False),
+        mock.patch("odoo_tools.utils.git.get_remotes", return_value={}),
         mock.patch("odoo_tools.utils.git.ensure_remote") as mock_ensure,
         mock.patch("odoo_tools.utils.git.fetch_targeted") as mock_fetch,
         mock.patch("odoo_tools.utils.git.remote_repo_exists", side_effect=repo_exists),
@@ -299,7 +333,10 @@ def test_setup_submodule_remotes_skips_missing_company_fork():
         )
         # Only the OCA remote is set up; the missing company fork is skipped
         mock_ensure.assert_called_once_with(
-            "/cache/account-payment", "OCA", "git@github.com:OCA/account-payment.git"
+            "/cache/account-payment",
+            "OCA",
+            "git@github.com:OCA/account-payment.git",
+            remotes={},
         )
         mock_fetch.assert_called_once_with(
             "/cache/account-payment",
@@ -311,7 +348,13 @@ def test_setup_submodule_remotes_skips_missing_company_fork():
 def test_setup_submodule_remotes_skips_probe_when_remote_present():
     """When the remotes are already configured locally, skip the network probe."""
     with (
-        mock.patch("odoo_tools.utils.git.remote_exists", return_value=True),
+        mock.patch(
+            "odoo_tools.utils.git.get_remotes",
+            return_value={
+                "OCA": "git@github.com:OCA/account-payment.git",
+                "camptocamp": "git@github.com:camptocamp/account-payment.git",
+            },
+        ),
         mock.patch("odoo_tools.utils.git.ensure_remote") as mock_ensure,
         mock.patch("odoo_tools.utils.git.fetch_targeted") as mock_fetch,
         mock.patch("odoo_tools.utils.git.remote_repo_exists") as mock_probe,
@@ -330,42 +373,242 @@ def test_setup_submodule_remotes_skips_probe_when_remote_present():
         assert mock_fetch.call_count == 2
 
 
+def _make_cache_and_worktree(tmp_path, reference=True):
+    """Create an autoshare-like cache with remote-tracking refs, and a clone of
+    it borrowing its objects (or not); return their paths and the commit SHA."""
+    cache = tmp_path / "cache"
+    worktree = tmp_path / "worktree"
+    sha = _make_repo_with_commit(cache)
+    cache_repo = git.Repo(cache)
+    cache_repo.git.update_ref("refs/remotes/OCA/18.0", sha)
+    cache_repo.git.update_ref("refs/remotes/camptocamp/merge-branch-1289-a", sha)
+    cache_repo.git.update_ref("refs/remotes/camptocamp/other", sha)
+    args = ["--reference", str(cache)] if reference else []
+    git.Repo.clone_from(str(cache), str(worktree), multi_options=args)
+    return cache, worktree, sha
+
+
+def test_setup_submodule_remotes_mirrors_refs_from_reference(tmp_path):
+    cache, worktree, sha = _make_cache_and_worktree(tmp_path)
+    assert git_utils.borrows_objects_from(worktree, cache)
+    with (
+        mock.patch("odoo_tools.utils.git.fetch_targeted") as mock_fetch,
+        mock.patch("odoo_tools.utils.git.remote_repo_exists", return_value=True),
+    ):
+        report = git_utils.setup_submodule_remotes(
+            worktree,
+            "git@github.com:OCA/account-payment.git",
+            "18.0",
+            "1289",
+            "camptocamp",
+            reference=cache,
+        )
+    mock_fetch.assert_not_called()
+    assert not report.fetched
+    refs = git.Repo(worktree).git.for_each_ref("--format=%(objectname) %(refname)")
+    assert refs.splitlines() == [
+        f"{sha} refs/heads/{git.Repo(worktree).active_branch.name}",
+        f"{sha} refs/remotes/OCA/18.0",
+        f"{sha} refs/remotes/camptocamp/merge-branch-1289-a",
+        f"{sha} refs/remotes/origin/HEAD",
+        f"{sha} refs/remotes/origin/{git.Repo(worktree).active_branch.name}",
+    ]
+    assert set(git_utils.get_remotes(worktree)) == {"origin", "OCA", "camptocamp"}
+
+
+def test_setup_submodule_remotes_fetches_without_alternates(tmp_path):
+    cache, worktree, __ = _make_cache_and_worktree(tmp_path, reference=False)
+    assert not git_utils.borrows_objects_from(worktree, cache)
+    with (
+        mock.patch("odoo_tools.utils.git.fetch_targeted") as mock_fetch,
+        mock.patch("odoo_tools.utils.git.remote_repo_exists", return_value=True),
+    ):
+        report = git_utils.setup_submodule_remotes(
+            worktree,
+            "git@github.com:OCA/account-payment.git",
+            "18.0",
+            "1289",
+            "camptocamp",
+            reference=cache,
+        )
+    assert mock_fetch.call_count == 2
+    assert report.fetched
+
+
 # ── remote_repo_exists ────────────────────────────────────────────────────────
 
 
 def test_remote_repo_exists_true():
-    git_utils.remote_repo_exists.cache_clear()
     with mock.patch("subprocess.run", return_value=mock.Mock(returncode=0)) as mock_run:
         assert git_utils.remote_repo_exists("git@github.com:OCA/account-payment.git")
         mock_run.assert_called_once_with(
-            ["git", "ls-remote", "git@github.com:OCA/account-payment.git"],
+            ["git", "ls-remote", "git@github.com:OCA/account-payment.git", "HEAD"],
             capture_output=True,
+            text=True,
+            env=mock.ANY,
         )
 
 
 def test_remote_repo_exists_false():
-    git_utils.remote_repo_exists.cache_clear()
-    with mock.patch("subprocess.run", return_value=mock.Mock(returncode=128)):
+    missing = mock.Mock(returncode=128, stderr="ERROR: Repository not found.\n")
+    with mock.patch("subprocess.run", return_value=missing):
         assert not git_utils.remote_repo_exists("git@github.com:OCA/odoo-tools.git")
 
 
+def test_remote_repo_exists_cached_across_runs():
+    url = "git@github.com:OCA/account-payment.git"
+    missing_url = "git@github.com:OCA/odoo-tools.git"
+
+    def ls_remote(args, **kw):
+        if args[2] == url:
+            return mock.Mock(returncode=0)
+        return mock.Mock(returncode=128, stderr="ERROR: Repository not found.\n")
+
+    with mock.patch("subprocess.run", side_effect=ls_remote) as mock_run:
+        assert git_utils.remote_repo_exists(url)
+        assert not git_utils.remote_repo_exists(missing_url)
+    assert mock_run.call_count == 2
+    # A new run reads the answers back from disk
+    with (
+        mock.patch.object(
+            git_utils, "remote_repo_cache", JsonCache("remote-repos.json")
+        ),
+        mock.patch("subprocess.run") as mock_run,
+    ):
+        assert git_utils.remote_repo_exists(url)
+        assert not git_utils.remote_repo_exists(missing_url)
+    mock_run.assert_not_called()
+
+
+def test_remote_repo_exists_failed_probe_not_cached():
+    url = "git@github.com:OCA/account-payment.git"
+    unreachable = mock.Mock(returncode=128, stderr="ssh: Could not resolve hostname")
+    with mock.patch("subprocess.run", return_value=unreachable):
+        assert not git_utils.remote_repo_exists(url)
+    assert git_utils.remote_repo_cache.lookup(url) is None
+
+
+def test_remote_repo_exists_missing_expires_sooner():
+    url = "git@github.com:OCA/odoo-tools.git"
+    git_utils.remote_repo_cache.set(url, False)
+    entry = git_utils.remote_repo_cache.lookup(url)
+    assert entry is not None
+    stale = entry._replace(stored_at=entry.stored_at - timedelta(days=2))
+    with (
+        mock.patch.object(git_utils.remote_repo_cache, "lookup", return_value=stale),
+        mock.patch("subprocess.run", return_value=mock.Mock(returncode=0)) as mock_run,
+    ):
+        assert git_utils.remote_repo_exists(url)
+    mock_run.assert_called_once()
+    # Existing repositories are trusted for longer
+    git_utils.remote_repo_cache.set(url, True)
+    with (
+        mock.patch.object(
+            git_utils.remote_repo_cache,
+            "lookup",
+            return_value=stale._replace(value=True),
+        ),
+        mock.patch("subprocess.run") as mock_run,
+    ):
+        assert git_utils.remote_repo_exists(url)
+    mock_run.assert_not_called()
+
+
+def test_prefetch_remote_repos_concurrent():
+    urls = [
+        "git@github.com:OCA/account-payment.git",
+        "git@github.com:OCA/odoo-tools.git",
+    ]
+    both_started = threading.Barrier(2, timeout=5)
+
+    def ls_remote(args, **kw):
+        # Blocks until both probes run at the same time
+        both_started.wait()
+        return mock.Mock(returncode=0)
+
+    with mock.patch("subprocess.run", side_effect=ls_remote):
+        git_utils.prefetch_remote_repos(urls + urls[:1], max_workers=2)
+    with mock.patch("subprocess.run") as mock_run:
+        assert all(git_utils.remote_repo_exists(url) for url in urls)
+    mock_run.assert_not_called()
+
+
+def test_prefetch_remote_repos_batch_lookup():
+    known = "git@github.com:OCA/account-payment.git"
+    unknown = "git@example.com:foo/bar.git"
+    git_utils.remote_repo_cache.set("git@github.com:OCA/cached.git", True)
+    batch_lookup = mock.Mock(return_value={known: False})
+    with mock.patch("subprocess.run", return_value=mock.Mock(returncode=0)) as mock_run:
+        git_utils.prefetch_remote_repos(
+            [known, unknown, "git@github.com:OCA/cached.git"],
+            batch_lookup=batch_lookup,
+        )
+    # Only the URLs without a fresh answer are looked up...
+    batch_lookup.assert_called_once_with([known, unknown])
+    # ...and only the ones the batch lookup could not answer are probed
+    mock_run.assert_called_once()
+    assert mock_run.call_args.args[0][2] == unknown
+    assert git_utils.remote_repo_cache.get(known, timedelta(days=1)) is False
+    assert git_utils.remote_repo_cache.get(unknown, timedelta(days=1)) is True
+
+
+def test_prefetch_submodule_remotes_skips_configured(project, tmp_path):
+    company = git_utils.proj_config.company_git_remote
+    # Both cloned with their remotes set up...
+    warm = tmp_path / "warm"
+    partial = tmp_path / "partial"
+    for path in (warm, partial):
+        repo = git.Repo.init(path)
+        for name in ("OCA", company):
+            repo.create_remote(name, f"git@github.com:{name}/{path.name}.git")
+    # ...but the autoshare cache of ``partial`` lacks the company remote
+    cache = tmp_path / "cache.git"
+    git.Repo.init(cache, bare=True).create_remote(
+        "OCA", "git@github.com:OCA/partial.git"
+    )
+    submodules = [
+        mock.Mock(path=str(warm), url="git@github.com:OCA/warm.git"),
+        mock.Mock(path=str(partial), url="git@github.com:OCA/partial.git"),
+        mock.Mock(path=str(tmp_path / "new"), url="git@github.com:OCA/new.git"),
+    ]
+
+    def find_autoshare(urls):
+        if urls == ["git@github.com:OCA/partial.git"]:
+            return None, mock.Mock(repo_dir=str(cache))
+        return None, None
+
+    with (
+        mock.patch.object(git_utils, "get_project_id", return_value="1234"),
+        mock.patch.object(
+            git_utils, "find_autoshare_repository", side_effect=find_autoshare
+        ),
+        mock.patch.object(git_utils, "prefetch_remote_repos") as mock_prefetch,
+    ):
+        git_utils.prefetch_submodule_remotes(submodules)
+    assert mock_prefetch.call_args.args[0] == [
+        f"git@github.com:{company}/partial.git",
+        "git@github.com:OCA/new.git",
+        f"git@github.com:{company}/new.git",
+    ]
+
+
 # ── get_pinned_sha ────────────────────────────────────────────────────────────
 
 
-def test_get_pinned_sha_returns_commit():
+def test_get_pinned_sha_returns_commit(project):
     ls_tree_output = "160000 commit abc123def456\todoo/external-src/foo"
     with mock.patch("odoo_tools.utils.git.run", return_value=ls_tree_output):
         sha = git_utils.get_pinned_sha("odoo/external-src/foo")
         assert sha == "abc123def456"
 
 
-def test_get_pinned_sha_returns_none_on_empty():
+def test_get_pinned_sha_returns_none_on_empty(project):
     with mock.patch("odoo_tools.utils.git.run", return_value=""):
         sha = git_utils.get_pinned_sha("odoo/external-src/foo")
         assert sha is None
 
 
-def test_get_pinned_sha_returns_none_on_error():
+def test_get_pinned_sha_returns_none_on_error(project):
     with mock.patch(
         "odoo_tools.utils.git.run",
         side_effect=subprocess.CalledProcessError(128, "git"),
@@ -374,32 +617,90 @@ def test_get_pinned_sha_returns_none_on_error():
         assert sha is None
 
 
-# ── pin_submodule_commit ──────────────────────────────────────────────────────
-
-
-def test_pin_submodule_commit_when_in_store():
-    with (
-        mock.patch("subprocess.run") as mock_sp_run,
-        mock.patch("odoo_tools.utils.git.run") as mock_run,
-    ):
-        mock_sp_run.return_value = mock.Mock(returncode=0)  # cat-file succeeds
-        result = git_utils.pin_submodule_commit("/repo", "abc123")
-        assert result is True
-        mock_run.assert_called_once_with(
-            ["git", "-C", "/repo", "update-ref", "refs/c2c-sync/pinned", "abc123"],
-            check=True,
-        )
+# ── get_pinned_shas ───────────────────────────────────────────────────────────
 
 
-def test_pin_submodule_commit_not_in_store():
-    with (
-        mock.patch("subprocess.run") as mock_sp_run,
-        mock.patch("odoo_tools.utils.git.run") as mock_run,
-    ):
-        mock_sp_run.return_value = mock.Mock(returncode=128)  # cat-file fails
-        result = git_utils.pin_submodule_commit("/repo", "abc123")
-        assert result is False
-        mock_run.assert_not_called()
+@pytest.mark.project_setup(git_init=True)
+def test_get_pinned_shas_single_lookup(project):
+    repo = git.Repo(".")
+    pins = {
+        "odoo/external-src/foo": "1" * 40,
+        "odoo/external-src/bar": "2" * 40,
+    }
+    for path, sha in pins.items():
+        repo.git.update_index("--add", "--cacheinfo", f"160000,{sha},{path}")
+    repo.index.commit("add submodules")
+    # Regular files are not reported
+    assert git_utils.get_pinned_shas() == pins
+    with mock.patch("odoo_tools.utils.git.run", wraps=git_utils.run) as mock_run:
+        assert git_utils.get_pinned_shas("odoo/external-src/foo") == {
+            "odoo/external-src/foo": "1" * 40
+        }
+    mock_run.assert_called_once()
+
+
+# ── ObjectChecker / update_refs / pin_submodule_commit ───────────────────────
+
+
+def _make_repo_with_commit(path):
+    """Create a git repo at ``path`` with a single commit, and return its SHA."""
+    repo = git.Repo.init(path)
+    with repo.config_writer() as cfg:
+        cfg.set_value("user", "email", "test@test.com")
+        cfg.set_value("user", "name", "Test")
+        cfg.set_value("commit", "gpgsign", "false")
+    (Path(path) / "README").write_text("hello")
+    repo.index.add(["README"])
+    return repo.index.commit("initial commit").hexsha
+
+
+def test_object_checker(tmp_path):
+    sha = _make_repo_with_commit(tmp_path)
+    with git_utils.ObjectChecker(tmp_path) as objects:
+        assert objects.resolve(sha) == (sha, "commit")
+        assert objects.exists(f"{sha}^{{commit}}")
+        assert objects.exists(f"{sha}^{{tree}}")
+        assert not objects.exists("0" * 40)
+        assert not objects.exists("no-such-branch")
+
+
+def test_update_refs_single_transaction(tmp_path):
+    sha = _make_repo_with_commit(tmp_path)
+    with mock.patch("odoo_tools.utils.git.run", wraps=git_utils.run) as mock_run:
+        git_utils.update_refs(tmp_path, {"refs/foo/one": sha, "refs/foo/two": sha})
+    mock_run.assert_called_once()
+    repo = git.Repo(tmp_path)
+    assert repo.git.rev_parse("refs/foo/one") == sha
+    assert repo.git.rev_parse("refs/foo/two") == sha
+
+
+def test_update_refs_all_or_nothing(tmp_path):
+    sha = _make_repo_with_commit(tmp_path)
+    with pytest.raises(subprocess.CalledProcessError):
+        git_utils.update_refs(tmp_path, {"refs/foo/one": sha, "refs/foo/two": "1" * 40})
+    repo = git.Repo(tmp_path)
+    assert not repo.git.for_each_ref("refs/foo/")
+
+
+def test_pin_submodule_commit_when_in_store(tmp_path):
+    sha = _make_repo_with_commit(tmp_path)
+    assert git_utils.pin_submodule_commit(tmp_path, sha) is True
+    assert git.Repo(tmp_path).git.rev_parse(git_utils.PINNED_REF) == sha
+
+
+def test_pin_submodule_commit_not_in_store(tmp_path):
+    _make_repo_with_commit(tmp_path)
+    with mock.patch("odoo_tools.utils.git.run", wraps=git_utils.run) as mock_run:
+        assert git_utils.pin_submodule_commit(tmp_path, "1" * 40) is False
+    # update-ref checks the commit on its own: a single git process
+    mock_run.assert_called_once()
+    assert not git.Repo(tmp_path).git.for_each_ref(git_utils.PINNED_REF)
+
+
+def test_object_exists(tmp_path):
+    sha = _make_repo_with_commit(tmp_path)
+    assert git_utils.object_exists(tmp_path, f"{sha}^{{commit}}")
+    assert not git_utils.object_exists(tmp_path, "1" * 40)
 
 
 # ── submodule_update integration ──────────────────────────────────────────────
@@ -457,6 +758,36 @@ def test_submodule_update_populates_autoshare_remotes(project, tmp_path):
     )
 
 
+@pytest.mark.project_setup(
+    manifest=dict(odoo_version="18.0", project_id="1289"),
+    proj_version="18.0.1.0.0",
+    extra_files={
+        ".gitmodules": Path(get_fixture_path("fake-gitmodules")).read_text(),
+    },
+)
+def test_submodule_update_worktree_refs_from_autoshare(project, tmp_path):
+    """The working tree gets its remote refs from the autoshare cache."""
+    cache_dir = tmp_path / "autoshare-cache"
+    cache_dir.mkdir()
+    Path("odoo/external-src/account-closing").mkdir(parents=True)
+    with (
+        mock.patch("odoo_tools.utils.git.run"),
+        mock.patch(
+            "odoo_tools.utils.git.find_autoshare_repository",
+            return_value=(None, _make_autoshare_repo(cache_dir)),
+        ),
+        mock.patch(
+            "odoo_tools.utils.git.setup_submodule_remotes"
+        ) as mock_setup_remotes,
+    ):
+        git_utils.submodule_update("odoo/external-src/account-closing", pinned_shas={})
+    assert [call.args[0] for call in mock_setup_remotes.call_args_list] == [
+        str(cache_dir),
+        build_path("odoo/external-src/account-closing"),
+    ]
+    assert mock_setup_remotes.call_args.kwargs == {"reference": str(cache_dir)}
+
+
 @pytest.mark.project_setup(
     manifest=dict(odoo_version="18.0", project_id="1289"),
     proj_version="18.0.1.0.0",
@@ -503,6 +834,111 @@ def test_submodule_update_pins_commit_after_clone(project, tmp_path):
     assert call_args[1] == pinned_sha
 
 
+# ── _checkout_repo ────────────────────────────────────────────────────────────
+
+
+@pytest.mark.parametrize(
+    "mode, partial_args",
+    [
+        ("shallow", ["--depth", "1"]),
+        ("blobless", ["--filter=blob:none"]),
+    ],
+)
+def test_checkout_repo_partial(tmp_path, mode, partial_args):
+    dest = tmp_path / "odoo"
+    with (
+        mock.patch(
+            "odoo_tools.utils.git.find_autoshare_repository", return_value=(None, None)
+        ),
+        mock.patch("odoo_tools.utils.git.run", return_value="") as mock_run,
+        mock.patch("odoo_tools.utils.git._run_network") as mock_network,
+        mock.patch("subprocess.run"),
+    ):
+        git_utils._checkout_repo("odoo", "odoo", dest, "abc123", mode=mode)
+    # No clone, which would fetch the default branch
+    assert mock_run.call_args_list[:2] == [
+        mock.call(["git", "init", "--quiet", str(dest)], check=True),
+        mock.call(
+            [
+                "git",
+                "-C",
+                str(dest),
+                "remote",
+                "add",
+                "origin",
+                "git@github.com:odoo/odoo",
+            ],
+            check=True,
+        ),
+    ]
+    fetch, checkout = mock_network.call_args_list
+    assert fetch == mock.call(
+        ["git", "-C", str(dest), "fetch", "--quiet", *partial_args, "origin", "abc123"]
+    )
+    # A blobless clone fetches the file contents while checking them out
+    assert checkout.args[0][-3:] == ["checkout", "--force", "abc123"]
+
+
+def test_checkout_repo_partial_refused(tmp_path):
+    dest = tmp_path / "odoo"
+    with (
+        mock.patch(
+            "odoo_tools.utils.git.find_autoshare_repository", return_value=(None, None)
+        ),
+        mock.patch("odoo_tools.utils.git.run", return_value=""),
+        mock.patch(
+            "odoo_tools.utils.git._run_network",
+            side_effect=[subprocess.CalledProcessError(128, "git"), None, None],
+        ) as mock_network,
+        mock.patch("subprocess.run"),
+        mock.patch("odoo_tools.utils.git.ui.echo") as mock_echo,
+    ):
+        git_utils._checkout_repo("odoo", "odoo", dest, "abc123", mode="shallow")
+    assert mock_network.call_args_list[1] == mock.call(
+        ["git", "-C", str(dest), "fetch", "--quiet", "origin", "abc123"]
+    )
+    assert any("refused" in call.args[0] for call in mock_echo.call_args_list)
+
+
+def test_checkout_repo_partial_ignored_on_full_clone(tmp_path):
+    dest = tmp_path / "odoo"
+    _make_repo_with_commit(dest)
+    with (
+        mock.patch(
+            "odoo_tools.utils.git.find_autoshare_repository", return_value=(None, None)
+        ),
+        mock.patch("odoo_tools.utils.git._run_network") as mock_network,
+        mock.patch("odoo_tools.utils.git.subprocess.run", wraps=subprocess.run),
+    ):
+        git_utils._checkout_repo("odoo", "odoo", dest, "HEAD", mode="shallow")
+    # Turning a full clone into a shallow one would lose its history
+    assert mock_network.call_args_list[0] == mock.call(
+        ["git", "-C", str(dest), "fetch", "--quiet", "origin", "HEAD"]
+    )
+
+
+def test_deepen_repo(tmp_path):
+    source = tmp_path / "source"
+    _make_repo_with_commit(source)
+    source_repo = git.Repo(source)
+    for i in range(3):
+        (source / "README").write_text(f"change {i}")
+        source_repo.index.add(["README"])
+        source_repo.index.commit(f"change {i}")
+    dest = tmp_path / "dest"
+    git.Repo.clone_from(f"file://{source}", str(dest), depth=1)
+
+    def history():
+        return len(git.Repo(dest).git.rev_list("HEAD").splitlines())
+
+    assert history() == 1
+    git_utils.deepen_repo(dest, depth=1)
+    assert history() == 2
+    git_utils.deepen_repo(dest)
+    assert history() == 4
+    assert not (dest / ".git" / "shallow").exists()
+
+
 # ── get_current_branch ────────────────────────────────────────────────────────
 
 
@@ -555,3 +991,188 @@ def test_set_remote_url_runs_in_submodule(project):
         cwd=build_path("odoo/external-src/edi"),
         check=True,
     )
+
+
+def _write_patch(repo_path, dest, file_name, content, message):
+    """Commit ``content`` in ``file_name`` and export it to the patch ``dest``,
+    leaving the repo as it was."""
+    repo = git.Repo(repo_path)
+    (Path(repo_path) / file_name).write_text(content)
+    repo.index.add([file_name])
+    repo.index.commit(message)
+    Path(dest).write_text(repo.git.format_patch("--stdout", "-1") + "\n")
+    repo.git.reset("--hard", "HEAD~1")
+
+
+@pytest.fixture()
+def patch_series(tmp_path, monkeypatch):
+    """A repo with a commit, and two patches to apply on it."""
+    monkeypatch.setenv("GIT_COMMITTER_NAME", "Test")
+    monkeypatch.setenv("GIT_COMMITTER_EMAIL", "test@test.com")
+    repo_path = tmp_path / "repo"
+    base = _make_repo_with_commit(repo_path)
+    patches = [tmp_path / "0001-one.patch", tmp_path / "0002-two.patch"]
+    _write_patch(repo_path, patches[0], "one", "1", "one")
+    repo = git.Repo(repo_path)
+    (repo_path / "one").write_text("1")
+    repo.index.add(["one"])
+    repo.index.commit("one")
+    _write_patch(repo_path, patches[1], "two", "2", "two")
+    repo.git.reset("--hard", base)
+    return repo_path, base, patches
+
+
+def _applied_patches(mock_run):
+    return [c.args[0][-1] for c in mock_run.call_args_list if "am" in c.args[0]]
+
+
+def test_apply_patches_cached(patch_series):
+    repo_path, base, patches = patch_series
+    git_utils.apply_patches(repo_path, base, patches)
+    head = git.Repo(repo_path).head.commit.hexsha
+    assert (repo_path / "two").read_text() == "2"
+    git.Repo(repo_path).git.checkout("--force", base)
+    with mock.patch("odoo_tools.utils.git.run", wraps=git_utils.run) as mock_run:
+        git_utils.apply_patches(repo_path, base, patches)
+    assert not _applied_patches(mock_run)
+    assert git.Repo(repo_path).head.commit.hexsha == head
+
+
+def test_apply_patches_from_first_change(patch_series):
+    repo_path, base, patches = patch_series
+    git_utils.apply_patches(repo_path, base, patches)
+    git.Repo(repo_path).git.checkout("--force", base)
+    patches[1].write_text(patches[1].read_text().replace("+2", "+3"))
+    with mock.patch("odoo_tools.utils.git.run", wraps=git_utils.run) as mock_run:
+        git_utils.apply_patches(repo_path, base, patches)
+    assert _applied_patches(mock_run) == [str(patches[1])]
+    assert (repo_path / "one").read_text() == "1"
+    assert (repo_path / "two").read_text() == "3"
+
+
+def test_apply_patches_keyed_by_base(patch_series):
+    repo_path, base, patches = patch_series
+    keys = git_utils.patch_series_keys(base, patches)
+    assert len(keys) == 2
+    assert git_utils.patch_series_keys(base, patches[:1]) == keys[:1]
+    assert git_utils.patch_series_keys("0" * 40, patches) != keys
+
+
+def test_apply_patches_on_moved_branch(patch_series):
+    repo_path, base, patches = patch_series
+    repo = git.Repo(repo_path)
+    repo.git.branch("stable", base)
+    repo.git.checkout("--force", "--detach", "stable")
+    git_utils.apply_patches(repo_path, "stable", patches)
+    # The branch moves: its series of the former commit is stale
+    repo.git.checkout("--force", "stable")
+    moved = _commit(repo, "other", "x", "other")
+    repo.git.checkout("--detach")
+    with mock.patch("odoo_tools.utils.git.run", wraps=git_utils.run) as mock_run:
+        git_utils.apply_patches(repo_path, "stable", patches)
+    assert _applied_patches(mock_run) == [str(p) for p in patches]
+    assert repo.head.commit.parents[0].parents[0].hexsha == moved
+    assert (repo_path / "other").read_text() == "x"
+
+
+def test_apply_patches_prunes_other_series(patch_series):
+    repo_path, base, patches = patch_series
+    git_utils.apply_patches(repo_path, base, patches)
+    repo = git.Repo(repo_path)
+    repo.git.checkout("--force", base)
+    patches[1].write_text(patches[1].read_text().replace("+2", "+3"))
+    git_utils.apply_patches(repo_path, base, patches)
+    refs = repo.git.for_each_ref(
+        "--format=%(refname)", git_utils.PATCHES_REF_PREFIX
+    ).splitlines()
+    keys = git_utils.patch_series_keys(base, patches)
+    assert sorted(refs) == sorted(git_utils.PATCHES_REF_PREFIX + key for key in keys)
+
+
+def test_apply_patches_keeps_series_of_worktrees(patch_series, tmp_path):
+    repo_path, base, patches = patch_series
+    repo = git.Repo(repo_path)
+    repo.git.worktree("add", "--detach", str(tmp_path / "other"), base)
+    git_utils.apply_patches(tmp_path / "other", base, patches)
+    kept = repo.git.for_each_ref(
+        "--format=%(refname)", git_utils.PATCHES_REF_PREFIX
+    ).splitlines()
+    git_utils.apply_patches(repo_path, base, patches[:1])
+    # The head of the other worktree stays cached, not its first patch
+    refs = repo.git.for_each_ref(
+        "--format=%(refname)", git_utils.PATCHES_REF_PREFIX
+    ).splitlines()
+    assert sorted(refs) == sorted(kept)
+
+
+def _commit(repo, file_name, content, message):
+    (Path(repo.working_dir) / file_name).write_text(content)
+    repo.index.add([file_name])
+    return repo.index.commit(message).hexsha
+
+
+def test_is_merged_into(tmp_path, monkeypatch):
+    monkeypatch.setenv("GIT_COMMITTER_NAME", "Test")
+    monkeypatch.setenv("GIT_COMMITTER_EMAIL", "test@test.com")
+    base = _make_repo_with_commit(tmp_path)
+    repo = git.Repo(tmp_path)
+    repo.git.branch("-M", "main")
+    # A PR of one commit, rebased on the base branch
+    repo.git.checkout("-b", "rebased", base)
+    rebased = _commit(repo, "one", "1", "one")
+    # A PR of two commits, merged with a merge commit
+    repo.git.checkout("-b", "merged", base)
+    _commit(repo, "two", "2", "two")
+    merged = _commit(repo, "three", "3", "three")
+    # A PR of two commits, squashed
+    repo.git.checkout("-b", "squashed", base)
+    _commit(repo, "four", "4", "four")
+    squashed = _commit(repo, "five", "5", "five")
+    repo.git.checkout("main")
+    _commit(repo, "other", "0", "other")
+    repo.git.cherry_pick(rebased)
+    repo.git.merge("--no-ff", "--no-edit", "merged")
+    repo.git.merge("--squash", "squashed")
+    repo.index.commit("squashed")
+    assert git_utils.is_merged_into(tmp_path, merged, "main") is True
+    assert git_utils.is_merged_into(tmp_path, rebased, "main") is True
+    # Only GitHub can tell about a squash of several commits
+    assert git_utils.is_merged_into(tmp_path, squashed, "main") is None
+    assert git_utils.is_merged_into(tmp_path, "missing", "main") is None
+
+
+def test_is_toplevel(tmp_path):
+    _make_repo_with_commit(tmp_path)
+    (tmp_path / "sub").mkdir()
+    assert git_utils.is_toplevel(tmp_path)
+    assert not git_utils.is_toplevel(tmp_path / "sub")
+
+
+def test_ls_remote(tmp_path):
+    upstream = make_upstream_repo(tmp_path / "upstream")
+    refs = git_utils.ls_remote(str(tmp_path / "upstream"), "14.0", "feature")
+    assert refs == {
+        "refs/heads/14.0": upstream.heads["14.0"].commit.hexsha,
+        "refs/heads/feature": upstream.heads["feature"].commit.hexsha,
+    }
+    assert git_utils.ls_remote(str(tmp_path / "missing"), "14.0") is None
+
+
+def test_merge_tree(tmp_path):
+    upstream = make_upstream_repo(tmp_path)
+    base = upstream.heads["14.0"].commit.hexsha
+    feature = upstream.heads["feature"].commit.hexsha
+    upstream.git.checkout("-b", "other", base)
+    other = _commit(upstream, "FEATURE", "other", "other feature")
+    upstream.git.checkout("14.0")
+    result = git_utils.merge_tree(tmp_path, base, feature)
+    assert result.conflicts == []
+    assert result.tree == upstream.heads["feature"].commit.tree.hexsha
+    merged = git_utils.commit_tree(tmp_path, result.tree, base, feature)
+    assert [p.hexsha for p in upstream.commit(merged).parents] == [base, feature]
+    assert git_utils.merge_tree(tmp_path, feature, other).conflicts == ["FEATURE"]
+    # Nothing moved
+    assert upstream.head.commit.hexsha == base
+    assert not upstream.is_dirty(untracked_files=True)
+    with pytest.raises(subprocess.CalledProcessError):
+        git_utils.merge_tree(tmp_path, base, "missing")
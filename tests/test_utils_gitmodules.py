@@ -0,0 +1,114 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from odoo_tools.utils import gitmodules
+
+from .common import get_fixture_path
+
+GITMODULES = r"""
+# A comment
+[submodule "odoo/external-src/edi"]
+	path = odoo/external-src/edi
+	URL = git@github.com:OCA/edi.git  ; trailing comment
+	branch = "16.0"
+[submodule "odoo/external-src/enterprise"] path = odoo/src/enterprise
+	url = git@github.com:odoo/enterprise\
+.git
+[submodule "odoo/external-src/camptocamp-edi"]
+	path = "odoo/external-src/c2c edi"
+	url = https://github.com/camptocamp/edi
+[core]
+	path = ignored
+"""
+
+
+def test_parse():
+    assert gitmodules.parse_gitmodules(GITMODULES) == [
+        gitmodules.Submodule(
+            "odoo/external-src/edi",
+            "git@github.com:OCA/edi.git",
+            "16.0",
+            "odoo/external-src/edi",
+        ),
+        gitmodules.Submodule(
+            "odoo/src/enterprise",
+            "git@github.com:odoo/enterprise.git",
+            None,
+            "odoo/external-src/enterprise",
+        ),
+        gitmodules.Submodule(
+            "odoo/external-src/c2c edi",
+            "https://github.com/camptocamp/edi",
+            None,
+            "odoo/external-src/camptocamp-edi",
+        ),
+    ]
+
+
+def test_parse_commented_out_submodules():
+    text = Path(get_fixture_path("fake-gitmodules")).read_text()
+    assert [sub.path for sub in gitmodules.parse_gitmodules(text)] == [
+        "odoo/external-src/account-closing",
+        "odoo/external-src/account-financial-reporting",
+    ]
+
+
+def test_parse_missing_url():
+    with pytest.raises(AssertionError, match="Missing `url`"):
+        gitmodules.parse_gitmodules('[submodule "foo"]\n\tpath = foo\n')
+
+
+def test_lookups():
+    table = gitmodules.GitmodulesTable(gitmodules.parse_gitmodules(GITMODULES))
+    edi = table.get("odoo/external-src/edi")
+    assert edi and edi.url == "git@github.com:OCA/edi.git"
+    assert table.get("odoo/external-src/edi/") is edi
+    assert table.get("odoo/external-src/nope") is None
+    assert table.by_url("git@github.com:OCA/edi") is edi
+    assert table.by_url("https://github.com/camptocamp/edi.git") == table.get(
+        "odoo/external-src/c2c edi"
+    )
+    assert [sub.url for sub in table.by_repo_name("edi")] == [
+        "git@github.com:OCA/edi.git",
+        "https://github.com/camptocamp/edi",
+    ]
+    assert [sub.path for sub in table.filter("odoo/external-src")] == [
+        "odoo/external-src/edi",
+        "odoo/external-src/c2c edi",
+    ]
+    assert len(table.filter()) == len(table) == 3
+
+
+def test_load_reparses_only_on_change(tmp_path):
+    path = tmp_path / ".gitmodules"
+    path.write_text(GITMODULES)
+    with mock.patch.object(
+        gitmodules, "parse_gitmodules", wraps=gitmodules.parse_gitmodules
+    ) as mock_parse:
+        table = gitmodules.load_gitmodules(path)
+        assert gitmodules.load_gitmodules(path) is table
+        assert mock_parse.call_count == 1
+        path.write_text(GITMODULES.replace('"16.0"', '"17.0"'))
+        # Make sure the change is seen, whatever the mtime resolution
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        table = gitmodules.load_gitmodules(path)
+        assert mock_parse.call_count == 2
+    assert table.submodules[0].branch == "17.0"
+
+
+def test_load_missing_file(tmp_path):
+    assert len(gitmodules.load_gitmodules(tmp_path / ".gitmodules")) == 0
+
+
+def test_submodule_cli_does_not_import_gitpython():
+    code = "import sys, odoo_tools.cli.submodule; sys.exit('git' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
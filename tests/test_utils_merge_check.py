@@ -0,0 +1,85 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+from pathlib import Path
+from textwrap import dedent
+
+import click
+import pytest
+
+from odoo_tools.cli import pending
+from odoo_tools.utils import merge_check
+from odoo_tools.utils.pending_merge import Repo
+
+from .common import make_upstream_repo
+
+
+def _write_merges(repo, upstream, *refs):
+    repo.abs_merges_path.parent.mkdir(parents=True, exist_ok=True)
+    merges = "".join(f"    - upstream {ref}\n" for ref in refs)
+    repo.abs_merges_path.write_text(
+        dedent(
+            f"""\
+            {repo.config_key}:
+              remotes:
+                upstream: {upstream.working_dir}
+              merges:
+            """
+        )
+        + merges
+        + "  target: upstream merge-branch\n"
+    )
+
+
+@pytest.fixture()
+def checked(project, tmp_path):
+    """An aggregated ``edi`` repo, with an ``other`` branch upstream adding the
+    same file as the ``feature`` branch."""
+    upstream = make_upstream_repo(tmp_path / "upstream")
+    upstream.git.checkout("-b", "other", "14.0")
+    (Path(upstream.working_dir) / "FEATURE").write_text("other")
+    upstream.index.add(["FEATURE"])
+    upstream.index.commit("other feature")
+    upstream.git.checkout("14.0")
+    repo = Repo("edi", path_check=False)
+    _write_merges(repo, upstream, "14.0", "feature")
+    repo.rebuild_consolidation_branch()
+    return repo, upstream
+
+
+def test_check_repo_clean(checked):
+    repo, __ = checked
+    head = repo.abs_path.joinpath(".git/HEAD").read_text()
+    check = merge_check.check_repo(repo)
+    assert check.ok
+    assert check.base_conflicts == check.pair_conflicts == []
+    # The checked out branch is left alone
+    assert repo.abs_path.joinpath(".git/HEAD").read_text() == head
+
+
+def test_check_repo_conflicts(checked):
+    repo, upstream = checked
+    _write_merges(repo, upstream, "14.0", "feature", "other", "missing")
+    check = merge_check.check_repo(repo)
+    assert not check.ok
+    assert check.missing == ["upstream missing"]
+    assert check.first_conflict == ("upstream other", ["FEATURE"])
+    assert check.base_conflicts == []
+    assert check.pair_conflicts == [("upstream feature", "upstream other", ["FEATURE"])]
+
+
+def test_check_repo_not_cloned(project):
+    repo = Repo("edi", path_check=False)
+    with pytest.raises(click.ClickException, match="not cloned"):
+        merge_check.check_repo(repo)
+
+
+def test_cli_check(project, checked):
+    result = project.invoke(pending.check, catch_exceptions=False)
+    assert result.exit_code == 0
+    repo, upstream = checked
+    _write_merges(repo, upstream, "14.0", "feature", "other")
+    result = project.invoke(pending.check)
+    assert result.exit_code == 1
+    assert "aggregation stops at upstream other: FEATURE" in result.output
+    assert "Pending merges don't aggregate for edi" in result.output
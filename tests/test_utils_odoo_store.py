@@ -0,0 +1,195 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import subprocess
+import threading
+from pathlib import Path
+from unittest import mock
+
+import git
+import pytest
+
+from odoo_tools.exceptions import Exit
+from odoo_tools.utils import git as git_utils
+from odoo_tools.utils import odoo_store
+
+
+def _make_upstream(path):
+    """Create an upstream repo at ``path`` with two commits, return their SHAs."""
+    repo = git.Repo.init(path)
+    with repo.config_writer() as cfg:
+        cfg.set_value("user", "email", "test@test.com")
+        cfg.set_value("user", "name", "Test")
+        cfg.set_value("commit", "gpgsign", "false")
+    shas = []
+    for content in ("hello", "world"):
+        (Path(path) / "README").write_text(content)
+        repo.index.add(["README"])
+        shas.append(repo.index.commit(f"say {content}").hexsha)
+    return shas
+
+
+@pytest.fixture()
+def upstream(tmp_path):
+    """An odoo/odoo mirror in the store, whose origin is a local repo."""
+    shas = _make_upstream(tmp_path / "upstream")
+    mirror = odoo_store.store_path() / "mirrors" / "odoo" / "odoo.git"
+    mirror.mkdir(parents=True)
+    subprocess.run(["git", "init", "--quiet", "--bare", str(mirror)], check=True)
+    subprocess.run(
+        [
+            "git",
+            "-C",
+            str(mirror),
+            "remote",
+            "add",
+            "origin",
+            str(tmp_path / "upstream"),
+        ],
+        check=True,
+    )
+    return shas
+
+
+def test_checkout_creates_then_reuses_worktree(upstream):
+    first, __ = upstream
+    worktree = odoo_store.checkout("odoo", "odoo", first)
+    assert worktree == odoo_store.store_path() / "worktrees/odoo/odoo" / first
+    assert (worktree / "README").read_text() == "hello"
+    with mock.patch("odoo_tools.utils.odoo_store.run") as mock_run:
+        assert odoo_store.checkout("odoo", "odoo", first) == worktree
+    mock_run.assert_not_called()
+
+
+def test_checkout_fetches_only_missing_commits(upstream):
+    first, second = upstream
+    odoo_store.checkout("odoo", "odoo", first)
+    with mock.patch(
+        "odoo_tools.utils.git._run_network", wraps=git_utils._run_network
+    ) as mock_fetch:
+        worktree = odoo_store.checkout("odoo", "odoo", second)
+    assert (worktree / "README").read_text() == "world"
+    mock_fetch.assert_called_once()
+    # Kept by a ref of its own, not only by FETCH_HEAD
+    mirror = git.Repo(odoo_store.store_path() / "mirrors" / "odoo" / "odoo.git")
+    assert mirror.git.rev_parse(f"{odoo_store.STORE_REF_PREFIX}{second}") == second
+    # the second commit brought the first one along
+    mock_fetch.reset_mock()
+    odoo_store.worktrees_index.invalidate()
+    odoo_store.checkout("odoo", "odoo", first)
+    mock_fetch.assert_not_called()
+
+
+def test_checkout_applies_patches_in_own_worktree(upstream, tmp_path, monkeypatch):
+    first, __ = upstream
+    monkeypatch.setenv("GIT_COMMITTER_NAME", "Test")
+    monkeypatch.setenv("GIT_COMMITTER_EMAIL", "test@test.com")
+    patch = subprocess.run(
+        ["git", "-C", str(tmp_path / "upstream"), "format-patch", "--stdout", "-1"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    patch_file = tmp_path / "0001-world.patch"
+    patch_file.write_text(patch)
+    plain = odoo_store.checkout("odoo", "odoo", first)
+    patched = odoo_store.checkout("odoo", "odoo", first, patches=[patch_file])
+    assert patched != plain
+    assert patched.name.startswith(f"{first}-")
+    assert (plain / "README").read_text() == "hello"
+    assert (patched / "README").read_text() == "world"
+
+
+def test_link_replaces_former_link(tmp_path):
+    dest = tmp_path / "src" / "odoo"
+    one, two = tmp_path / "one", tmp_path / "two"
+    one.mkdir()
+    two.mkdir()
+    odoo_store.link(dest, one)
+    odoo_store.link(dest, two)
+    assert dest.resolve() == two
+
+
+def test_link_refuses_own_checkout(tmp_path):
+    dest = tmp_path / "odoo"
+    dest.mkdir()
+    with pytest.raises(Exit):
+        odoo_store.link(dest, tmp_path)
+    assert dest.is_dir() and not dest.is_symlink()
+
+
+def test_evict_least_recently_used(upstream):
+    first, second = upstream
+    odoo_store.checkout("odoo", "odoo", first)
+    odoo_store.checkout("odoo", "odoo", second)
+    # use the first one again: the second one is now the least recently used
+    odoo_store.checkout("odoo", "odoo", first)
+    entry = odoo_store.worktrees_index.lookup(f"worktrees/odoo/odoo/{first}")
+    assert entry is not None
+    # As in a later run: none of them is about to be linked
+    odoo_store._checked_out.clear()
+    odoo_store.evict(budget=entry.value)
+    worktrees = odoo_store.store_path() / "worktrees" / "odoo" / "odoo"
+    assert (worktrees / first).is_dir()
+    assert not (worktrees / second).exists()
+    assert odoo_store.worktrees_index.keys() == [f"worktrees/odoo/odoo/{first}"]
+
+
+def test_evict_keeps_worktree_to_link(upstream, monkeypatch):
+    monkeypatch.setenv(odoo_store.BUDGET_ENV_VAR, "0")
+    first, second = upstream
+    odoo_store.checkout("odoo", "odoo", first)
+    # Checked out by another pipeline of the command, not linked yet
+    odoo_store.checkout("odoo", "odoo", second)
+    assert (odoo_store.store_path() / "worktrees/odoo/odoo" / first).is_dir()
+
+
+def test_evict_keeps_worktree_in_use(upstream):
+    first, __ = upstream
+    odoo_store.checkout("odoo", "odoo", first)
+    key = f"worktrees/odoo/odoo/{first}"
+    odoo_store.evict(budget=0, keep=key)
+    assert (odoo_store.store_path() / key).is_dir()
+
+
+def test_evict_keeps_linked_worktree(upstream, tmp_path):
+    first, __ = upstream
+    worktree = odoo_store.checkout("odoo", "odoo", first)
+    dest = tmp_path / "project" / "src" / "odoo"
+    odoo_store.link(dest, worktree)
+    odoo_store.evict(budget=0)
+    assert worktree.is_dir()
+    # Once the project links to another one, the worktree and its commit go
+    dest.unlink()
+    odoo_store.evict(budget=0)
+    assert not worktree.exists()
+    assert not odoo_store.links_index.keys()
+    mirror = git.Repo(odoo_store.store_path() / "mirrors" / "odoo" / "odoo.git")
+    assert not mirror.git.for_each_ref(odoo_store.STORE_REF_PREFIX)
+
+
+def test_evict_waits_for_the_store_lock(upstream):
+    first, __ = upstream
+    worktree = odoo_store.checkout("odoo", "odoo", first)
+    odoo_store._checked_out.clear()
+    done = threading.Event()
+
+    def evict():
+        odoo_store.evict(budget=0)
+        done.set()
+
+    with odoo_store._store_lock():
+        thread = threading.Thread(target=evict)
+        thread.start()
+        assert not done.wait(0.2)
+        assert worktree.is_dir()
+    thread.join()
+    assert done.is_set()
+    assert not worktree.exists()
+
+
+def test_get_budget(monkeypatch):
+    monkeypatch.setenv(odoo_store.BUDGET_ENV_VAR, "1.5")
+    assert odoo_store.get_budget() == 1.5 * 1024**3
+    monkeypatch.delenv(odoo_store.BUDGET_ENV_VAR)
+    assert odoo_store.get_budget() == odoo_store.DEFAULT_BUDGET_GIB * 1024**3
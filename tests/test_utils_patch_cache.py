@@ -0,0 +1,99 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+from textwrap import dedent
+
+import git
+import pytest
+import responses
+
+from odoo_tools.utils import patch_cache
+from odoo_tools.utils.pending_merge import Repo
+
+from .common import make_upstream_repo
+
+URL = "https://github.com/OCA/edi/pull/1.patch"
+CMD = f"curl -sSL {URL} | git am -3 --keep-non-patch --exclude '*requirements.txt'"
+SHA = "a" * 40
+
+
+def test_patch_urls():
+    assert patch_cache.patch_urls([CMD, "git tag -f aggregated"]) == [URL]
+
+
+@responses.activate
+def test_fetch_revalidates_with_etag():
+    responses.add(responses.GET, URL, body=b"patch", headers={"ETag": '"v1"'})
+    path = patch_cache.fetch(URL)
+    assert path.read_bytes() == b"patch"
+    responses.replace(responses.GET, URL, status=304)
+    assert patch_cache.fetch(URL) == path
+    assert responses.calls[-1].request.headers["If-None-Match"] == '"v1"'
+    assert path.read_bytes() == b"patch"
+
+
+@responses.activate
+def test_fetch_known_sha_downloads_once():
+    responses.add(responses.GET, URL, body=b"patch")
+    path = patch_cache.fetch(URL, SHA)
+    assert path.name == f"{SHA}.patch"
+    assert patch_cache.fetch(URL, SHA) == path
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_prefetch_leaves_out_failures():
+    missing = "https://github.com/OCA/edi/pull/2.patch"
+    responses.add(responses.GET, URL, body=b"patch")
+    responses.add(responses.GET, missing, status=404)
+    paths = patch_cache.prefetch({URL: None, missing: None})
+    assert list(paths) == [URL]
+    assert patch_cache.local_commands([CMD], paths) == [
+        f"cat {paths[URL]} | git am -3 --keep-non-patch --exclude '*requirements.txt'"
+    ]
+    # Left to download, as before
+    assert patch_cache.local_commands([CMD], {}) == [CMD]
+
+
+@responses.activate
+def test_rebuild_consolidation_branch_applies_cached_patch(
+    project, tmp_path, monkeypatch
+):
+    # git am commits
+    monkeypatch.setenv("GIT_COMMITTER_NAME", "Test")
+    monkeypatch.setenv("GIT_COMMITTER_EMAIL", "test@test.com")
+    upstream = make_upstream_repo(tmp_path / "upstream")
+    patch = upstream.git.format_patch("--stdout", "14.0..feature")
+    responses.add(responses.GET, URL, body=patch, headers={"ETag": '"v1"'})
+    repo = Repo("edi", path_check=False)
+    repo.abs_merges_path.parent.mkdir(parents=True, exist_ok=True)
+    repo.abs_merges_path.write_text(
+        dedent(
+            f"""\
+            {repo.config_key}:
+              remotes:
+                upstream: {upstream.working_dir}
+              merges:
+                - upstream 14.0
+              target: upstream merge-branch
+              shell_command_after:
+                - {CMD}
+            """
+        )
+    )
+    # The head of the PR can't be resolved here: revalidated with the ETag
+    repo.rebuild_consolidation_branch(reuse=False)
+    aggregated = git.Repo(repo.abs_path)
+    assert aggregated.head.commit.message.strip() == "add feature"
+    assert (repo.abs_path / "FEATURE").read_text() == "feature"
+    responses.replace(responses.GET, URL, status=304)
+    repo.rebuild_consolidation_branch(reuse=False)
+    assert aggregated.head.commit.message.strip() == "add feature"
+    assert len(responses.calls) == 2
+
+
+@pytest.mark.project_setup(manifest=dict(odoo_version="16.0"))
+def test_with_local_patches_without_patch(project):
+    repo = Repo("edi", path_check=False)
+    config = {"merges": ["OCA 16.0"], "shell_command_after": ["git tag -f x"]}
+    assert repo._with_local_patches(config, None) is config
@@ -1,23 +1,32 @@
 # Copyright 2023 Camptocamp SA
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
 
+import subprocess
+from datetime import timedelta
 from pathlib import Path
 from textwrap import dedent
 from unittest import mock
 
+import click
+import git as git_module
 import pytest
 import requests
 import responses
 from git.config import GitConfigParser
+from rich.console import Console
 
 from odoo_tools.cli import pending
 from odoo_tools.exceptions import Exit, PathNotFound
+from odoo_tools.utils import aggregator, ui
 from odoo_tools.utils import pending_merge as pm_utils
+from odoo_tools.utils import yaml as yaml_utils
+from odoo_tools.utils.cache import CacheEntry
 from odoo_tools.utils.config import config
 
 from .common import (
     MockSubprocessRun,
     assert_no_chdir,
+    make_upstream_repo,
     mock_pending_merge_repo_paths,
 )
 
@@ -898,7 +907,8 @@ def test_cli_add_multiple_urls_aggregates_once_per_submodule(project):
     assert push_to_remote.call_count == 2
 
 
-def test_repo_run_aggregate_runs_gitaggregate_cli(project):
+def test_repo_run_aggregate_runs_gitaggregate_cli(project, monkeypatch):
+    monkeypatch.setenv(aggregator.IN_PROCESS_ENV_VAR, "0")
     mock_pending_merge_repo_paths("edi")
     repo = Repo("edi", path_check=False)
     with mock.patch.object(pm_utils, "run") as run:
@@ -980,9 +990,10 @@ def test_repo_push_to_remote(project):
     )
 
 
-def test_repo_aggregate_and_push_do_not_chdir(project):
+def test_repo_aggregate_and_push_do_not_chdir(project, monkeypatch):
     """Aggregating and pushing must not change the process working directory:
     they run concurrently, and chdir would corrupt the other threads' paths."""
+    monkeypatch.setenv(aggregator.IN_PROCESS_ENV_VAR, "0")
     mock_pending_merge_repo_paths("edi")
     repo = Repo("edi", path_check=False)
     subprocess_run = MockSubprocessRun(
@@ -1400,3 +1411,672 @@ def test_enrich_with_github_uses_token(project, monkeypatch):
         pending.enrich_with_github()
         sent = list(rsps.calls)
         assert sent[0].request.headers.get("Authorization") == "token secret-token"
+
+
+def test_enrich_pull_requests_graphql_then_rest(project, monkeypatch):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    merged, unknown = _make_pending(repo, 773), _make_pending(repo, 9999)
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    with responses.RequestsMock() as rsps:
+        rsps.add(
+            responses.POST,
+            "https://api.github.com/graphql",
+            json={
+                "data": {
+                    "p0": {
+                        "pullRequest": {
+                            "state": "MERGED",
+                            "merged": True,
+                            "number": 773,
+                            "title": "A merged PR",
+                            "updatedAt": "2025-01-02T00:00:00Z",
+                            "labels": {"nodes": [{"name": "bug"}]},
+                        }
+                    },
+                    "p1": {"pullRequest": None},
+                },
+                "errors": [{"type": "NOT_FOUND", "path": ["p1", "pullRequest"]}],
+            },
+        )
+        # The PR the query didn't find is looked up with the REST API
+        rsps.add(
+            responses.GET,
+            "https://api.github.com/repos/OCA/edi/pulls/9999",
+            status=404,
+        )
+        results = list(pm_utils.enrich_pull_requests([merged, unknown]))
+    assert [(pr, error is None) for pr, error in results] == [
+        (merged, True),
+        (unknown, False),
+    ]
+    assert isinstance(results[1][1], requests.HTTPError)
+    assert merged.to_dict() | {"_repo": None} == {
+        "_repo": None,
+        "repo": "edi",
+        "owner": "OCA",
+        "pr": 773,
+        "is_patch": False,
+        "state": "closed",
+        "merged": True,
+        "labels": ["bug"],
+        "number": 773,
+        "title": "A merged PR",
+        "updated_at": "2025-01-02T00:00:00Z",
+        "shortcut": "OCA/edi#773",
+        "url": "https://github.com/OCA/edi/pull/773",
+    }
+    assert not unknown.is_enriched
+
+
+def test_enrich_pull_requests_batches(project, monkeypatch):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    prs = [_make_pending(repo, number) for number in range(1, 4)]
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    monkeypatch.setattr(pm_utils.gh, "GRAPHQL_PR_BATCH_SIZE", 2)
+    with mock.patch.object(
+        pm_utils.gh,
+        "pull_requests_info",
+        side_effect=lambda keys: {
+            key: {"state": "open", "number": key[2]} for key in keys
+        },
+    ) as mock_info:
+        results = list(pm_utils.enrich_pull_requests(prs))
+    assert mock_info.call_args_list == [
+        mock.call([("OCA", "edi", 1), ("OCA", "edi", 2)]),
+        mock.call([("OCA", "edi", 3)]),
+    ]
+    assert sorted(pr.pr for pr, __ in results) == [1, 2, 3]
+    assert all(pr.state == "open" for pr in prs)
+
+
+def test_enrich_pull_requests_without_token(project, monkeypatch):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    pending = _make_pending(repo, 773)
+    monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+    with responses.RequestsMock() as rsps:
+        rsps.add(
+            responses.GET,
+            "https://api.github.com/repos/OCA/edi/pulls/773",
+            json={"state": "open", "merged": False, "number": 773},
+        )
+        assert list(pm_utils.enrich_pull_requests([pending])) == [(pending, None)]
+    assert pending.state == "open"
+
+
+def _rest_pull(rsps, number, state, merged=False):
+    rsps.add(
+        responses.GET,
+        f"https://api.github.com/repos/OCA/edi/pulls/{number}",
+        json={"state": state, "merged": merged, "number": number, "title": "T"},
+    )
+
+
+def test_enrich_pull_requests_remembers_merged_prs(project):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    with responses.RequestsMock() as rsps:
+        _rest_pull(rsps, 773, "closed", merged=True)
+        _rest_pull(rsps, 774, "open")
+        list(
+            pm_utils.enrich_pull_requests([_make_pending(repo, n) for n in (773, 774)])
+        )
+    # Only the open PR is asked again
+    merged, opened = _make_pending(repo, 773), _make_pending(repo, 774)
+    with responses.RequestsMock() as rsps:
+        _rest_pull(rsps, 774, "open")
+        list(pm_utils.enrich_pull_requests([merged, opened]))
+        assert len(rsps.calls) == 1
+    assert merged.merged and merged.state == "closed" and merged.title == "T"
+    assert opened.state == "open"
+
+
+def test_enrich_pull_requests_refresh(project):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    pm_utils.pr_state_cache.set("OCA/edi#773", {"state": "closed", "merged": True})
+    pending = _make_pending(repo, 773)
+    with responses.RequestsMock() as rsps:
+        _rest_pull(rsps, 773, "closed", merged=True)
+        list(pm_utils.enrich_pull_requests([pending], refresh=True))
+        assert len(rsps.calls) == 1
+    assert pending.title == "T"
+
+
+@pytest.mark.parametrize(
+    ("state", "age", "env", "cached"),
+    [
+        ("closed", timedelta(hours=1), {}, True),
+        ("closed", timedelta(days=2), {}, False),
+        ("closed", timedelta(hours=1), {"OTOOLS_CLOSED_PR_TTL": "30"}, False),
+        ("open", timedelta(minutes=1), {}, False),
+        ("open", timedelta(minutes=1), {"OTOOLS_OPEN_PR_TTL": "5"}, True),
+    ],
+)
+def test_enrich_pull_requests_ttl(project, monkeypatch, state, age, env, cached):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    pm_utils.pr_state_cache.set("OCA/edi#773", {"state": state, "merged": False})
+    entry = pm_utils.pr_state_cache.lookup("OCA/edi#773")
+    assert entry is not None
+    stale = CacheEntry(entry.value, entry.stored_at - age)
+    with mock.patch.object(pm_utils.pr_state_cache, "lookup", return_value=stale):
+        assert (
+            pm_utils._cached_github_data(_make_pending(repo, 773)) is not None
+        ) == cached
+
+
+def test_merged_prs_from_history(project):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    merged, other = _make_pending(repo, 773), _make_pending(repo, 774)
+    fork = pm_utils.PendingPR(_repo=repo, owner="someone", pr=1, is_patch=True)
+    with (
+        mock.patch.object(pm_utils.git, "is_toplevel", return_value=True),
+        mock.patch.object(pm_utils.git, "fetch_targeted") as mock_fetch,
+        mock.patch.object(
+            pm_utils.git,
+            "is_merged_into",
+            side_effect=lambda path, head, base: head.endswith("/773") or None,
+        ) as mock_merged,
+    ):
+        assert repo.merged_prs_from_history([merged, other, fork]) == [merged]
+    # One fetch per remote, with the base branch
+    assert mock_fetch.call_args_list == [
+        mock.call(
+            repo.abs_path,
+            "git@github.com:OCA/edi.git",
+            "+refs/heads/14.0:refs/remotes/OCA/14.0",
+            "+refs/pull/773/head:refs/otools/pull/OCA/edi/773",
+            "+refs/pull/774/head:refs/otools/pull/OCA/edi/774",
+        ),
+        mock.call(
+            repo.abs_path,
+            "git@github.com:someone/edi.git",
+            "+refs/pull/1/head:refs/otools/pull/someone/edi/1",
+        ),
+    ]
+    assert mock_merged.call_args_list[0] == mock.call(
+        repo.abs_path, "refs/otools/pull/OCA/edi/773", "refs/remotes/OCA/14.0"
+    )
+
+
+def test_merged_prs_from_history_not_cloned(project):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    with mock.patch.object(pm_utils.git, "fetch_targeted") as mock_fetch:
+        assert repo.merged_prs_from_history([_make_pending(repo, 773)]) == []
+    mock_fetch.assert_not_called()
+
+
+def test_enrich_pull_requests_from_history(project, monkeypatch):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    merged, still_open = _make_pending(repo, 773), _make_pending(repo, 774)
+    monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+    with (
+        mock.patch.object(
+            Repo, "merged_prs_from_history", return_value=[merged]
+        ) as mock_history,
+        responses.RequestsMock() as rsps,
+    ):
+        # Only the PR the history can't tell about is looked up
+        rsps.add(
+            responses.GET,
+            "https://api.github.com/repos/OCA/edi/pulls/774",
+            json={"state": "open", "merged": False, "number": 774},
+        )
+        results = list(
+            pm_utils.enrich_pull_requests([merged, still_open], from_history=True)
+        )
+    mock_history.assert_called_once_with([merged, still_open])
+    assert results == [(merged, None), (still_open, None)]
+    assert merged.merged and merged.state == "closed"
+    assert still_open.state == "open"
+    # A merged PR stays merged: the history is not checked again for it
+    entry = pm_utils.pr_state_cache.lookup(merged.shortcut)
+    assert entry is not None and entry.value["merged"]
+    merged_again = _make_pending(repo, 773)
+    with mock.patch.object(Repo, "merged_prs_from_history") as mock_history:
+        results = list(pm_utils.enrich_pull_requests([merged_again], from_history=True))
+    mock_history.assert_not_called()
+    assert results == [(merged_again, None)]
+    assert merged_again.merged
+
+
+def test_enrich_pull_requests_threads_capped_by_pool(project, monkeypatch):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    prs = [_make_pending(repo, number) for number in range(1, 4)]
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    pm_utils.gh_api.configure(pool_size=2)
+    with (
+        mock.patch.object(
+            pm_utils.gh,
+            "pull_requests_info",
+            side_effect=lambda keys: {key: {"state": "open"} for key in keys},
+        ),
+        mock.patch.object(
+            pm_utils, "ThreadPoolExecutor", wraps=pm_utils.ThreadPoolExecutor
+        ) as mock_pool,
+    ):
+        list(pm_utils.enrich_pull_requests(prs, max_workers=50))
+    mock_pool.assert_called_once_with(max_workers=2)
+
+
+def test_purge_merged_prs_parses_file_once(project):
+    name = "edi"
+    mock_pending_merge_repo_paths(name)
+    repo = Repo(name)
+    pr_states = {774: ("closed", True), 773: ("closed", True)}
+    with (
+        mock.patch.object(
+            pm_utils.PendingPR,
+            "enrich_with_github",
+            autospec=True,
+            side_effect=_fake_enrich(pr_states),
+        ),
+        mock.patch(
+            "odoo_tools.utils.yaml.yaml_load", wraps=yaml_utils.yaml_load
+        ) as mock_load,
+    ):
+        purged = list(repo.purge_merged_prs())
+    assert sorted(pr.pr for pr in purged) == [773, 774]
+    mock_load.assert_called_once()
+    remaining = repo.merges_config()["merges"]
+    assert "OCA refs/pull/773/head" not in remaining
+    assert "OCA refs/pull/774/head" not in remaining
+
+
+def test_repo_transaction_writes_once(project):
+    mock_pending_merge_repo_paths("edi")
+    repo = Repo("edi", path_check=False)
+    with mock.patch.object(
+        pm_utils, "dump_document", wraps=pm_utils.dump_document
+    ) as dump:
+        with repo.transaction() as transaction:
+            transaction.remove("merges", "OCA refs/pull/773/head")
+            transaction.remove("merges", "OCA refs/pull/774/head")
+            transaction.append("merges", "OCA refs/pull/1000/head", ["new PR"])
+            merges = transaction.lines("merges")
+            assert "OCA refs/pull/773/head" not in merges
+            assert merges[-1] == "OCA refs/pull/1000/head"
+            # Nothing written yet
+            assert not dump.called
+    dump.assert_called_once()
+    yaml_utils.clear_documents()
+    merges = repo.merges_config()["merges"]
+    assert "OCA refs/pull/773/head" not in merges
+    assert "OCA refs/pull/774/head" not in merges
+    assert merges[-1] == "OCA refs/pull/1000/head"
+    assert "# new PR" in repo.abs_merges_path.read_text()
+
+
+def test_repo_transaction_rolls_back_on_error(project):
+    mock_pending_merge_repo_paths("edi")
+    repo = Repo("edi", path_check=False)
+    content = repo.abs_merges_path.read_text()
+    with pytest.raises(RuntimeError), repo.transaction() as transaction:
+        transaction.remove("merges", "OCA refs/pull/773/head")
+        raise RuntimeError("boom")
+    assert repo.abs_merges_path.read_text() == content
+    # The edited document is not served from the cache either
+    assert "OCA refs/pull/773/head" in repo.merges_config()["merges"]
+
+
+def test_repo_transaction_without_config_key(project):
+    mock_pending_merge_repo_paths("edi")
+    repo = Repo("edi", path_check=False)
+    content = repo.abs_merges_path.read_text()
+    other = Repo("sale-workflow", path_check=False)
+    other.abs_merges_path.write_text(content)
+    # Nothing to remove from a repo without config
+    with other.transaction() as transaction:
+        transaction.remove("merges", "OCA refs/pull/773/head")
+    assert other.abs_merges_path.read_text() == content
+    with other.transaction() as transaction:
+        transaction.append("shell_command_after", "git tag -f x")
+    yaml_utils.clear_documents()
+    assert other.merges_config()["shell_command_after"] == ["git tag -f x"]
+
+
+@pytest.mark.project_setup(manifest=dict(odoo_version="16.0"))
+def test_new_merges_file_set_url_on_commit(project):
+    mock_pending_merge_repo_paths("edi", pending=False)
+    repo = Repo("edi", path_check=False)
+    with mock.patch.object(pm_utils.git, "submodule_set_url") as set_url:
+        with pytest.raises(RuntimeError), repo.transaction():
+            repo.generate_pending_merges_file_template("OCA")
+            raise RuntimeError("boom")
+        # The submodule keeps its remote along with the missing merges file
+        assert not repo.abs_merges_path.exists()
+        set_url.assert_not_called()
+        with repo.transaction():
+            repo.generate_pending_merges_file_template("OCA")
+            set_url.assert_not_called()
+    set_url.assert_called_once_with(repo.path, "git@github.com:camptocamp/edi.git")
+
+
+@pytest.mark.project_setup(proj_tmpl_ver=2)
+def test_pending_commit_in_transaction(project):
+    mock_pending_merge_repo_paths("edi")
+    repo = Repo("edi", path_check=False)
+    sha = "a86f5fe73e1f34f29cb2ad0dca253e47ce625406"
+    with mock.patch.object(
+        pm_utils, "dump_document", wraps=pm_utils.dump_document
+    ) as dump:
+        with repo.transaction():
+            repo.add_pending_commit("OCA", sha)
+            repo.remove_pending_pull("OCA", 773)
+            assert not dump.called
+    dump.assert_called_once()
+    with pytest.raises(RuntimeError), repo.transaction():
+        repo.remove_pending_commit("OCA", sha)
+        raise RuntimeError("boom")
+    # The cached document is left as written
+    assert f"git cherry-pick {sha}" in repo.merges_config()["shell_command_after"]
+
+
+def test_cli_add_multiple_urls_writes_once_per_file(project):
+    mock_pending_merge_repo_paths("edi")
+    with responses.RequestsMock() as rsps:
+        for pull_id in (1470, 1471):
+            rsps.add(
+                responses.GET,
+                f"https://api.github.com/repos/OCA/edi/pulls/{pull_id}",
+                json={"base": {"ref": "14.0"}},
+                status=200,
+            )
+        with mock.patch.object(
+            pm_utils, "dump_document", wraps=pm_utils.dump_document
+        ) as dump:
+            result = project.invoke(
+                pending.add_pending,
+                [
+                    "https://github.com/OCA/edi/pull/1470",
+                    "https://github.com/OCA/edi/pull/1471",
+                    "--no-aggregate",
+                ],
+                catch_exceptions=False,
+            )
+    assert result.exit_code == 0
+    dump.assert_called_once()
+    merges = Repo("edi", path_check=False).merges_config()["merges"]
+    assert "OCA refs/pull/1470/head" in merges
+    assert "OCA refs/pull/1471/head" in merges
+
+
+def test_aggregate_repos_failure_does_not_stop_others(project):
+    mock_pending_merge_repo_paths("edi")
+    mock_pending_merge_repo_paths("web")
+    edi = Repo("edi", path_check=False)
+    web = Repo("web", path_check=False)
+
+    def run_aggregate(repo, **kwargs):
+        ui.echo(f"Aggregating {repo.name}")
+        if repo.name == "edi":
+            raise subprocess.CalledProcessError(
+                1, "gitaggregate", stderr=b"fatal: could not merge\n"
+            )
+
+    with (
+        mock.patch.object(
+            pm_utils.Repo, "run_aggregate", autospec=True, side_effect=run_aggregate
+        ),
+        mock.patch.object(pm_utils.Repo, "push_to_remote") as push_to_remote,
+        mock.patch.object(
+            pm_utils.gh, "get_target_branch", return_value="merge-branch"
+        ) as get_target_branch,
+    ):
+        results = {
+            repo: (rebuilt, error, output)
+            for repo, rebuilt, error, output in pm_utils.aggregate_repos(
+                [edi, web], max_workers=2
+            )
+        }
+    assert isinstance(results[edi][1], subprocess.CalledProcessError)
+    assert results[web] == (True, None, [("Aggregating web", (), {})])
+    assert results[edi][2] == [("Aggregating edi", (), {})]
+    # Resolved once, before any thread starts
+    get_target_branch.assert_called_once_with()
+    push_to_remote.assert_called_once_with(target_branch="merge-branch", verbose=False)
+
+
+def test_cli_aggregate_reports_failed_repos(project):
+    mock_pending_merge_repo_paths("edi")
+    mock_pending_merge_repo_paths("web")
+
+    def run_aggregate(repo, **kwargs):
+        ui.echo(f"Merging into {repo.name}")
+        if repo.name == "edi":
+            raise subprocess.CalledProcessError(
+                1, "gitaggregate", stderr=b"fatal: could not merge\n"
+            )
+
+    with (
+        mock.patch.object(
+            pm_utils.Repo, "run_aggregate", autospec=True, side_effect=run_aggregate
+        ),
+        mock.patch.object(pm_utils.Repo, "push_to_remote") as push_to_remote,
+    ):
+        result = project.invoke(
+            pending.aggregate,
+            ["edi", "web", "--jobs", "2", "--target-branch", "merge-branch"],
+        )
+    assert result.exit_code == 1
+    assert "fatal: could not merge" in result.output
+    assert "Aggregation failed for edi" in result.output
+    # Replayed after the grid, under each repo
+    assert "odoo/external-src/edi\nMerging into edi\n" in result.output
+    assert "odoo/external-src/web\nMerging into web\n" in result.output
+    # web is pushed all the same
+    push_to_remote.assert_called_once_with(target_branch="merge-branch", verbose=False)
+
+
+def test_repo_run_aggregate_in_process(project):
+    mock_pending_merge_repo_paths("edi")
+    repo = Repo("edi", path_check=False)
+    with (
+        mock.patch.object(pm_utils, "run") as run,
+        mock.patch.object(
+            aggregator, "aggregate", return_value={"fetch": 1.0}
+        ) as aggregate,
+    ):
+        assert repo.run_aggregate() == {"fetch": 1.0}
+    run.assert_not_called()
+    path, config = aggregate.call_args.args
+    assert path.resolve() == repo.abs_path.resolve()
+    assert config == repo.merges_config()
+
+
+def _aggregated_repo(tmp_path):
+    """Return the repo of an ``edi`` submodule aggregating the ``14.0`` and
+    ``feature`` branches of a local upstream, with the upstream."""
+    upstream = make_upstream_repo(tmp_path / "upstream")
+    repo = Repo("edi", path_check=False)
+    repo.abs_merges_path.parent.mkdir(parents=True, exist_ok=True)
+    repo.abs_merges_path.write_text(
+        dedent(
+            f"""\
+            {repo.config_key}:
+              remotes:
+                upstream: {upstream.working_dir}
+              merges:
+                - upstream 14.0
+                - upstream feature
+              target: upstream merge-branch
+            """
+        )
+    )
+    return repo, upstream
+
+
+def test_rebuild_consolidation_branch_reuses_unchanged_aggregation(project, tmp_path):
+    repo, upstream = _aggregated_repo(tmp_path)
+    assert repo.rebuild_consolidation_branch()
+    with (
+        mock.patch.object(pm_utils.Repo, "run_aggregate") as run_aggregate,
+        mock.patch.object(pm_utils.Repo, "push_to_remote") as push_to_remote,
+    ):
+        assert not repo.rebuild_consolidation_branch()
+        run_aggregate.assert_not_called()
+        # Never pushed: pushed, without aggregating again
+        assert not repo.rebuild_consolidation_branch(push=True, target_branch="b1")
+        run_aggregate.assert_not_called()
+        push_to_remote.assert_called_once()
+    head = upstream.heads["feature"].commit
+    assert git_module.Repo(repo.abs_path).head.commit == head
+
+
+def test_rebuild_consolidation_branch_pushes_reused_to_new_branch(project, tmp_path):
+    repo, __ = _aggregated_repo(tmp_path)
+    with mock.patch.object(pm_utils.Repo, "push_to_remote") as push_to_remote:
+        assert repo.rebuild_consolidation_branch(push=True, target_branch="b1")
+        with mock.patch.object(pm_utils.Repo, "run_aggregate") as run_aggregate:
+            # Already there
+            assert not repo.rebuild_consolidation_branch(push=True, target_branch="b1")
+            # A new commit of the project, a new branch for the same inputs
+            assert not repo.rebuild_consolidation_branch(push=True, target_branch="b2")
+        run_aggregate.assert_not_called()
+    assert [call.kwargs["target_branch"] for call in push_to_remote.call_args_list] == [
+        "b1",
+        "b2",
+    ]
+    entry = pm_utils.aggregation_cache.lookup(str(repo.abs_path))
+    assert entry is not None
+    assert entry.value["pushed"] == "b2"
+
+
+def test_rebuild_consolidation_branch_after_input_moved(project, tmp_path):
+    repo, upstream = _aggregated_repo(tmp_path)
+    fingerprint = repo.aggregation_fingerprint()
+    assert fingerprint is not None
+    assert repo.rebuild_consolidation_branch()
+    new_head = _move_feature(upstream)
+    assert repo.aggregation_fingerprint() != fingerprint
+    assert repo.rebuild_consolidation_branch()
+    local = git_module.Repo(repo.abs_path)
+    assert local.head.commit.hexsha == new_head.hexsha
+    assert local.active_branch.name == "merge-branch"
+
+
+def test_aggregation_fingerprint_unresolved_ref(project, tmp_path):
+    repo, __ = _aggregated_repo(tmp_path)
+    config = repo.merges_config()
+    config["merges"].append("upstream missing")
+    repo.update_merges_config(config)
+    assert repo.aggregation_fingerprint() is None
+
+
+def test_resolve_refs_hex_branch_name():
+    sha = "a" * 40
+    listed = {"refs/heads/cafe123": "b" * 40}
+    with mock.patch.object(pm_utils.git, "ls_remote", return_value=listed) as ls:
+        refs = pm_utils._resolve_refs([("url", "cafe123"), ("url", sha)])
+    # Only the full SHA is taken as it is
+    ls.assert_called_once_with("url", "cafe123")
+    assert [ref["sha"] for ref in refs or []] == ["b" * 40, sha]
+
+
+def _move_feature(upstream):
+    """Add a commit to the ``feature`` branch of ``upstream``, return it."""
+    upstream.heads["feature"].checkout()
+    (Path(upstream.working_dir) / "FEATURE").write_text("more feature")
+    upstream.index.add(["FEATURE"])
+    commit = upstream.index.commit("improve feature")
+    upstream.heads["14.0"].checkout()
+    return commit
+
+
+@pytest.mark.project_setup(proj_cfg={"pending_merge_lock": "1"})
+def test_rebuild_consolidation_branch_writes_lock(project, tmp_path):
+    repo, upstream = _aggregated_repo(tmp_path)
+    assert repo.rebuild_consolidation_branch(reuse=False)
+    assert repo.read_lock() == [
+        {
+            "url": upstream.working_dir,
+            "ref": "14.0",
+            "sha": upstream.heads["14.0"].commit.hexsha,
+        },
+        {
+            "url": upstream.working_dir,
+            "ref": "feature",
+            "sha": upstream.heads["feature"].commit.hexsha,
+        },
+    ]
+    assert repo.abs_lock_path.read_text().startswith("# Written by otools-pending")
+
+
+@pytest.mark.project_setup(proj_cfg={"pending_merge_lock": "1"})
+def test_cli_outdated(project, tmp_path):
+    repo, upstream = _aggregated_repo(tmp_path)
+    repo.rebuild_consolidation_branch()
+    locked = upstream.heads["feature"].commit.hexsha
+    result = project.invoke(pending.outdated, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "All lock files are up to date" in result.output
+    moved = _move_feature(upstream)
+    with (
+        mock.patch.object(pm_utils.git, "fetch_targeted") as fetch,
+        # Wide enough for the whole path of the remote
+        mock.patch.object(pending, "console", Console(width=200)),
+    ):
+        result = project.invoke(pending.outdated, catch_exceptions=False)
+    fetch.assert_not_called()
+    assert result.exit_code == 0
+    assert f"edi feature {upstream.working_dir} {locked[:8]} → {moved.hexsha[:8]}" in (
+        result.output
+    )
+
+
+@pytest.mark.project_setup(proj_cfg={"pending_merge_lock": "1"})
+def test_cli_outdated_unresolved(project, tmp_path):
+    repo, __ = _aggregated_repo(tmp_path)
+    repo.rebuild_consolidation_branch()
+    config = repo.merges_config()
+    config["merges"].append("unknown 14.0")
+    repo.update_merges_config(config)
+    with pytest.raises(click.ClickException, match="can't be resolved"):
+        repo.lock_changes()
+    with mock.patch.object(pending, "console", Console(width=200)):
+        result = project.invoke(pending.outdated, catch_exceptions=False)
+    assert result.exit_code == 0
+    assert "edi unresolved" in result.output
+    # Not reported as removed
+    assert "gone" not in result.output
+
+
+@pytest.mark.project_setup(proj_cfg={"pending_merge_lock": "1"})
+def test_cli_aggregate_locked(project, tmp_path):
+    repo, upstream = _aggregated_repo(tmp_path)
+    repo.rebuild_consolidation_branch()
+    locked = upstream.heads["feature"].commit.hexsha
+    _move_feature(upstream)
+    result = project.invoke(
+        pending.aggregate, ["edi", "--locked", "--no-push"], catch_exceptions=False
+    )
+    assert result.exit_code == 0
+    assert git_module.Repo(repo.abs_path).head.commit.hexsha == locked
+    # The lock file is left as it was
+    assert repo.read_lock()[1]["sha"] == locked
+
+
+def test_cli_aggregate_locked_without_lock(project, tmp_path):
+    _aggregated_repo(tmp_path)
+    result = project.invoke(pending.aggregate, ["edi", "--locked", "--no-push"])
+    assert result.exit_code == 1
+    assert "edi has no lock file" in result.output
@@ -0,0 +1,58 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import io
+
+from rich.console import Console
+
+from odoo_tools.utils.progress import ProgressGrid
+
+
+def _console(height=25):
+    return Console(file=io.StringIO(), width=80, height=height, color_system=None)
+
+
+def _grid(console, rows):
+    grid = ProgressGrid([{"no_wrap": True}, {}], console=console)
+    for i in range(rows):
+        grid.set_row(i, ["-", f"row {i}"], status="pending")
+    return grid
+
+
+def _render(console, renderable):
+    with console.capture() as capture:
+        console.print(renderable)
+    return [line.rstrip() for line in capture.get().splitlines()]
+
+
+def test_progress_grid_updates_row_in_place():
+    console = _console()
+    grid = _grid(console, 3)
+    grid.set_row(1, ["●", "row 1 done"], status="done")
+    grid.remove_row(2)
+    assert _render(console, grid.render()) == ["- row 0", "● row 1 done"]
+
+
+def test_progress_grid_summary_when_taller_than_terminal():
+    console = _console(height=6)
+    grid = _grid(console, 10)
+    grid.set_row(4, ["●", "row 4 done"], status="done")
+    grid.set_row(2, ["?", "row 2 failed"], status="failed")
+    lines = _render(console, grid.render())
+    # The summary, then the rows updated last that fit
+    assert lines == [
+        "8 pending, 1 failed, 1 done",
+        "- row 9",
+        "● row 4 done",
+        "? row 2 failed",
+    ]
+
+
+def test_progress_grid_prints_every_row_when_done():
+    console = _console(height=6)
+    grid = _grid(console, 10)
+    with grid:
+        grid.set_row(4, ["●", "row 4 done"], status="done")
+    output = console.file.getvalue()
+    assert "pending," not in output
+    assert all(f"row {i}" in output for i in range(10))
@@ -0,0 +1,159 @@
+# Copyright 2026 Camptocamp SA
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html)
+
+import shlex
+from unittest import mock
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from odoo_tools.utils import os_exec, ssh
+from odoo_tools.utils.click import global_command_decorators
+
+
+@pytest.fixture(autouse=True)
+def ssh_multiplexing(monkeypatch, tmp_path):
+    """Re-enable the SSH connection sharing for this module.
+
+    ``tests/conftest.py`` turns it off globally; it is turned back on here,
+    with the control sockets in a temp directory and a known ``ssh``.
+    """
+    monkeypatch.delenv("OTOOLS_SSH_MULTIPLEXING", raising=False)
+    monkeypatch.delenv("OTOOLS_SSH_PERSIST", raising=False)
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.delenv("GIT_SSH", raising=False)
+    ssh._has_ssh.cache_clear()
+    with (
+        mock.patch.object(ssh.misc, "get_cache_path", return_value=tmp_path),
+        mock.patch.object(ssh.shutil, "which", return_value="/usr/bin/ssh"),
+    ):
+        yield
+    ssh._network_commands = 0
+    ssh._git_ssh_command.cache_clear()
+    ssh._has_ssh.cache_clear()
+
+
+def test_git_ssh_command(tmp_path):
+    command = shlex.split(ssh.git_ssh_command() or "")
+    assert command == [
+        "ssh",
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        f"ControlPath={tmp_path}/ssh/%C",
+        "-o",
+        "ControlPersist=60s",
+    ]
+    assert (tmp_path / "ssh").is_dir()
+
+
+def test_git_ssh_command_persist(monkeypatch):
+    monkeypatch.setenv("OTOOLS_SSH_PERSIST", "10m")
+    assert "ControlPersist=10m" in (ssh.git_ssh_command() or "")
+
+
+@pytest.mark.parametrize(
+    "env",
+    [
+        {"OTOOLS_SSH_MULTIPLEXING": "0"},
+        {"GIT_SSH_COMMAND": "ssh -i ~/.ssh/other"},
+        {"GIT_SSH": "/usr/local/bin/my-ssh"},
+    ],
+)
+def test_git_ssh_command_disabled(monkeypatch, env):
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    assert ssh.git_ssh_command() is None
+    env_ssh_command = os_exec.get_venv(network=True).get("GIT_SSH_COMMAND")
+    assert env_ssh_command == env.get("GIT_SSH_COMMAND")
+
+
+def test_get_venv_sets_git_ssh_command():
+    env = os_exec.get_venv(network=True)
+    assert env["GIT_SSH_COMMAND"] == ssh.git_ssh_command()
+    # The environment of otools itself is left untouched
+    assert env is not ssh.os.environ
+    # Only the commands talking to a remote go through the shared connection
+    assert "GIT_SSH_COMMAND" not in os_exec.get_venv()
+
+
+def test_git_ssh_command_computed_once():
+    with (
+        mock.patch.object(ssh.Path, "mkdir") as mkdir,
+        mock.patch.object(ssh.shutil, "which", return_value="/usr/bin/ssh") as which,
+    ):
+        for __ in range(3):
+            os_exec.get_venv(network=True)
+    mkdir.assert_called_once()
+    which.assert_called_once()
+
+
+def test_run_shares_connection_of_network_commands_only():
+    with mock.patch.object(os_exec.subprocess, "run") as mock_run:
+        mock_run.return_value.stdout = b""
+        os_exec.run(["git", "status"])
+        os_exec.run(["git", "fetch", "origin"])
+    envs = [call.kwargs["env"] for call in mock_run.call_args_list]
+    assert "GIT_SSH_COMMAND" not in envs[0]
+    assert envs[1]["GIT_SSH_COMMAND"] == ssh.git_ssh_command()
+
+
+@pytest.mark.parametrize(
+    "cmd, expected",
+    [
+        (["git", "fetch", "OCA", "16.0"], True),
+        (["git", "-C", "/repo", "push", "origin", "HEAD"], True),
+        (["git", "ls-remote", "git@github.com:OCA/edi.git", "HEAD"], True),
+        (["git", "submodule", "update", "--init", "odoo/external-src/edi"], True),
+        (["gitaggregate", "--config", "edi.yml", "aggregate"], True),
+        (["git", "-C", "fetch", "log"], False),
+        (["git", "submodule", "sync"], False),
+        (["git", "status"], False),
+        (["ls", "-l"], False),
+        ([], False),
+    ],
+)
+def test_is_network_command(cmd, expected):
+    assert ssh._is_network_command(cmd) is expected
+
+
+def test_close_at_the_end_of_the_command(caplog):
+    @click.group()
+    @global_command_decorators
+    def cli():
+        pass
+
+    @cli.command()
+    def sub():
+        ssh.track(["git", "fetch", "origin"])
+        ssh.track(["git", "push", "origin"])
+        ssh.track(["git", "status"])
+        # Still open: the subcommand runs before the group's context is closed
+        assert mock_run.call_count == 0
+
+    with mock.patch.object(ssh.subprocess, "run") as mock_run:
+        mock_run.return_value.returncode = 0
+        with caplog.at_level("DEBUG", logger="odoo_tools"):
+            result = CliRunner().invoke(cli, ["sub"], catch_exceptions=False)
+    assert result.exit_code == 0
+    assert [call.args[0][-2:] for call in mock_run.call_args_list] == [
+        ["check", "git@github.com"],
+        ["exit", "git@github.com"],
+    ]
+    assert "2 git network command(s) ran while the SSH connection" in caplog.text
+
+
+def test_close_keeps_persistent_connection(monkeypatch):
+    monkeypatch.setenv("OTOOLS_SSH_PERSIST", "10m")
+    ssh.track(["git", "fetch", "origin"])
+    with mock.patch.object(ssh.subprocess, "run") as mock_run:
+        mock_run.return_value.returncode = 0
+        ssh.close()
+    assert [call.args[0][-2] for call in mock_run.call_args_list] == ["check"]
+
+
+def test_close_without_network_command():
+    with mock.patch.object(ssh.subprocess, "run") as mock_run:
+        ssh.close()
+    mock_run.assert_not_called()
@@ -189,3 +189,20 @@ def test_with_update_check_decorator_invokes_check():
 
     assert result == 5
     assert calls == ["checked"]
+
+
+def test_stale_cache_revalidates_release(cache_dir, mocked_releases):
+    mocked_releases.add(
+        responses.GET,
+        update_check.RELEASES_URL,
+        json={"tag_name": "1.2.3"},
+        headers={"ETag": '"abc"'},
+    )
+    assert update_check.get_latest_version() == "1.2.3"
+    stale = datetime.now() - timedelta(hours=25)
+    (cache_dir / update_check.CACHE_FILE_NAME).write_text(
+        json.dumps({"checked_at": stale.isoformat(), "latest_version": "1.2.3"})
+    )
+    mocked_releases.replace(responses.GET, update_check.RELEASES_URL, status=304)
+    assert update_check.get_latest_version() == "1.2.3"
+    assert mocked_releases.calls[1].request.headers["If-None-Match"] == '"abc"'
@@ -9,6 +9,9 @@ from ruamel.yaml import YAML
 
 from odoo_tools.utils.yaml import (
     append_seq_item_with_comments,
+    dump_document,
+    edit_seq_with_comments,
+    load_document,
     remove_seq_item_with_comments,
     sequence_item_indent,
     yaml,
@@ -647,3 +650,69 @@ class TestRuamelUpstreamCanary:
             """
         )
         assert result == expected
+
+
+def test_load_document_shared_until_changed(tmp_path):
+    path = tmp_path / "doc.yml"
+    path.write_text("key: value\n")
+    data = load_document(path)
+    assert load_document(path) is data
+    # Written by someone else
+    path.write_text("key: other value\n")
+    assert load_document(path) == {"key": "other value"}
+
+
+def test_dump_document_write_through(tmp_path):
+    path = tmp_path / "doc.yml"
+    path.write_text("# A comment\nkey: value\n")
+    data = load_document(path)
+    data["key"] = "new"
+    dump_document(path, data)
+    assert path.read_text() == "# A comment\nkey: new\n"
+    # Not parsed again after our own write
+    assert load_document(path) is data
+
+
+def test_edit_seq_with_comments_batch():
+    """Several removals and an append in one pass keep each survivor's
+    comments, like the same edits made one at a time."""
+    src = dedent(
+        """\
+        items:
+        # comment for a
+        - a
+        # comment for b
+        - b
+        - c  # eol for c
+        # comment for d
+        - d
+        """
+    )
+    yaml = YAML()
+    data = yaml.load(src)
+    edit_seq_with_comments(
+        data["items"], remove=["d", "a"], append=[("e", ["comment for e"])]
+    )
+    buf = io.StringIO()
+    yaml.dump(data, buf)
+    expected = dedent(
+        """\
+        items:
+        # comment for b
+        - b
+        - c  # eol for c
+        # comment for e
+        - e
+        """
+    )
+    assert buf.getvalue() == expected
+
+
+def test_dump_document_keeps_file_mode(tmp_path):
+    path = tmp_path / "doc.yml"
+    path.write_text("key: value\n")
+    path.chmod(0o664)
+    dump_document(path, {"key": "new"})
+    assert path.stat().st_mode & 0o777 == 0o664
+    # No temporary file left behind
+    assert [p.name for p in tmp_path.iterdir()] == ["doc.yml"]